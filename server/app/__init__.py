@@ -1,8 +1,30 @@
-from flask import Flask, request
+from flask import Flask, request, g
 from flask_cors import CORS
 from config import get_config
 from app.utils.database import mongo_db
 import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def init_background_workers(config):
+    """
+    启动本进程的后台线程 (每个进程调用，重复调用无副作用)
+    gunicorn --preload 时 create_app 在 master 进程中执行，线程不会被 fork 到 worker，
+    因此在 worker 处理请求时启动
+    """
+    # 预热实时语音识别连接，worker 的第一个实时会话也无需等待握手
+    if config.get('ASR_POOL_SIZE', 2) > 0:
+        from app.utils.asr_pool import get_asr_pool
+        get_asr_pool(config)
+
+    # 后台清理上传目录和临时文件
+    if config.get('JANITOR_ENABLED', True):
+        from app.utils.janitor import get_janitor
+        get_janitor(config)
+
 
 def create_app(env=None):
     """
@@ -22,8 +44,85 @@ def create_app(env=None):
     config = get_config(env)
     app.config.from_object(config)
 
+    # 在 app.logger 首次使用前接管日志，Flask 不再添加自己的 handler
+    from app.utils.logger import setup_logging
+    setup_logging(app.config)
+
+    # 签名URL密钥不可用时直接拒绝启动，不使用代码库中的默认密钥签名
+    from app.utils.signed_url import check_signing_key
+    check_signing_key(app.config)
+
     mongo_db.init_app(app)
 
+    @app.before_request
+    def start_background_workers():
+        init_background_workers(app.config)
+
+    @app.before_request
+    def set_deadline():
+        """为本次请求设置截止时间，客户端可通过 X-Request-Timeout 头(秒)缩短"""
+        from app.utils.resilience import set_request_deadline
+        deadline = app.config.get('REQUEST_DEADLINE', 60)
+        try:
+            deadline = min(deadline, float(request.headers.get('X-Request-Timeout', deadline)))
+        except ValueError:
+            pass
+        set_request_deadline(deadline)
+
+    if app.config.get('METRICS_ENABLED', True):
+        from app.utils.metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, init_metrics
+
+        @app.before_request
+        def start_timer():
+            # gunicorn --preload 时写入指标的线程要在 fork 之后的 worker 中启动
+            init_metrics(app.config)
+            request.environ['echotalk.start'] = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            """按蓝图和路由模板统计 (不用实际路径，避免 ID 等参数产生大量标签)"""
+            start = request.environ.get('echotalk.start')
+            if start is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                blueprint = request.blueprint or 'app'
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, blueprint=blueprint,
+                                             route=route, method=request.method)
+                HTTP_REQUESTS.inc(blueprint=blueprint, route=route, method=request.method,
+                                  status=str(response.status_code))
+            return response
+
+    if app.config.get('TRACING_ENABLED', False):
+        from app.utils.tracing import init_tracing, KIND_SERVER, activate, deactivate
+        tracer = init_tracing(app.config)
+
+        @app.before_request
+        def start_trace():
+            """每个 HTTP 请求一条 trace，沿用上游的 traceparent"""
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            root = tracer.start_trace(f"{request.method} {route}",
+                                      {'http.method': request.method, 'http.route': route},
+                                      traceparent=request.headers.get('traceparent'), kind=KIND_SERVER)
+            g.trace_root = root
+            g.trace_token = activate(root)
+
+        @app.teardown_request
+        def end_trace(exc):
+            root = g.pop('trace_root', None)
+            if root is None:
+                return
+            deactivate(g.pop('trace_token'))
+            if exc is not None:
+                root.record_exception(exc)
+            tracer.end_trace(root)
+
+        @app.after_request
+        def record_trace_status(response):
+            root = g.get('trace_root')
+            if root is not None:
+                root.set_attribute('http.status_code', response.status_code)
+                response.headers['X-Trace-Id'] = root.trace.trace_id
+            return response
+
     CORS(app, resources={
         r"/api/*": {
             "origins": "*",
@@ -40,6 +139,8 @@ def create_app(env=None):
     from app.routes.voice import voice_bp
     from app.routes.test_voice import test_voice_bp
     from app.routes.admin import admin_bp
+    from app.routes.media import media_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(session_bp, url_prefix='/api/session')
@@ -48,6 +149,9 @@ def create_app(env=None):
     app.register_blueprint(voice_bp, url_prefix='/api/voice')
     app.register_blueprint(test_voice_bp)
     app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(media_bp, url_prefix='/api/media')
+    if app.config.get('METRICS_ENABLED', True):
+        app.register_blueprint(metrics_bp)
 
     @app.route('/health')
     def health_check():
@@ -80,13 +184,12 @@ def websocket_app(environ, start_response):
     """
     WebSocket 应用 - 处理 WebSocket 连接
     """
-    import sys
     from geventwebsocket import WebSocketError
     
     path = environ.get('PATH_INFO', '')
     
     if path.startswith('/ws/realtime/'):
-        print(f"[WS] 收到WebSocket请求: {path}", file=sys.stderr, flush=True)
+        logger.debug(f"[WS] 收到WebSocket请求: {path}")
         
         ws = environ.get('wsgi.websocket')
         if ws:
@@ -94,7 +197,6 @@ def websocket_app(environ, start_response):
             if len(parts) >= 5:
                 session_id = parts[3]
                 open_id = parts[4]
-                print(f"[WS] session_id={session_id}, open_id={open_id}", file=sys.stderr, flush=True)
                 
                 from app.routes.realtime import handle_websocket
                 handle_websocket(ws, session_id, open_id)
@@ -1,7 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, jsonify, Response
 from functools import wraps
 from datetime import datetime, timedelta
 from app.utils.database import mysql_db, mongo_db
+from app.utils.prompt_builder import usage_tracker
+from app.utils.speculation import speculation_stats
+from app.utils.session_recorder import recorder_stats
 import os
 
 admin_bp = Blueprint('admin', __name__, template_folder='../templates/admin')
@@ -388,3 +391,125 @@ def delete_article(article_id):
         flash('删除文章失败', 'danger')
     
     return redirect(url_for('admin.articles'))
+
+@admin_bp.route('/usage')
+@login_required
+def usage():
+    """大模型调用 token 用量与耗时统计 (JSON，供看板使用)"""
+    from app.utils.bailian_client import bailian_client
+    data = usage_tracker.snapshot()
+    router = bailian_client.router
+    data['router'] = router.snapshot() if router else None
+    data['speculation'] = speculation_stats.snapshot()
+    data['recording'] = recorder_stats.snapshot()
+    transcoder = bailian_client.transcoder
+    data['transcode'] = transcoder.snapshot() if transcoder else None
+    return jsonify(data)
+
+@admin_bp.route('/quota')
+@login_required
+def quota():
+    """百炼平台配额使用情况 (JSON)"""
+    from app.utils.rate_limiter import get_rate_limiter
+    from app.utils.resilience import breaker_states
+    from app.utils.asr_pool import asr_pool_snapshot
+    from app.utils.tts_pool import synthesizer_pool_snapshot
+    return jsonify({
+        'quota': get_rate_limiter(current_app.config).utilization(),
+        'breakers': breaker_states(),
+        'asr_pool': asr_pool_snapshot(),
+        'tts_pool': synthesizer_pool_snapshot()
+    })
+
+@admin_bp.route('/traces')
+@login_required
+def traces():
+    """链路追踪统计和最近的慢 trace (JSON)"""
+    from app.utils.tracing import tracing_snapshot
+    return jsonify(tracing_snapshot())
+
+def _seconds_arg(default: float) -> float:
+    """读取 seconds 参数，限制在 0 到 PROFILER_MAX_SECONDS 之间"""
+    try:
+        seconds = float(request.args.get('seconds', default))
+    except ValueError:
+        seconds = default
+    return max(0.0, min(seconds, current_app.config.get('PROFILER_MAX_SECONDS', 60)))
+
+@admin_bp.route('/profile')
+@login_required
+def profile():
+    """
+    对处理本请求的 worker 采样剖析 seconds 秒 (默认 10)
+
+    format: collapsed 折叠栈文本 (默认) / svg 火焰图 / json 热点函数
+    """
+    from app.utils.profiler import profile as run_profile, ProfilerBusy
+    if not current_app.config.get('PROFILER_ENABLED', True):
+        return jsonify({'error': '性能剖析未开启'}), 404
+    seconds = _seconds_arg(10) or 1
+    try:
+        interval = max(1, int(request.args.get('interval_ms', current_app.config.get('PROFILER_INTERVAL_MS', 10))))
+    except ValueError:
+        interval = current_app.config.get('PROFILER_INTERVAL_MS', 10)
+    try:
+        profiler = run_profile(seconds, interval=interval / 1000)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+
+    fmt = request.args.get('format', 'collapsed')
+    if fmt == 'json':
+        return jsonify({'pid': os.getpid(), 'samples': profiler.samples, 'duration': round(profiler.duration, 3),
+                        'top': profiler.top()})
+    filename = f"profile-{os.getpid()}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    if fmt == 'svg':
+        response = Response(profiler.flamegraph(title=f"EchoTalk pid {os.getpid()}"), mimetype='image/svg+xml')
+        filename += '.svg'
+    else:
+        response = Response(profiler.collapsed(), mimetype='text/plain')
+        filename += '.collapsed.txt'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@admin_bp.route('/profile/blocking')
+@login_required
+def profile_blocking():
+    """
+    检测阻塞 gevent 事件循环的协程 (JSON)
+
+    seconds=0 (默认) 返回已开启的检测的最近记录；seconds>0 时开启检测 seconds 秒 (阈值 threshold_ms)，
+    返回这段时间内的阻塞记录，之后恢复原来的状态
+    """
+    import time
+    from app.utils.profiler import get_blocking_monitor, blocking_monitor_snapshot, wait
+    if not current_app.config.get('PROFILER_ENABLED', True):
+        return jsonify({'error': '性能剖析未开启'}), 404
+    seconds = _seconds_arg(0)
+    if not seconds:
+        return jsonify({'pid': os.getpid(), 'monitor': blocking_monitor_snapshot()})
+
+    from gevent._hub_local import get_hub_if_exists
+    if get_hub_if_exists() is None:
+        return jsonify({'error': '当前 worker 不是 gevent 服务器，没有事件循环可检测'}), 400
+    monitor = get_blocking_monitor(current_app.config)
+    started_here = not monitor.running
+    if started_here:
+        try:
+            monitor.threshold = max(1, int(request.args.get('threshold_ms', monitor.threshold * 1000))) / 1000
+        except ValueError:
+            pass
+        monitor.start()
+    since = time.perf_counter()
+    try:
+        wait(seconds)
+    finally:
+        if started_here:
+            monitor.stop()
+    return jsonify({'pid': os.getpid(), 'seconds': seconds, 'monitor': monitor.snapshot(since=since)})
+
+@admin_bp.route('/storage')
+@login_required
+def storage_usage():
+    """磁盘清理统计：各目录大小、已清理的文件数和回收的字节数 (JSON)"""
+    from app.utils.janitor import janitor_snapshot
+    return jsonify({'janitor': janitor_snapshot()})
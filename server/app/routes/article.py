@@ -1,9 +1,12 @@
+import logging
 from flask import Blueprint, request
 from datetime import datetime
 from app.utils.database import mysql_db, mongo_db
 from app.utils.ai_service import ai_service
 from app.utils.response import success, error
 
+logger = logging.getLogger(__name__)
+
 article_bp = Blueprint('article', __name__)
 
 @article_bp.route('/generate', methods=['POST'])
@@ -85,7 +88,7 @@ def generate_article():
         })
 
     except Exception as e:
-        print(f'生成文章失败: {e}')
+        logger.exception(f'生成文章失败: {e}')
         return error('生成文章失败')
 
 @article_bp.route('/<int:article_id>', methods=['GET'])
@@ -113,7 +116,7 @@ def get_article(article_id):
         })
 
     except Exception as e:
-        print(f'获取文章失败: {e}')
+        logger.exception(f'获取文章失败: {e}')
         return error('获取文章失败')
 
 @article_bp.route('/<int:article_id>', methods=['PUT'])
@@ -138,7 +141,7 @@ def update_article(article_id):
         return success(message='文章已更新')
 
     except Exception as e:
-        print(f'更新文章失败: {e}')
+        logger.exception(f'更新文章失败: {e}')
         return error('更新文章失败')
 
 @article_bp.route('/<int:article_id>/save', methods=['POST'])
@@ -170,7 +173,7 @@ def save_article(article_id):
         return success(message='文章已保存')
 
     except Exception as e:
-        print(f'保存文章失败: {e}')
+        logger.exception(f'保存文章失败: {e}')
         return error('保存文章失败')
 
 @article_bp.route('/user/<open_id>', methods=['GET'])
@@ -216,5 +219,5 @@ def get_user_articles(open_id):
         })
 
     except Exception as e:
-        print(f'获取文章列表失败: {e}')
+        logger.exception(f'获取文章列表失败: {e}')
         return error('获取文章列表失败')
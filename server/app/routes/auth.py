@@ -1,8 +1,11 @@
 from flask import Blueprint, request
 import requests
+import logging
 from app.utils.database import mysql_db
 from app.utils.response import success, error
 
+logger = logging.getLogger(__name__)
+
 auth_bp = Blueprint('auth', __name__)
 
 @auth_bp.route('/login', methods=['POST'])
@@ -62,5 +65,5 @@ def login():
         })
 
     except Exception as e:
-        print(f'登录失败: {e}')
+        logger.exception(f'登录失败: {e}')
         return error('登录失败')
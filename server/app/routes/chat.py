@@ -1,9 +1,12 @@
-from flask import Blueprint, request
+import logging
+from flask import Blueprint, request, current_app
 from datetime import datetime
 from app.utils.database import mysql_db, mongo_db
 from app.utils.ai_service import ai_service
 from app.utils.response import success, error
 
+logger = logging.getLogger(__name__)
+
 chat_bp = Blueprint('chat', __name__)
 
 @chat_bp.route('/message', methods=['POST'])
@@ -48,7 +51,7 @@ def send_message():
         history = list(chat_collection.find(
             {'session_id': session_id},
             {'_id': 0, 'role': 1, 'content': 1}
-        ).sort('timestamp', -1).limit(10))
+        ).sort('timestamp', -1).limit(current_app.config.get('CHAT_CONTEXT_WINDOW', 10)))
 
         history.reverse()
 
@@ -74,7 +77,7 @@ def send_message():
         })
 
     except Exception as e:
-        print(f'发送消息失败: {e}')
+        logger.exception(f'发送消息失败: {e}')
         return error('发送消息失败')
 
 @chat_bp.route('/history/<int:session_id>', methods=['GET'])
@@ -99,5 +102,5 @@ def get_chat_history(session_id):
         })
 
     except Exception as e:
-        print(f'获取聊天记录失败: {e}')
+        logger.exception(f'获取聊天记录失败: {e}')
         return error('获取聊天记录失败')
@@ -0,0 +1,33 @@
+from flask import Blueprint, request, current_app, send_from_directory, Response
+from werkzeug.security import safe_join
+from app.utils.response import error
+from app.utils.signed_url import verify, storage_root
+from urllib.parse import quote
+import mimetypes
+import os
+
+media_bp = Blueprint('media', __name__)
+
+
+@media_bp.route('/<path:filename>', methods=['GET', 'HEAD'])
+def get_media(filename):
+    """
+    通过签名URL读取上传目录中的文件
+    启用 X-Accel-Redirect 时由 nginx 以 sendfile 直接返回文件内容，应用进程不读取文件
+    """
+    if not verify(filename, request.args.get('e'), request.args.get('s')):
+        return error('链接无效或已过期', code=403), 403
+
+    root = storage_root()
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        return error('文件不存在', code=404), 404
+
+    accel_prefix = current_app.config.get('X_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(filename)}"
+        return response
+
+    return send_from_directory(root, filename, conditional=True)
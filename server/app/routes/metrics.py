@@ -0,0 +1,18 @@
+from flask import Blueprint, request, current_app, Response
+from app.utils.metrics import generate_latest, init_metrics
+import hmac
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """
+    Prometheus 抓取接口
+    配置 METRICS_DIR 时合并所有 worker 的指标，否则只有处理本次请求的进程的指标
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    init_metrics(current_app.config)
+    return Response(generate_latest(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,13 +4,25 @@
 """
 import json
 import base64
+import logging
 import time
 import threading
-import websocket
 from datetime import datetime
+from flask import current_app
 from app.utils.bailian_client import bailian_client
 from app.utils.database import mysql_db, mongo_db
 from app.utils.ai_service import ai_service
+from app.utils.resilience import deadline_scope
+from app.utils.rate_limiter import get_rate_limiter, RateLimitTimeout
+from app.utils.utterance import UtteranceAssembler
+from app.utils.speculation import Speculator
+from app.utils.session_recorder import SessionRecorder
+from app.utils.audio_transcoder import get_audio_transcoder
+from app.utils.storage import get_storage
+from app.utils.metrics import REALTIME_TURN_SECONDS, REALTIME_SESSIONS, REALTIME_TURNS_IN_FLIGHT
+from app.utils.tracing import trace, span, add_span, ns_ago
+
+logger = logging.getLogger(__name__)
 
 active_sessions = {}
 
@@ -18,12 +30,12 @@ def handle_websocket(ws, session_id, open_id):
     """
     处理 WebSocket 连接
     """
-    print(f"[WS] 新连接: session_id={session_id}, open_id={open_id}")
+    logger.info("[WS] 新连接: session_id=%s", session_id)
     
     try:
         session_id = int(session_id)
     except (TypeError, ValueError):
-        print(f"[WS] 无效的会话ID: {session_id}")
+        logger.warning("[WS] 无效的会话ID: %s", session_id)
         ws.send(json.dumps({'type': 'error', 'message': '无效的会话ID'}))
         return
     
@@ -31,197 +43,284 @@ def handle_websocket(ws, session_id, open_id):
     user = mysql_db.execute(user_sql, (open_id,), fetchone=True)
     
     if not user:
-        print(f"[WS] 用户不存在: {open_id}")
+        logger.warning("[WS] 用户不存在: session_id=%s", session_id)
         ws.send(json.dumps({'type': 'error', 'message': '用户不存在'}))
         return
     
     user_id = user['id']
-    print(f"[WS] 用户ID: {user_id}")
+    logger.debug("[WS] 用户ID: %s", user_id)
     
-    accumulated_text = ""
-    last_audio_time = time.time()
+    # 后台线程中没有应用上下文，需要显式传递
+    app = current_app._get_current_object()
+    context_window = app.config.get('CHAT_CONTEXT_WINDOW', 10)
+    slow_turn_ms = app.config.get('TRACING_SLOW_TURN_MS', 5000)
+    utterance = UtteranceAssembler(
+        grace_ms=app.config.get('TURN_GRACE_MS', 300),
+        silence_ms=app.config.get('TURN_SILENCE_MS', 1500)
+    )
     is_running = True
-    asr_ws = None
+    asr_stream = None
+    turns_in_flight = 0
+    # 最近一次收到识别结果的时间，用于统计说完到判定话轮结束的等待
+    last_asr_at = None
     
-    def process_ai_response(text):
-        nonlocal is_running
+    # 按话轮保存用户的录音，回填到对应发言的 voice_relation_id
+    recorder = None
+    if app.config.get('RECORD_REALTIME', True):
+        recorder = SessionRecorder(
+            app, get_storage(app.config), get_audio_transcoder(app.config), user_id, session_id,
+            sample_rate=app.config.get('ASR_SAMPLE_RATE', 16000),
+            bitrate_kbps=app.config.get('RECORD_BITRATE', 32),
+            max_segment_seconds=app.config.get('RECORD_MAX_SEGMENT_SECONDS', 60),
+            max_pending=app.config.get('RECORD_MAX_PENDING', 4),
+            workers=app.config.get('RECORD_WORKERS', 2)
+        )
+    
+    def build_history(text, before=None):
+        """之前的对话加上本轮发言 (before 之后的记录不计入上文)"""
+        query = {'session_id': session_id}
+        if before:
+            query['timestamp'] = {'$lt': before}
+        history = []
+        if context_window > 1:
+            history = list(mongo_db.get_collection('chat_log').find(
+                query,
+                {'_id': 0, 'role': 1, 'content': 1}
+            ).sort('timestamp', -1).limit(context_window - 1))
+            history.reverse()
+        history.append({'role': 'user', 'content': text})
+        return history
+    
+    def generate_reply(text, before=None):
+        """根据之前的对话和本轮发言生成追问"""
+        return ai_service.generate_followup_question(build_history(text, before))
+    
+    # 投机生成使用的上文，结果被采用时据此写入追问缓存
+    speculation_histories = {}
+    
+    def speculate_reply(text):
+        """投机生成追问，结果可能作废，不写入追问缓存"""
+        history = build_history(text)
+        if len(speculation_histories) >= 8:
+            # 作废的投机不会被领取，定期清理
+            speculation_histories.clear()
+        speculation_histories[text] = history
+        return ai_service.generate_followup_question(history, cache_result=False)
+    
+    def commit_speculation(text, reply):
+        history = speculation_histories.get(text)
+        speculation_histories.clear()
+        if history:
+            ai_service.cache_followup(history, reply)
+    
+    def send_json(payload):
+        with span('ws.send', type=payload['type']):
+            ws.send(json.dumps(payload))
+    
+    def process_ai_response(text, segment=None, ended_at=None):
+        nonlocal is_running, turns_in_flight
         if not is_running or not text.strip():
+            speculator.cancel()
             return
             
-        print(f"[AI] 处理用户输入: {text}")
+        logger.debug("[AI] 处理用户输入: %s", text)
+        turns_in_flight += 1
+        REALTIME_TURNS_IN_FLIGHT.inc()
+        ended_at = ended_at or time.perf_counter()
         
+        # 一个话轮一条 trace，从最后一次收到识别结果开始计时
+        now = time.perf_counter()
+        turn_started = min(last_asr_at or ended_at, ended_at)
         try:
-            ws.send(json.dumps({'type': 'user_speech', 'text': text}))
+            with trace('realtime.turn', {'session_id': session_id, 'chars': len(text)},
+                       start_ns=ns_ago(now - turn_started), slow_ms=slow_turn_ms):
+                add_span('vad_wait', ns_ago(now - turn_started), ns_ago(now - ended_at))
+                send_json({'type': 'user_speech', 'text': text})
             
-            chat_collection = mongo_db.get_collection('chat_log')
-            user_msg_doc = {
-                'user_id': user_id,
-                'session_id': session_id,
-                'role': 'user',
-                'content': text,
-                'timestamp': datetime.now(),
-                'voice_relation_id': None
-            }
-            chat_collection.insert_one(user_msg_doc)
-            
-            history = list(chat_collection.find(
-                {'session_id': session_id},
-                {'_id': 0, 'role': 1, 'content': 1}
-            ).sort('timestamp', -1).limit(10))
-            history.reverse()
+                chat_collection = mongo_db.get_collection('chat_log')
+                user_msg_doc = {
+                    'user_id': user_id,
+                    'session_id': session_id,
+                    'role': 'user',
+                    'content': text,
+                    'timestamp': datetime.now(),
+                    'voice_relation_id': None
+                }
+                chat_collection.insert_one(user_msg_doc)
+                if recorder:
+                    recorder.link(segment, user_msg_doc['_id'])
             
-            ai_response = ai_service.generate_followup_question(history)
+                # 用户说完前已按相同文本投机生成的，直接采用
+                with span('speculation.take') as take_span:
+                    ai_response = speculator.take(text)
+                    take_span.set_attribute('hit', bool(ai_response))
+                ai_response = ai_response or generate_reply(text, before=user_msg_doc['timestamp'])
+                # 追问为非流式生成，没有单独的首 token 时间 (流式对话的首 token 见 echotalk_llm_first_token_seconds)
+                REALTIME_TURN_SECONDS.observe(time.perf_counter() - ended_at, stage='llm_total')
             
-            if not ai_response:
-                ai_response = '嗯，我在听，您继续讲。'
+                if not ai_response:
+                    ai_response = '嗯，我在听，您继续讲。'
             
-            ai_msg_doc = {
-                'user_id': user_id,
-                'session_id': session_id,
-                'role': 'ai',
-                'content': ai_response,
-                'timestamp': datetime.now(),
-                'voice_relation_id': None
-            }
-            chat_collection.insert_one(ai_msg_doc)
+                ai_msg_doc = {
+                    'user_id': user_id,
+                    'session_id': session_id,
+                    'role': 'ai',
+                    'content': ai_response,
+                    'timestamp': datetime.now(),
+                    'voice_relation_id': None
+                }
+                chat_collection.insert_one(ai_msg_doc)
             
-            ws.send(json.dumps({'type': 'ai_response', 'text': ai_response}))
+                send_json({'type': 'ai_response', 'text': ai_response})
             
-            try:
-                import tempfile
-                import os
+                try:
+                    # 流式合成直接在内存中收集音频块，不再经过临时文件
+                    tts_started = time.perf_counter()
+                    chunks = []
+                    with span('tts', chars=len(ai_response)) as tts_span:
+                        for chunk in bailian_client.iter_text_to_speech(ai_response):
+                            if not chunks:
+                                first_byte = time.perf_counter() - tts_started
+                                REALTIME_TURN_SECONDS.observe(first_byte, stage='tts_first_byte')
+                                tts_span.set_attribute('first_byte_ms', round(first_byte * 1000, 1))
+                            chunks.append(chunk)
+                    REALTIME_TURN_SECONDS.observe(time.perf_counter() - tts_started, stage='tts_total')
                 
-                audio_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-                audio_path = audio_file.name
-                audio_file.close()
-                
-                result = bailian_client.text_to_speech(
-                    text=ai_response,
-                    output_path=audio_path
-                )
-                
-                if result and os.path.exists(audio_path):
-                    with open(audio_path, 'rb') as f:
-                        audio_data = f.read()
-                        audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                        ws.send(json.dumps({'type': 'ai_audio', 'audio': audio_base64}))
-                    
-                    os.unlink(audio_path)
-                    ws.send(json.dumps({'type': 'ai_audio_complete', 'message': '语音合成完成'}))
-                else:
-                    print(f"[TTS] 语音合成失败")
-            except Exception as tts_err:
-                print(f"[TTS] 语音合成异常: {tts_err}")
+                    if chunks:
+                        audio_base64 = base64.b64encode(b''.join(chunks)).decode('utf-8')
+                        send_json({'type': 'ai_audio', 'audio': audio_base64})
+                        send_json({'type': 'ai_audio_complete', 'message': '语音合成完成'})
+                    else:
+                        logger.warning("[TTS] 语音合成失败")
+                except Exception as tts_err:
+                    logger.error("[TTS] 语音合成异常: %s", tts_err)
                 
         except Exception as e:
-            print(f"[AI] 处理失败: {e}")
+            logger.exception("[AI] 处理失败: %s", e)
+        finally:
+            turns_in_flight -= 1
+            REALTIME_TURNS_IN_FLIGHT.dec()
     
-    def on_asr_message(ws_asr, message):
-        nonlocal accumulated_text, last_audio_time
-        try:
-            result = json.loads(message)
-            print(f"[ASR] 收到消息: {result}")
-            
-            if 'payload' in result:
-                payload = result['payload']
-                if 'sentence' in payload:
-                    sentence = payload['sentence']
-                    text = sentence.get('text', '')
-                    if text:
-                        print(f"[ASR] 识别文本: {text}")
-                        accumulated_text = text
-                        last_audio_time = time.time()
-        except Exception as e:
-            print(f"[ASR] 解析消息失败: {e}")
+    def run_in_app_context(func, *args):
+        with app.app_context(), deadline_scope(app.config.get('REQUEST_DEADLINE', 60)):
+            return func(*args)
     
-    def on_asr_error(ws_asr, error):
-        print(f"[ASR] 错误: {error}")
+    # 用户还在说话时，按稳定的识别文本提前生成追问
+    speculator = Speculator(
+        lambda text: run_in_app_context(speculate_reply, text),
+        stable_ms=app.config.get('SPECULATE_STABLE_MS', 250),
+        min_chars=app.config.get('SPECULATE_MIN_CHARS', 4),
+        on_commit=commit_speculation
+    )
+    speculation_enabled = app.config.get('SPECULATE_ENABLED', True)
     
-    def on_asr_close(ws_asr, close_status_code, close_msg):
-        print(f"[ASR] 连接关闭: {close_status_code} {close_msg}")
+    def on_asr_partial(result):
+        nonlocal last_asr_at
+        last_asr_at = time.perf_counter()
+        utterance.add_partial(result.text)
     
-    def check_silence():
-        nonlocal accumulated_text, last_audio_time, is_running
+    def on_asr_final(result):
+        nonlocal last_asr_at
+        last_asr_at = time.perf_counter()
+        logger.debug("[ASR] 识别句子: %s", result.text)
+        utterance.add_final(result.text)
+    
+    def on_asr_error(message):
+        logger.error("[ASR] 错误: %s", message)
+        try:
+            ws.send(json.dumps({'type': 'error', 'message': '语音识别连接已断开'}))
+        except Exception:
+            pass
+    
+    def renew_asr_lease():
+        """实时识别的并发租约按 lease_ttl 过期，会话期间每 lease_ttl/3 续期一次"""
+        nonlocal lease_renewed_at
+        if time.time() - lease_renewed_at < rate_limiter.lease_ttl / 3:
+            return
+        lease_renewed_at = time.time()
+        try:
+            if not rate_limiter.renew('asr_realtime', asr_lease):
+                logger.warning("[WS] 实时语音识别并发租约已过期: session_id=%s", session_id)
+        except Exception as e:
+            logger.warning("[WS] 续期实时语音识别并发租约失败: %s", e)
+    
+    def check_turn_end():
+        nonlocal is_running
         
         while is_running:
-            time.sleep(0.3)
+            time.sleep(0.05)
             
             if not is_running:
                 return
-                
-            current_time = time.time()
-            time_since_last_audio = current_time - last_audio_time
             
-            if accumulated_text and time_since_last_audio >= 1.5:
-                print(f"[VAD] 检测到静音，处理文本: {accumulated_text}")
-                text_to_process = accumulated_text
-                accumulated_text = ""
-                
-                threading.Thread(target=process_ai_response, args=(text_to_process,), daemon=True).start()
+            renew_asr_lease()
+            
+            text_to_process = utterance.poll()
+            if not text_to_process:
+                # 上一轮还在处理时上文会变化，不投机
+                if speculation_enabled and not turns_in_flight:
+                    speculator.observe(utterance.text)
+                continue
+            
+            logger.debug("[VAD] 话轮结束，处理文本: %s", text_to_process)
+            ended_at = time.perf_counter()
+            if last_asr_at is not None:
+                REALTIME_TURN_SECONDS.observe(ended_at - last_asr_at, stage='vad_wait')
+            segment = recorder.cut() if recorder else None
+            threading.Thread(target=run_in_app_context,
+                             args=(process_ai_response, text_to_process, segment, ended_at),
+                             daemon=True).start()
     
+    # 实时语音识别按会话占用一个并发连接配额
+    rate_limiter = get_rate_limiter(app.config)
     try:
-        import dashscope
-        api_key = bailian_client.api_key
-        
-        asr_url = f"wss://dashscope.aliyuncs.com/api-ws/v1/inference/asr/paraformer-realtime-v2?api-key={api_key}"
-        
-        print(f"[ASR] 连接到阿里云ASR服务...")
-        
-        asr_ws = websocket.WebSocketApp(
-            asr_url,
-            on_message=on_asr_message,
-            on_error=on_asr_error,
-            on_close=on_asr_close
+        asr_lease = rate_limiter.acquire('asr_realtime')
+        lease_renewed_at = time.time()
+    except RateLimitTimeout:
+        logger.warning("[WS] 实时语音识别并发已满")
+        ws.send(json.dumps({'type': 'error', 'message': '当前使用人数较多，请稍后再试'}))
+        return
+    
+    try:
+        asr_stream = bailian_client.create_streaming_asr(
+            on_partial=on_asr_partial,
+            on_final=on_asr_final,
+            on_error=on_asr_error
         )
+        asr_stream.start()
         
-        def on_asr_open(ws_asr):
-            print(f"[ASR] 连接已打开")
-            header = {
-                "header": {
-                    "action": "start",
-                    "streaming": "duplex"
-                },
-                "payload": {
-                    "format": "pcm",
-                    "sample_rate": 16000,
-                    "language_hints": ["zh", "en"]
-                }
-            }
-            ws_asr.send(json.dumps(header))
-            print(f"[ASR] 已发送开始消息")
-        
-        asr_ws.on_open = on_asr_open
-        
-        asr_thread = threading.Thread(target=asr_ws.run_forever, daemon=True)
-        asr_thread.start()
-        
-        time.sleep(0.5)
+        # 连接打开并发送开始消息后才通知客户端开始说话
+        if not asr_stream.wait_open():
+            raise ConnectionError('语音识别连接未就绪')
+        logger.debug("[ASR] 连接已就绪")
         
         ws.send(json.dumps({'type': 'session_started', 'message': '实时对话已开始'}))
         
-        silence_thread = threading.Thread(target=check_silence, daemon=True)
-        silence_thread.start()
+        turn_thread = threading.Thread(target=check_turn_end, daemon=True)
+        turn_thread.start()
         
-        print(f"[WS] 实时对话已开始")
+        logger.info("[WS] 实时对话已开始: session_id=%s", session_id)
         
     except Exception as e:
-        print(f"[ASR] 创建连接失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[ASR] 创建连接失败: %s", e)
+        if asr_stream:
+            asr_stream.close()
+        rate_limiter.release('asr_realtime', asr_lease)
         ws.send(json.dumps({'type': 'error', 'message': '创建语音识别连接失败'}))
         return
     
+    REALTIME_SESSIONS.inc()
     try:
         audio_frame_count = 0
         while True:
             try:
                 message = ws.receive()
             except Exception as recv_err:
-                print(f"[WS] 接收消息异常: {recv_err}")
+                logger.warning("[WS] 接收消息异常: %s", recv_err)
                 break
                 
             if message is None:
-                print(f"[WS] 收到空消息，连接关闭")
+                logger.debug("[WS] 收到空消息，连接关闭")
                 break
             
             try:
@@ -230,47 +329,41 @@ def handle_websocket(ws, session_id, open_id):
                 
                 if msg_type == 'audio_frame':
                     audio_base64 = data.get('audio')
-                    if audio_base64 and asr_ws:
+                    if audio_base64 and asr_stream:
                         audio_data = base64.b64decode(audio_base64)
                         audio_frame_count += 1
-                        last_audio_time = time.time()
-                        if audio_frame_count % 10 == 0:
-                            print(f"[WS] 收到音频帧 #{audio_frame_count}, 大小: {len(audio_data)} bytes")
+                        logger.debug("[WS] 收到音频帧 #%d, 大小: %d bytes", audio_frame_count, len(audio_data),
+                                     extra={'rate_key': 'ws.audio_frame'})
                         
-                        audio_message = {
-                            "header": {
-                                "action": "send_audio"
-                            },
-                            "payload": {
-                                "audio": audio_base64
-                            }
-                        }
-                        asr_ws.send(json.dumps(audio_message))
+                        asr_stream.send_audio(audio_data)
+                        if recorder:
+                            recorder.append(audio_data)
                 
                 elif msg_type == 'stop_session':
-                    print(f"[WS] 收到停止会话请求")
-                    if accumulated_text:
-                        process_ai_response(accumulated_text)
-                        accumulated_text = ""
+                    logger.debug("[WS] 收到停止会话请求")
+                    remaining_text = utterance.flush()
+                    if remaining_text:
+                        segment = recorder.cut() if recorder else None
+                        run_in_app_context(process_ai_response, remaining_text, segment)
                     break
                 
                 elif msg_type == 'user_interrupt':
-                    print(f"[WS] 收到打断请求")
+                    logger.debug("[WS] 收到打断请求")
                     ws.send(json.dumps({'type': 'interrupt_ack', 'message': '已停止AI播放'}))
                     
             except json.JSONDecodeError:
-                print(f"[WS] 无效的JSON消息")
+                logger.warning("[WS] 无效的JSON消息")
                 
     except Exception as e:
-        print(f"[WS] 连接异常: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[WS] 连接异常: %s", e)
     
     finally:
         is_running = False
-        if asr_ws:
-            try:
-                asr_ws.close()
-            except:
-                pass
-        print(f"[WS] 连接关闭: session_id={session_id}")
+        speculator.cancel()
+        if asr_stream:
+            asr_stream.close()
+        if recorder:
+            recorder.close()
+        rate_limiter.release('asr_realtime', asr_lease)
+        REALTIME_SESSIONS.dec()
+        logger.info("[WS] 连接关闭: session_id=%s, 音频帧 %d", session_id, audio_frame_count)
@@ -1,7 +1,10 @@
+import logging
 from flask import Blueprint, request
 from app.utils.database import mysql_db
 from app.utils.response import success, error
 
+logger = logging.getLogger(__name__)
+
 session_bp = Blueprint('session', __name__)
 
 @session_bp.route('/create', methods=['POST'])
@@ -47,7 +50,7 @@ def create_session():
         })
 
     except Exception as e:
-        print(f'创建会话失败: {e}')
+        logger.exception(f'创建会话失败: {e}')
         return error('创建会话失败')
 
 @session_bp.route('/<int:session_id>', methods=['GET'])
@@ -67,7 +70,7 @@ def get_session(session_id):
         })
 
     except Exception as e:
-        print(f'获取会话失败: {e}')
+        logger.exception(f'获取会话失败: {e}')
         return error('获取会话失败')
 
 @session_bp.route('/<int:session_id>/end', methods=['POST'])
@@ -86,5 +89,5 @@ def end_session(session_id):
         return success(message='会话已结束')
 
     except Exception as e:
-        print(f'结束会话失败: {e}')
+        logger.exception(f'结束会话失败: {e}')
         return error('结束会话失败')
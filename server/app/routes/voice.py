@@ -1,10 +1,17 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app, Response, send_file, stream_with_context
 import os
+import re
+import time
 import uuid
+import hashlib
+import logging
 from datetime import datetime
 from app.utils.database import mysql_db
 from app.utils.response import success, error
 from app.utils.bailian_client import bailian_client
+from app.utils.storage import get_storage, TeeReader
+
+logger = logging.getLogger(__name__)
 
 voice_bp = Blueprint('voice', __name__)
 
@@ -17,34 +24,44 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def upload_voice():
     """
     上传语音文件
-    1. 保存语音文件到本地
+    1. 流式写入存储 (本地或对象存储)
     2. 调用语音识别API转文字
     3. 保存语音记录到数据库
     4. 返回识别结果
     """
-    if 'voice' not in request.files:
+    # 两种上传方式：multipart 表单 (voice 字段)，或请求体直接是音频 (Content-Type: audio/*，参数放在 URL 中)
+    if 'voice' in request.files:
+        voice_file = request.files['voice']
+        voice_stream = voice_file.stream
+        content_type = voice_file.mimetype or 'application/octet-stream'
+        file_ext = voice_file.filename.split('.')[-1] if '.' in voice_file.filename else 'webm'
+        session_id = request.form.get('session_id')
+        open_id = request.form.get('open_id')
+    elif (request.mimetype or '').startswith('audio/'):
+        voice_stream = request.stream
+        content_type = request.mimetype
+        file_ext = request.args.get('format') or request.mimetype.split('/')[-1]
+        session_id = request.args.get('session_id')
+        open_id = request.args.get('open_id')
+    else:
         return error('没有上传语音文件')
 
-    voice_file = request.files['voice']
-    session_id = request.form.get('session_id')
-    open_id = request.form.get('open_id')
-
     if not all([session_id, open_id]):
         return error('缺少必要参数')
 
+    # 扩展名只保留字母数字，避免拼出非法路径
+    file_ext = re.sub(r'[^0-9A-Za-z]', '', file_ext)[:8] or 'webm'
+    file_path = None
+    remote_copy = False
+    storage = None
+    storage_key = None
+    # 识别和保存记录都成功后才保留已写入存储的文件，其它情况删除，避免留下无人引用的对象
+    keep = False
     try:
         # 将 session_id 转换为整数，确保类型一致
         session_id = int(session_id)
-        
-        # 生成文件名
-        file_ext = voice_file.filename.split('.')[-1] if '.' in voice_file.filename else 'webm'
-        file_name = f"{uuid.uuid4().hex}.{file_ext}"
-        file_path = os.path.join(UPLOAD_FOLDER, file_name)
-
-        # 保存文件到本地
-        voice_file.save(file_path)
 
-        # 查询用户ID
+        # 先校验用户再写入存储
         user_sql = 'SELECT id FROM user WHERE open_id = %s'
         user = mysql_db.execute(user_sql, (open_id,), fetchone=True)
 
@@ -52,6 +69,22 @@ def upload_voice():
             return error('用户不存在', code=404)
 
         user_id = user['id']
+        
+        # 生成文件名
+        file_name = f"{uuid.uuid4().hex}.{file_ext}"
+        storage_key = f"voice/{file_name}"
+
+        # 流式写入存储，不在内存中缓存整个文件
+        storage = get_storage(current_app.config)
+        file_path = storage.local_path(storage_key)
+        if file_path:
+            storage.put_stream(storage_key, voice_stream, content_type)
+        else:
+            # 上传到对象存储的同时写一份本地副本用于语音识别，识别后删除
+            remote_copy = True
+            file_path = os.path.join(UPLOAD_FOLDER, file_name)
+            with open(file_path, 'wb') as local_copy:
+                storage.put_stream(storage_key, TeeReader(voice_stream, local_copy), content_type)
 
         # 调用语音识别API
         recognized_text = bailian_client.speech_to_text(file_path)
@@ -59,8 +92,7 @@ def upload_voice():
         if not recognized_text:
             return error('语音识别失败', code=500)
 
-        # 上传到对象存储（模拟）
-        voice_url = f"https://your-bucket.oss-cn-hangzhou.aliyuncs.com/voice/{file_name}"
+        voice_url = storage.public_url(storage_key)
 
         # 保存语音记录到MySQL
         insert_sql = '''
@@ -78,6 +110,7 @@ def upload_voice():
         '''
         voice_record = mysql_db.execute(voice_sql, (session_id, voice_url), fetchone=True)
         voice_id = voice_record['id']
+        keep = True
 
         return success({
             'voice_id': voice_id,
@@ -86,53 +119,82 @@ def upload_voice():
         })
 
     except Exception as e:
-        print(f'上传语音失败: {e}')
-        import traceback
-        traceback.print_exc()
+        logger.exception(f'上传语音失败: {e}')
         return error('上传语音失败')
+    finally:
+        if remote_copy and file_path and os.path.exists(file_path):
+            os.unlink(file_path)
+        if storage is not None and not keep:
+            try:
+                storage.delete(storage_key)
+            except Exception as e:
+                logger.warning(f'删除未使用的语音文件失败 {storage_key}: {e}')
+
 
+def _tts_cache_path(text: str, model: str, voice: str) -> str:
+    """合成结果的缓存文件，相同的模型、音色和文本复用同一个文件"""
+    digest = hashlib.sha256(f"{model}\n{voice}\n{text}".encode('utf-8')).hexdigest()
+    tts_dir = current_app.config.get('TTS_OUTPUT_DIR', 'uploads/tts')
+    os.makedirs(tts_dir, exist_ok=True)
+    return os.path.join(tts_dir, f"{digest}.mp3")
 
-@voice_bp.route('/tts', methods=['POST'])
+
+@voice_bp.route('/tts', methods=['GET', 'POST'])
 def text_to_speech():
     """
     文字转语音
+    已缓存的结果按文件返回；否则边合成边以分块传输返回，合成完成后写入缓存
+    GET 请求 (参数在 URL 中，可直接作为 <audio> 的地址) 读取缓存时支持 Range，播放器可以拖动进度
     """
-    data = request.get_json()
+    data = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
     text = data.get('text')
     voice = data.get('voice', 'longanyang')  # 默认音色
 
     if not text:
         return error('缺少text参数')
 
-    try:
-        # 生成临时文件路径
-        audio_file = f"{uuid.uuid4().hex}.mp3"
-        audio_path = os.path.join(UPLOAD_FOLDER, audio_file)
-
-        # 调用语音合成API
-        result = bailian_client.text_to_speech(
-            text=text,
-            voice=voice,
-            output_path=audio_path
-        )
-
-        if not result:
-            return error('语音合成失败', code=500)
-
-        # 返回音频文件
-        from flask import send_file
-        return send_file(
-            audio_path,
-            mimetype='audio/mpeg',
-            as_attachment=False,
-            download_name='tts.mp3'
-        )
+    model = bailian_client.tts_model
+    cache_path = _tts_cache_path(text, model, voice)
+    if os.path.isfile(cache_path):
+        # 更新访问时间，磁盘清理按最近访问淘汰
+        os.utime(cache_path, (time.time(), os.stat(cache_path).st_mtime))
+        response = send_file(cache_path, mimetype='audio/mpeg', conditional=True,
+                             download_name='tts.mp3')
+        response.headers['X-TTS-Cache'] = 'hit'
+        return response
 
+    try:
+        chunks = bailian_client.iter_text_to_speech(text, model=model, voice=voice)
+        # 先取到第一块再返回响应，合成失败时还能返回错误
+        first = next(chunks)
     except Exception as e:
-        print(f'语音合成失败: {e}')
-        import traceback
-        traceback.print_exc()
-        return error('语音合成失败')
+        logger.exception(f'语音合成失败: {e}')
+        return error('语音合成失败', code=500)
+
+    def generate():
+        temp_path = f"{cache_path}.{uuid.uuid4().hex}.part"
+        completed = False
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(first)
+                yield first
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, cache_path)
+            completed = True
+        except Exception as e:
+            logger.warning(f'流式语音合成中断: {e}')
+        finally:
+            chunks.close()
+            if not completed and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    # 不设置 Content-Length，以分块传输返回
+    response = Response(stream_with_context(generate()), mimetype='audio/mpeg')
+    response.headers['X-TTS-Cache'] = 'miss'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 @voice_bp.route('/models', methods=['GET'])
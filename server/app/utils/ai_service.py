@@ -2,9 +2,12 @@
 AI服务统一接口
 基于阿里云百炼平台实现对话、语音识别、语音合成、回忆录生成等功能
 """
+import logging
 from typing import Optional, List, Dict, Union
 from .bailian_client import bailian_client
 
+logger = logging.getLogger(__name__)
+
 
 class AIService:
     """AI服务统一接口类"""
@@ -30,7 +33,7 @@ class AIService:
                 temperature=temperature
             )
         except Exception as e:
-            print(f"AI对话调用失败: {e}")
+            logger.error(f"AI对话调用失败: {e}")
             return None
     
     def speech_to_text(self, audio_file_path: str) -> Optional[str]:
@@ -46,7 +49,7 @@ class AIService:
         try:
             return self.client.speech_to_text(audio_file_path)
         except Exception as e:
-            print(f"语音识别失败: {e}")
+            logger.error(f"语音识别失败: {e}")
             return None
     
     def text_to_speech(self, 
@@ -72,7 +75,7 @@ class AIService:
                 # 使用 HTTP API 方式
                 return self.client.text_to_speech(text, output_path=output_path)
         except Exception as e:
-            print(f"语音合成失败: {e}")
+            logger.error(f"语音合成失败: {e}")
             return None
     
     def generate_memoir(self, chat_history: List[Dict[str, str]]) -> Optional[str]:
@@ -88,25 +91,34 @@ class AIService:
         try:
             return self.client.generate_memoir(chat_history)
         except Exception as e:
-            print(f"回忆录生成失败: {e}")
+            logger.error(f"回忆录生成失败: {e}")
             return None
     
-    def generate_followup_question(self, chat_history: List[Dict[str, str]]) -> Optional[str]:
+    def generate_followup_question(self, chat_history: List[Dict[str, str]],
+                                   cache_result: bool = True) -> Optional[str]:
         """
         基于聊天历史生成追问问题
         
         Args:
             chat_history: 聊天历史
+            cache_result: 是否把结果写入追问缓存
             
         Returns:
             生成的追问问题
         """
         try:
-            return self.client.generate_followup_question(chat_history)
+            return self.client.generate_followup_question(chat_history, cache_result=cache_result)
         except Exception as e:
-            print(f"追问问题生成失败: {e}")
+            logger.error(f"追问问题生成失败: {e}")
             return None
     
+    def cache_followup(self, chat_history: List[Dict[str, str]], response: Optional[str]):
+        """把生成的追问写入缓存 (投机生成的结果被采用时调用)"""
+        try:
+            self.client.cache_followup(chat_history, response)
+        except Exception as e:
+            logger.warning(f"追问缓存写入失败: {e}")
+    
     def get_available_models(self) -> Dict[str, Dict[str, str]]:
         """
         获取可用的模型列表
@@ -0,0 +1,233 @@
+"""
+实时语音识别连接池
+预先建立到百炼实时语音识别服务的 WebSocket 连接并发送开始指令，
+新会话直接领取已就绪的连接，省去每次的 TLS + WebSocket 握手；
+后台线程负责补充连接并淘汰空闲过久的连接
+"""
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Optional, Callable
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+
+ASR_WS_URL = 'wss://dashscope.aliyuncs.com/api-ws/v1/inference/asr/paraformer-realtime-v2'
+
+
+class ASRConnection:
+    """一条实时语音识别 WebSocket 连接"""
+
+    def __init__(self, url: str, api_key: str, sample_rate: int = 16000):
+        self.url = url
+        self.api_key = api_key
+        self.sample_rate = sample_rate
+        self.created_at = time.time()
+        self.opened = threading.Event()
+        self.closed = threading.Event()
+        self.on_message = None
+        self.on_error = None
+        self.on_close = None
+        self._ws = None
+        self._thread = None
+
+    def connect(self):
+        """在后台线程中建立连接，连接打开后自动发送开始指令"""
+        self._ws = websocket.WebSocketApp(
+            f"{self.url}?api-key={self.api_key}",
+            on_open=self._handle_open,
+            on_message=self._handle_message,
+            on_error=self._handle_error,
+            on_close=self._handle_close
+        )
+        self._thread = threading.Thread(target=self._ws.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def _handle_open(self, ws):
+        header = {
+            "header": {
+                "action": "start",
+                "streaming": "duplex"
+            },
+            "payload": {
+                "format": "pcm",
+                "sample_rate": self.sample_rate,
+                "language_hints": ["zh", "en"]
+            }
+        }
+        ws.send(json.dumps(header))
+        self.opened.set()
+
+    def _handle_message(self, ws, message):
+        if self.on_message:
+            self.on_message(ws, message)
+
+    def _handle_error(self, ws, error):
+        if self.on_error:
+            self.on_error(ws, error)
+
+    def _handle_close(self, ws, close_status_code, close_msg):
+        self.closed.set()
+        if self.on_close:
+            self.on_close(ws, close_status_code, close_msg)
+
+    def bind(self,
+             on_message: Optional[Callable] = None,
+             on_error: Optional[Callable] = None,
+             on_close: Optional[Callable] = None):
+        """绑定会话的回调"""
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        # 领取前连接已经断开时，立即通知会话
+        if self.closed.is_set() and on_close:
+            on_close(self._ws, None, 'closed before bind')
+
+    def wait_open(self, timeout: float) -> bool:
+        """等待连接就绪 (开始指令已发送)"""
+        return self.opened.wait(timeout) and not self.closed.is_set()
+
+    @property
+    def is_ready(self) -> bool:
+        return self.opened.is_set() and not self.closed.is_set()
+
+    def send(self, data: str):
+        self._ws.send(data)
+
+    def close(self):
+        if self._ws:
+            try:
+                self._ws.close()
+            except Exception:
+                pass
+
+
+class ASRConnectionPool:
+    """预热的实时语音识别连接池"""
+
+    def __init__(self,
+                 api_key: str,
+                 url: str = ASR_WS_URL,
+                 size: int = 2,
+                 max_idle: float = 15,
+                 sample_rate: int = 16000):
+        """
+        Args:
+            api_key: 百炼 API Key
+            url: 实时语音识别 WebSocket 地址
+            size: 保持的预热连接数
+            max_idle: 预热连接的最长空闲时间 (秒)，超过后关闭重建，避免被服务端超时断开
+            sample_rate: 音频采样率
+        """
+        self.api_key = api_key
+        self.url = url
+        self.size = size
+        self.max_idle = max_idle
+        self.sample_rate = sample_rate
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self.stats = {'warm_hits': 0, 'cold_starts': 0, 'expired': 0}
+
+    def _new_connection(self) -> ASRConnection:
+        return ASRConnection(self.url, self.api_key, self.sample_rate).connect()
+
+    def start(self):
+        """启动后台补充线程"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        threading.Thread(target=self._replenish_loop, daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        with self._lock:
+            while self._idle:
+                self._idle.popleft().close()
+
+    def _replenish_loop(self):
+        while self._running:
+            now = time.time()
+            with self._lock:
+                alive = deque()
+                for conn in self._idle:
+                    if conn.closed.is_set() or now - conn.created_at > self.max_idle:
+                        conn.close()
+                        self.stats['expired'] += 1
+                    else:
+                        alive.append(conn)
+                self._idle = alive
+                missing = self.size - len(self._idle)
+            for _ in range(max(missing, 0)):
+                try:
+                    conn = self._new_connection()
+                except Exception as e:
+                    logger.warning(f"[ASRPool] 预热连接失败: {e}")
+                    break
+                with self._lock:
+                    self._idle.append(conn)
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+
+    def acquire(self) -> ASRConnection:
+        """
+        领取一条连接：优先返回已就绪的预热连接，没有时新建连接
+
+        Returns:
+            ASRConnection，调用方通过 wait_open 等待就绪
+        """
+        now = time.time()
+        with self._lock:
+            # 优先领取已就绪的连接，其次是正在握手的连接
+            for ready_only in (True, False):
+                for conn in list(self._idle):
+                    if conn.closed.is_set() or now - conn.created_at > self.max_idle:
+                        continue
+                    if ready_only and not conn.is_ready:
+                        continue
+                    self._idle.remove(conn)
+                    self.stats['warm_hits'] += 1
+                    self._wakeup.set()
+                    return conn
+            self.stats['cold_starts'] += 1
+        self._wakeup.set()
+        return self._new_connection()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle), ready=sum(1 for c in self._idle if c.is_ready))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_asr_pool(config) -> ASRConnectionPool:
+    """获取进程内唯一的连接池，首次调用时启动预热"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ASRConnectionPool(
+                    api_key=config.get('ALIYUN_API_KEY', ''),
+                    url=config.get('ASR_REALTIME_URL', ASR_WS_URL),
+                    size=config.get('ASR_POOL_SIZE', 2),
+                    max_idle=config.get('ASR_POOL_MAX_IDLE', 15),
+                    sample_rate=config.get('ASR_SAMPLE_RATE', 16000)
+                )
+                if _pool.size > 0:
+                    _pool.start()
+    return _pool
+
+
+def asr_pool_snapshot() -> Optional[dict]:
+    """连接池统计，本进程尚未创建连接池时返回 None"""
+    return _pool.snapshot() if _pool is not None else None
@@ -0,0 +1,372 @@
+"""
+语音识别前的音频预处理
+客户端上传的录音常常是高码率、双声道的 webm/m4a/wav，原样上传浪费带宽和识别时间。
+上传前在进程池中：解码 -> 混为单声道 -> 重采样到 ASR_SAMPLE_RATE -> 去掉首尾静音 -> 重新编码为低码率格式
+
+编码器：
+    ffmpeg 可用时输出 Opus (ogg 封装)，支持任意输入格式
+    没有 ffmpeg 时只处理 WAV 输入，输出 16bit 单声道 WAV；其它格式原样上传
+
+实时对话录音 (session_recorder) 也在同一个进程池中把 PCM 编码为 Opus
+"""
+import os
+import uuid
+import wave
+import shutil
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import logging
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Optional, Dict, Tuple, Callable, Any
+
+logger = logging.getLogger(__name__)
+
+try:
+    import audioop
+except ImportError:  # Python 3.13 移除了 audioop
+    audioop = None
+
+
+def _ffprobe_duration(path: str, ffmpeg: str) -> Optional[float]:
+    """用 ffprobe 读取音频时长 (秒)"""
+    ffprobe = os.path.join(os.path.dirname(ffmpeg), 'ffprobe') if os.path.dirname(ffmpeg) else 'ffprobe'
+    try:
+        output = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=30
+        ).stdout.strip()
+        return float(output) if output else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def _wav_duration(path: str) -> Optional[float]:
+    try:
+        with wave.open(path, 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def _remove(path: Optional[str]):
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _run_ffmpeg(args: list, dst: str, **kwargs):
+    """执行 ffmpeg，失败时删除写了一半的输出文件"""
+    try:
+        subprocess.run(args, check=True, capture_output=True, timeout=300, **kwargs)
+    except BaseException:
+        _remove(dst)
+        raise
+
+
+def _transcode_ffmpeg(src: str, dst_dir: str, sample_rate: int, bitrate_kbps: int,
+                      silence_db: int, ffmpeg: str) -> Tuple[str, str]:
+    dst = os.path.join(dst_dir, f"echotalk_asr_{uuid.uuid4().hex}.opus")
+    # 先去掉开头的静音，倒放后再去掉一次，即去掉结尾的静音
+    trim = f"silenceremove=start_periods=1:start_threshold={silence_db}dB:start_silence=0.1"
+    _run_ffmpeg(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', src,
+         '-ac', '1', '-ar', str(sample_rate),
+         '-af', f"{trim},areverse,{trim},areverse",
+         '-c:a', 'libopus', '-b:a', f"{bitrate_kbps}k", '-application', 'voip',
+         dst],
+        dst
+    )
+    return dst, 'opus'
+
+
+def _trim_silence(data: bytes, sample_rate: int, silence_db: int, padding: float = 0.1) -> bytes:
+    """
+    去掉 16bit 单声道 PCM 首尾的静音 (按 20ms 窗口判断)
+    与 ffmpeg 的 start_silence=0.1 一样，在首尾各保留 padding 秒，避免切掉字的起音和尾音
+    """
+    window = sample_rate // 50 * 2
+    threshold = 32768 * 10 ** (silence_db / 20)
+    starts = range(0, len(data), window)
+    voiced = [i for i in starts if audioop.rms(data[i:i + window], 2) >= threshold]
+    if not voiced:
+        return b''
+    pad = int(sample_rate * padding) * 2
+    return data[max(voiced[0] - pad, 0):voiced[-1] + window + pad]
+
+
+def _transcode_wav(src: str, dst_dir: str, sample_rate: int, silence_db: int) -> Tuple[str, str]:
+    """纯 Python 处理 WAV：转 16bit、混为单声道、重采样、去首尾静音"""
+    with wave.open(src, 'rb') as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+
+    if width != 2:
+        data = audioop.lin2lin(data, width, 2)
+    if channels == 2:
+        data = audioop.tomono(data, 2, 0.5, 0.5)
+    elif channels > 2:
+        raise ValueError(f'不支持 {channels} 声道的 WAV')
+    if rate != sample_rate:
+        data, _ = audioop.ratecv(data, 2, 1, rate, sample_rate, None)
+
+    data = _trim_silence(data, sample_rate, silence_db)
+
+    dst = os.path.join(dst_dir, f"echotalk_asr_{uuid.uuid4().hex}.wav")
+    with wave.open(dst, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(data)
+    return dst, 'wav'
+
+
+def transcode_for_asr(src: str,
+                      dst_dir: str,
+                      sample_rate: int = 16000,
+                      bitrate_kbps: int = 24,
+                      silence_db: int = -45,
+                      ffmpeg: Optional[str] = None) -> Optional[Dict]:
+    """
+    转码一个音频文件 (在工作进程中执行)
+
+    Args:
+        src: 源文件路径
+        dst_dir: 输出目录
+        sample_rate: 目标采样率
+        bitrate_kbps: Opus 码率
+        silence_db: 静音阈值 (dBFS)
+        ffmpeg: ffmpeg 路径，None 表示不可用
+
+    Returns:
+        {'path', 'format', 'bytes_in', 'bytes_out', 'seconds_in', 'seconds_out'}；
+        无法处理或处理后没有音频 (整段低于静音阈值) 时返回 None
+    """
+    is_wav = src.lower().endswith('.wav')
+    if ffmpeg:
+        seconds_in = _ffprobe_duration(src, ffmpeg)
+        dst, fmt = _transcode_ffmpeg(src, dst_dir, sample_rate, bitrate_kbps, silence_db, ffmpeg)
+        seconds_out = _ffprobe_duration(dst, ffmpeg)
+    elif is_wav and audioop is not None:
+        seconds_in = _wav_duration(src)
+        dst, fmt = _transcode_wav(src, dst_dir, sample_rate, silence_db)
+        seconds_out = _wav_duration(dst)
+    else:
+        return None
+    if not seconds_out and seconds_in is not None:
+        # 整段都被当作静音去掉 (如说话声音很轻)，或输出无法读取：使用原始文件，由识别服务判断
+        _remove(dst)
+        return None
+    return {
+        'path': dst,
+        'format': fmt,
+        'bytes_in': os.path.getsize(src),
+        'bytes_out': os.path.getsize(dst),
+        'seconds_in': seconds_in,
+        'seconds_out': seconds_out
+    }
+
+
+def encode_pcm(pcm: bytes,
+               dst_dir: str,
+               sample_rate: int = 16000,
+               bitrate_kbps: int = 32,
+               silence_db: Optional[int] = None,
+               ffmpeg: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    把 16bit 单声道 PCM 编码为音频文件 (在工作进程中执行)
+    ffmpeg 可用时编码为 Opus，否则写入 WAV
+
+    Args:
+        pcm: 16bit 单声道 PCM
+        dst_dir: 输出目录
+        sample_rate: 采样率
+        bitrate_kbps: Opus 码率
+        silence_db: 静音阈值 (dBFS)，None 表示不去掉首尾静音
+        ffmpeg: ffmpeg 路径，None 表示不可用
+
+    Returns:
+        (文件路径, 格式)；去掉静音后没有内容时返回 None
+    """
+    if silence_db is not None and audioop is not None:
+        pcm = _trim_silence(pcm, sample_rate, silence_db)
+    if not pcm:
+        return None
+    if ffmpeg:
+        dst = os.path.join(dst_dir, f"echotalk_rec_{uuid.uuid4().hex}.opus")
+        _run_ffmpeg(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+             '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+             '-c:a', 'libopus', '-b:a', f"{bitrate_kbps}k", '-application', 'voip', dst],
+            dst, input=pcm
+        )
+        return dst, 'opus'
+    dst = os.path.join(dst_dir, f"echotalk_rec_{uuid.uuid4().hex}.wav")
+    with wave.open(dst, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(pcm)
+    return dst, 'wav'
+
+
+class AudioTranscoder:
+    """在进程池中执行的音频预处理"""
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 bitrate_kbps: int = 24,
+                 silence_db: int = -45,
+                 max_workers: int = 2,
+                 timeout: float = 60,
+                 ffmpeg: str = 'ffmpeg',
+                 temp_dir: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.bitrate_kbps = bitrate_kbps
+        self.silence_db = silence_db
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ffmpeg = shutil.which(ffmpeg)
+        self.temp_dir = temp_dir or tempfile.gettempdir()
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {'files': 0, 'skipped': 0, 'failures': 0, 'in_flight': 0,
+                      'bytes_in': 0, 'bytes_out': 0, 'seconds_in': 0.0, 'seconds_out': 0.0}
+        if not self.ffmpeg:
+            logger.warning("[Transcode] 未找到 ffmpeg，只预处理 WAV 文件")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 服务进程中有多个线程，使用 spawn 避免 fork 时复制锁状态
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _submit(self, func, *args) -> Future:
+        """提交到进程池，in_flight 记录排队和执行中的任务数"""
+        with self._lock:
+            self.stats['in_flight'] += 1
+        future = self._get_executor().submit(func, *args)
+        future.add_done_callback(lambda _: self._count(None, 'in_flight', -1))
+        return future
+
+    @staticmethod
+    def _discard_output(future: Future, output_path: Callable[[Any], Optional[str]]):
+        """
+        丢弃任务的输出文件：还在排队的任务直接取消；等待超时后仍在执行的任务，
+        输出文件在任务结束后才出现，完成时再删除
+        """
+        if future.cancel():
+            return
+
+        def remove(done: Future):
+            if not done.cancelled() and done.exception() is None:
+                _remove(output_path(done.result()))
+
+        future.add_done_callback(remove)
+
+    def _count(self, report: Optional[Dict], key: Optional[str] = None, value: int = 1):
+        with self._lock:
+            if key:
+                self.stats[key] += value
+                return
+            self.stats['files'] += 1
+            for field in ('bytes_in', 'bytes_out', 'seconds_in', 'seconds_out'):
+                self.stats[field] += report.get(field) or 0
+
+    def prepare(self, path: str) -> Tuple[str, Optional[Dict]]:
+        """
+        预处理待识别的音频
+
+        Args:
+            path: 原始音频路径
+
+        Returns:
+            (待上传的文件路径, 处理报告)；无法处理、失败或处理后没有音频时返回 (原始路径, None)
+            报告中的 path 是临时文件，调用方用完后删除
+        """
+        future = None
+        handed_over = False
+        try:
+            future = self._submit(
+                transcode_for_asr, path, self.temp_dir, self.sample_rate,
+                self.bitrate_kbps, self.silence_db, self.ffmpeg
+            )
+            report = future.result(timeout=self.timeout)
+
+            if report is None:
+                self._count(None, 'skipped')
+                return path, None
+            if report['bytes_out'] >= report['bytes_in']:
+                # 转码后反而更大，仍使用原始文件 (临时文件在 finally 中删除)
+                self._count(None, 'skipped')
+                return path, None
+
+            self._count(report)
+            saved_seconds = (report['seconds_in'] or 0) - (report['seconds_out'] or 0)
+            logger.debug(f"[Transcode] {report['bytes_in']} -> {report['bytes_out']} bytes，"
+                         f"去掉静音 {saved_seconds:.1f}s")
+            handed_over = True
+            return report['path'], report
+        except Exception as e:
+            logger.warning(f"[Transcode] 预处理失败，上传原始文件: {e}")
+            self._count(None, 'failures')
+            return path, None
+        finally:
+            # 超时、失败或不使用转码结果时，删除工作进程生成的临时文件
+            if future is not None and not handed_over:
+                self._discard_output(future, lambda report: report and report['path'])
+
+    def encode_pcm(self, pcm: bytes, bitrate_kbps: int = 32,
+                   trim_silence: bool = True) -> Optional[Tuple[str, str]]:
+        """
+        在进程池中把 PCM 编码为音频文件 (阻塞等待结果)
+
+        Returns:
+            (临时文件路径, 格式)，调用方用完后删除；整段都是静音时返回 None
+        """
+        silence_db = self.silence_db if trim_silence else None
+        future = self._submit(encode_pcm, pcm, self.temp_dir, self.sample_rate,
+                              bitrate_kbps, silence_db, self.ffmpeg)
+        handed_over = False
+        try:
+            result = future.result(timeout=self.timeout)
+            handed_over = True
+            return result
+        finally:
+            if not handed_over:
+                self._discard_output(future, lambda result: result and result[0])
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        stats['seconds_saved'] = round(stats['seconds_in'] - stats['seconds_out'], 1)
+        stats['ffmpeg'] = bool(self.ffmpeg)
+        return stats
+
+
+_transcoder = None
+_transcoder_lock = threading.Lock()
+
+
+def get_audio_transcoder(config) -> AudioTranscoder:
+    """获取进程内唯一的音频处理器 (识别前预处理和实时录音编码共用一个进程池)"""
+    global _transcoder
+    if _transcoder is None:
+        with _transcoder_lock:
+            if _transcoder is None:
+                _transcoder = AudioTranscoder(
+                    sample_rate=config.get('ASR_SAMPLE_RATE', 16000),
+                    bitrate_kbps=config.get('ASR_PREPROCESS_BITRATE', 24),
+                    silence_db=config.get('ASR_TRIM_SILENCE_DB', -45),
+                    max_workers=config.get('ASR_PREPROCESS_WORKERS', 2),
+                    ffmpeg=config.get('FFMPEG_PATH', 'ffmpeg'),
+                    temp_dir=config.get('ASR_TEMP_DIR')
+                )
+    return _transcoder
@@ -5,12 +5,29 @@
 """
 import os
 import json
+import math
 import base64
 import requests
 import tempfile
+import logging
 import threading
+import time
 from typing import Optional, List, Dict, Union, Generator
 from flask import current_app
+from .prompt_builder import (PromptBuilder, estimate_messages_tokens, format_chat_line,
+                             make_messages, usage_tracker)
+from .prompts import (MEMOIR_SYSTEM_PROMPT, MEMOIR_FROM_CHAT_HEADER, MEMOIR_FROM_SUMMARY_HEADER,
+                      FOLLOWUP_SYSTEM_PROMPT, FOLLOWUP_HEADER, FOLLOWUP_FOOTER)
+from .response_cache import split_history
+from .resilience import (call_with_resilience, bounded_timeout, acquire_quota,
+                         UpstreamError, CircuitOpenError, DeadlineExceeded)
+from .streaming_asr import StreamingASR, create_transport_factory
+from .tts_pool import get_synthesizer_pool
+from .metrics import LLM_FIRST_TOKEN_SECONDS
+from .sse import iter_sse_data, parse_json
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
 
 
 class BailianClient:
@@ -61,6 +78,62 @@ class BailianClient:
         self._asr_model = None
         self._tts_model = None
         self._tts_voice = None
+        self._memoir_pipeline = None
+        self._followup_cache = None
+        self._router = None
+    
+    @property
+    def memoir_pipeline(self):
+        """获取回忆录分层摘要流水线"""
+        if self._memoir_pipeline is None:
+            from .memoir_pipeline import MemoirPipeline
+            self._memoir_pipeline = MemoirPipeline(self)
+        return self._memoir_pipeline
+    
+    @property
+    def followup_cache(self):
+        """获取追问回复缓存，未启用时返回None"""
+        if not current_app.config.get('FOLLOWUP_CACHE_ENABLED', False):
+            return None
+        if self._followup_cache is None:
+            from .response_cache import ResponseCache
+            self._followup_cache = ResponseCache(
+                max_size=current_app.config.get('FOLLOWUP_CACHE_MAX_SIZE', 1000),
+                ttl=current_app.config.get('FOLLOWUP_CACHE_TTL', 3600),
+                threshold=current_app.config.get('FOLLOWUP_CACHE_THRESHOLD', 0.85),
+                ngram=current_app.config.get('FOLLOWUP_CACHE_NGRAM', 2)
+            )
+        return self._followup_cache
+    
+    @property
+    def router(self):
+        """获取大模型请求路由，未启用时返回None"""
+        if not current_app.config.get('ROUTER_ENABLED', False):
+            return None
+        if self._router is None:
+            from .llm_router import LLMRouter, RouteTarget, parse_targets
+            config = current_app.config
+            targets = [
+                RouteTarget(model, url,
+                            failure_threshold=config.get('ROUTER_BREAKER_FAILURES', 5),
+                            reset_timeout=config.get('ROUTER_BREAKER_RESET', 30))
+                for model, url in parse_targets(config.get('ROUTER_TARGETS') or self.chat_model, self.base_url)
+            ]
+            self._router = LLMRouter(
+                targets,
+                hedge_min_ms=config.get('ROUTER_HEDGE_MIN_MS', 500),
+                hedge_max_ms=config.get('ROUTER_HEDGE_MAX_MS', 5000),
+                hedge_default_ms=config.get('ROUTER_HEDGE_DEFAULT_MS', 2000)
+            )
+        return self._router
+    
+    @property
+    def transcoder(self):
+        """获取识别前的音频预处理器，未启用时返回None"""
+        if not current_app.config.get('ASR_PREPROCESS', False):
+            return None
+        from .audio_transcoder import get_audio_transcoder
+        return get_audio_transcoder(current_app.config)
     
     @property
     def api_key(self) -> str:
@@ -112,12 +185,14 @@ class BailianClient:
             'Content-Type': 'application/json'
         }
     
+    @traced('bailian.chat_completion')
     def chat_completion(self, 
                        messages: List[Dict[str, str]], 
                        model: Optional[str] = None,
                        temperature: float = 0.7,
                        max_tokens: int = 2000,
-                       stream: bool = False) -> Union[str, Generator[str, None, None]]:
+                       stream: bool = False,
+                       purpose: str = 'chat') -> Union[str, Generator[str, None, None]]:
         """
         对话补全
         
@@ -127,58 +202,126 @@ class BailianClient:
             temperature: 温度参数 (0-2)
             max_tokens: 最大生成token数
             stream: 是否流式输出
+            purpose: 调用用途，用于 token 用量统计
             
         Returns:
             非流式：生成的文本
             流式：文本生成器
         """
         url = f"{self.base_url}/chat/completions"
+        model = model or self.chat_model
         
         payload = {
-            'model': model or self.chat_model,
+            'model': model,
             'messages': messages,
             'temperature': temperature,
             'max_tokens': max_tokens,
             'stream': stream
         }
+        if stream:
+            # 流式输出时在最后一个数据块返回 usage
+            payload['stream_options'] = {'include_usage': True}
         
-        try:
+        estimated_tokens = estimate_messages_tokens(messages)
+        start_time = time.time()
+        
+        # 非流式请求经路由发送，支持多目标对冲与熔断
+        router = self.router
+        if router and not stream:
+            try:
+                # 主请求和对冲请求各占一次配额
+                result, target = router.complete(payload, self._get_headers(),
+                                                 bounded_timeout(current_app.config.get('CHAT_TIMEOUT', 30)),
+                                                 acquire_quota=lambda max_wait: acquire_quota('chat', max_wait))
+            except (RuntimeError, DeadlineExceeded) as e:
+                logger.warning(f"对话请求失败: {e}")
+                return None
+            choice = (result.get('choices') or [{}])[0]
+            usage_tracker.record(purpose, target.model, estimated_tokens, result.get('usage'),
+                                 (time.time() - start_time) * 1000, choice.get('finish_reason'))
+            return choice.get('message', {}).get('content', '')
+        
+        def do_request(timeout: float):
             response = requests.post(
                 url,
                 headers=self._get_headers(),
                 json=payload,
                 stream=stream,
-                timeout=60
+                timeout=timeout
             )
             response.raise_for_status()
+            return response
+        
+        try:
+            response = call_with_resilience('chat', do_request, current_app.config.get('CHAT_TIMEOUT', 30))
             
             if stream:
-                return self._parse_stream_response(response)
+                def on_finish(usage, finish_reason):
+                    usage_tracker.record(purpose, model, estimated_tokens, usage,
+                                         (time.time() - start_time) * 1000, finish_reason)
+                return self._parse_stream_response(response, on_finish, start_time, purpose)
             else:
                 result = response.json()
-                return result.get('choices', [{}])[0].get('message', {}).get('content', '')
+                choice = (result.get('choices') or [{}])[0]
+                usage_tracker.record(purpose, model, estimated_tokens, result.get('usage'),
+                                     (time.time() - start_time) * 1000, choice.get('finish_reason'))
+                return choice.get('message', {}).get('content', '')
                 
-        except requests.exceptions.RequestException as e:
-            print(f"对话请求失败: {e}")
+        except (requests.exceptions.RequestException, CircuitOpenError, DeadlineExceeded) as e:
+            logger.warning(f"对话请求失败: {e}")
             return None
     
-    def _parse_stream_response(self, response) -> Generator[str, None, None]:
-        """解析流式响应"""
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data = line[6:]
-                    if data == '[DONE]':
-                        break
-                    try:
-                        json_data = json.loads(data)
-                        delta = json_data.get('choices', [{}])[0].get('delta', {})
-                        content = delta.get('content', '')
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
+    def _parse_stream_response(self, response, on_finish: callable = None,
+                               started: Optional[float] = None, purpose: str = 'chat') -> Generator[str, None, None]:
+        """
+        解析流式响应，逐段产出回复文本
+
+        Args:
+            response: stream=True 的响应
+            on_finish: 流结束时调用 on_finish(usage, finish_reason)
+            started: 发起请求的时间，用于统计首 token 延迟
+            purpose: 调用用途
+        """
+        usage = None
+        finish_reason = None
+        for data in iter_sse_data(response):
+            if data == b'[DONE]':
+                break
+            event = parse_json(data)
+            if not event:
+                continue
+            if event.get('usage'):
+                usage = event['usage']
+            choices = event.get('choices')
+            if not choices:
+                continue
+            choice = choices[0]
+            if choice.get('finish_reason'):
+                finish_reason = choice['finish_reason']
+            delta = choice.get('delta')
+            content = delta.get('content') if delta else None
+            if content:
+                if started is not None:
+                    LLM_FIRST_TOKEN_SECONDS.observe(time.time() - started, purpose=purpose)
+                    started = None
+                yield content
+        if finish_reason == 'length':
+            logger.warning(f"[Chat] {purpose} 输出达到 max_tokens 被截断")
+        if on_finish:
+            on_finish(usage, finish_reason)
+    
+    def _get_asr_file_url(self, file_path: str, model_name: str) -> Optional[str]:
+        """
+        获取语音识别服务可访问的文件URL
+        启用 asr_signed_url 且文件在上传目录下时直接使用本地签名URL，否则上传到百炼临时存储
+        """
+        if current_app.config.get('ASR_SIGNED_URL', False):
+            from .signed_url import make_signed_url
+            file_url = make_signed_url(file_path)
+            if file_url:
+                logger.debug("[ASR] 使用本地签名URL，跳过文件上传")
+                return file_url
+        return self._upload_file_to_bailian(file_path, model_name)
     
     def _upload_file_to_bailian(self, file_path: str, model_name: str) -> Optional[str]:
         """
@@ -192,63 +335,58 @@ class BailianClient:
         Returns:
             临时URL (oss://...)，失败返回None
         """
-        print(f"[ASR] 开始上传文件到百炼临时存储...")
+        logger.debug("[ASR] 开始上传文件到百炼临时存储...")
         
         try:
-            import dashscope
             from dashscope import Files
             
-            # 设置 API Key
-            dashscope.api_key = self.api_key
-            
             # 使用 SDK 上传文件
-            print(f"[ASR] 使用 SDK 上传文件...")
-            file_response = Files.upload(file_path=file_path, purpose='file-extraction')
+            def upload(timeout: float):
+                response = Files.upload(file_path=file_path, purpose='file-extraction', api_key=self.api_key)
+                if response.status_code != 200:
+                    raise UpstreamError(getattr(response, 'message', 'unknown'), response.status_code)
+                return response
             
-            print(f"[ASR] 文件上传响应: status_code={file_response.status_code}")
-            print(f"[ASR] 文件上传响应 output: {file_response.output}")
+            file_response = call_with_resilience('asr_upload', upload, current_app.config.get('ASR_TIMEOUT', 60))
             
-            if file_response.status_code != 200:
-                print(f"[ASR] 文件上传失败: {getattr(file_response, 'message', 'unknown')}")
-                return None
+            logger.debug(f"[ASR] 文件上传响应 output: {file_response.output}")
             
             # 获取 file_id
             uploaded_files = file_response.output.get('uploaded_files', []) if hasattr(file_response, 'output') else []
             if not uploaded_files:
-                print("[ASR] 错误: 未获取到上传文件信息")
+                logger.error("[ASR] 错误: 未获取到上传文件信息")
                 return None
             
             file_id = uploaded_files[0].get('file_id')
-            print(f"[ASR] 文件上传成功，file_id: {file_id}")
+            logger.debug(f"[ASR] 文件上传成功，file_id: {file_id}")
             
             # 获取文件详情以获取 URL
-            print(f"[ASR] 获取文件 URL...")
-            file_detail = Files.get(file_id=file_id)
-            print(f"[ASR] 文件详情响应: {file_detail.output}")
+            def get_detail(timeout: float):
+                response = Files.get(file_id=file_id, api_key=self.api_key)
+                if response.status_code != 200:
+                    raise UpstreamError(getattr(response, 'message', 'unknown'), response.status_code)
+                return response
+            
+            file_detail = call_with_resilience('asr_upload', get_detail, current_app.config.get('ASR_TIMEOUT', 60))
             
             if file_detail.status_code == 200:
                 file_url = file_detail.output.get('url') if hasattr(file_detail, 'output') else None
-                print(f"[ASR] 文件 URL: {file_url[:80] if file_url else 'None'}...")
                 return file_url
             else:
-                print(f"[ASR] 获取文件详情失败")
+                logger.error("[ASR] 获取文件详情失败")
                 return None
             
         except ImportError as ie:
-            print(f"[ASR] 导入错误: {ie}")
-            print("[ASR] 未安装 dashscope SDK，请运行: pip install dashscope")
+            logger.error(f"[ASR] 未安装 dashscope SDK ({ie})，请运行: pip install dashscope")
             return None
         except Exception as e:
-            print(f"[ASR] 上传文件异常: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"[ASR] 上传文件异常: {e}")
             return None
     
+    @traced('bailian.speech_to_text')
     def speech_to_text(self, 
                       audio_file_path: str,
-                      model: Optional[str] = None,
-                      format: str = 'mp3',
-                      sample_rate: int = 16000) -> Optional[str]:
+                      model: Optional[str] = None) -> Optional[str]:
         """
         语音识别 (Paraformer)
         使用阿里云百炼 Transcription API - 异步任务方式
@@ -256,130 +394,121 @@ class BailianClient:
         Args:
             audio_file_path: 音频文件路径
             model: 模型名称
-            format: 音频格式 (mp3, wav, pcm)
-            sample_rate: 采样率
             
         Returns:
             识别出的文本，失败返回None
         """
-        print(f"[ASR] 开始语音识别，文件: {audio_file_path}")
+        logger.debug(f"[ASR] 开始语音识别，文件: {audio_file_path}")
         
+        # 预处理生成的临时文件在识别结束后删除
+        upload_path, report = audio_file_path, None
         try:
-            import dashscope
             from dashscope.audio.asr import Transcription
             from urllib import request
             
             # 检查文件是否存在
             if not os.path.exists(audio_file_path):
-                print(f"[ASR] 错误: 文件不存在 {audio_file_path}")
+                logger.warning(f"[ASR] 错误: 文件不存在 {audio_file_path}")
                 return None
             
-            file_size = os.path.getsize(audio_file_path)
-            print(f"[ASR] 文件大小: {file_size} bytes")
-            
             # 使用 paraformer-v2 模型（推荐）
             model_name = model or 'paraformer-v2'
-            print(f"[ASR] 使用模型: {model_name}")
             
-            # 步骤1: 上传文件获取临时URL
-            file_url = self._upload_file_to_bailian(audio_file_path, model_name)
+            # 步骤1: 混为单声道、重采样、去掉首尾静音后再上传
+            if self.transcoder:
+                upload_path, report = self.transcoder.prepare(audio_file_path)
+            
+            # 步骤2: 获取识别服务可访问的URL (本地签名URL，或上传到百炼临时存储)
+            file_url = self._get_asr_file_url(upload_path, model_name)
             if not file_url:
-                print("[ASR] 错误: 文件上传失败")
+                logger.error("[ASR] 错误: 文件上传失败")
                 return None
             
-            # 步骤2: 使用 dashscope SDK 提交语音识别任务
-            print(f"[ASR] 步骤3: 使用 SDK 提交语音识别任务...")
-            
-            # 设置 API Key
-            dashscope.api_key = self.api_key
+            # 步骤3: 使用 dashscope SDK 提交语音识别任务
             
             # 提交异步任务
-            task_response = Transcription.async_call(
-                model=model_name,
-                file_urls=[file_url],
-                language_hints=['zh', 'en']
-            )
+            def submit(timeout: float):
+                response = Transcription.async_call(
+                    model=model_name,
+                    file_urls=[file_url],
+                    language_hints=['zh', 'en'],
+                    api_key=self.api_key
+                )
+                if response.status_code != 200:
+                    raise UpstreamError(getattr(response, 'message', 'unknown'), response.status_code)
+                return response
             
-            print(f"[ASR] 任务提交响应: status_code={task_response.status_code}")
+            task_response = call_with_resilience('asr', submit, current_app.config.get('ASR_TIMEOUT', 60))
             
-            if task_response.status_code != 200:
-                print(f"[ASR] 提交任务失败: {getattr(task_response, 'message', 'unknown')}")
-                return None
             
             task_id = task_response.output.get('task_id') if hasattr(task_response, 'output') else None
-            print(f"[ASR] 任务提交成功，任务ID: {task_id}")
+            logger.debug(f"[ASR] 任务提交成功，任务ID: {task_id}")
             
             if not task_id:
-                print("[ASR] 错误: 未能获取任务ID")
+                logger.error("[ASR] 错误: 未能获取任务ID")
                 return None
             
-            # 步骤3: 等待任务完成
-            print(f"[ASR] 步骤4: 等待任务完成...")
-            transcription_response = Transcription.wait(task=task_id)
+            # 步骤4: 等待任务完成
+            # 等待时间不超过请求截止时间
+            wait_timeout = math.ceil(bounded_timeout(current_app.config.get('ASR_TIMEOUT', 60)))
+            transcription_response = Transcription.wait(task=task_id, wait_timeout=wait_timeout, api_key=self.api_key)
             
-            print(f"[ASR] 任务完成: status_code={transcription_response.status_code}")
+            logger.debug(f"[ASR] 任务完成: status_code={transcription_response.status_code}")
             
             if transcription_response.status_code == 200:
                 # 获取识别结果 URL
-                print(f"[ASR] 任务响应 output: {transcription_response.output}")
-                print(f"[ASR] 任务响应 output 类型: {type(transcription_response.output)}")
                 
                 # 检查任务状态
                 task_status = transcription_response.output.get('task_status') if hasattr(transcription_response, 'output') else None
-                print(f"[ASR] 任务状态: {task_status}")
                 
                 if task_status != 'SUCCEEDED':
-                    print(f"[ASR] 错误: 任务未成功完成，状态: {task_status}")
+                    logger.error(f"[ASR] 错误: 任务未成功完成，状态: {task_status}")
                     return None
                 
                 results = transcription_response.output.get('results', []) if hasattr(transcription_response, 'output') else []
-                print(f"[ASR] 结果列表: {results}")
-                print(f"[ASR] 结果数量: {len(results)}")
                 
                 if results:
                     transcription_url = results[0].get('transcription_url')
-                    print(f"[ASR] 转写URL: {transcription_url}")
                     if transcription_url:
                         # 下载识别结果
-                        print(f"[ASR] 下载识别结果...")
                         try:
                             transcription_data = json.loads(request.urlopen(transcription_url).read().decode('utf8'))
-                            print(f"[ASR] 转写数据: {transcription_data}")
                             transcripts = transcription_data.get('transcripts', [])
-                            print(f"[ASR] transcripts: {transcripts}")
                             if transcripts:
                                 text = transcripts[0].get('text', '')
-                                print(f"[ASR] 识别成功: {text[:50] if text else 'Empty'}...")
+                                logger.debug(f"[ASR] 识别成功: {text[:50] if text else 'Empty'}...")
                                 return text
                             else:
-                                print("[ASR] 错误: transcripts 为空")
+                                logger.warning("[ASR] 错误: transcripts 为空")
                         except Exception as download_err:
-                            print(f"[ASR] 下载结果失败: {download_err}")
-                            import traceback
-                            traceback.print_exc()
+                            logger.exception(f"[ASR] 下载结果失败: {download_err}")
                             return None
                     else:
-                        print("[ASR] 错误: transcription_url 为空")
+                        logger.error("[ASR] 错误: transcription_url 为空")
                 else:
-                    print("[ASR] 错误: results 为空")
+                    logger.error("[ASR] 错误: results 为空")
                 return None
             else:
-                print(f"[ASR] 任务执行失败: {getattr(transcription_response, 'message', 'unknown')}")
+                logger.error(f"[ASR] 任务执行失败: {getattr(transcription_response, 'message', 'unknown')}")
                 return None
                 
         except ImportError as ie:
-            print(f"[ASR] 导入错误: {ie}")
-            print("[ASR] 请运行: pip install dashscope")
+            logger.error(f"[ASR] 未安装 dashscope SDK ({ie})，请运行: pip install dashscope")
+            return None
+        except (CircuitOpenError, DeadlineExceeded, UpstreamError) as e:
+            logger.error(f"[ASR] 语音识别失败: {e}")
             return None
         except FileNotFoundError:
-            print(f"[ASR] 错误: 音频文件不存在: {audio_file_path}")
+            logger.warning(f"[ASR] 错误: 音频文件不存在: {audio_file_path}")
             return None
         except Exception as e:
-            print(f"[ASR] 语音识别失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"[ASR] 语音识别失败: {e}")
             return None
+        finally:
+            if report and os.path.exists(upload_path):
+                os.unlink(upload_path)
     
+    @traced('bailian.text_to_speech')
     def text_to_speech(self,
                       text: str,
                       model: Optional[str] = None,
@@ -391,17 +520,13 @@ class BailianClient:
         使用阿里云百炼平台的 dashscope SDK 进行语音合成
         """
         try:
-            import dashscope
-            from dashscope.audio.tts_v2 import SpeechSynthesizer
+            pool = get_synthesizer_pool(current_app.config)
             
-            dashscope.api_key = self.api_key
+            def synthesize(timeout: float):
+                with pool.synthesizer(model or self.tts_model, voice or self.tts_voice) as synthesizer:
+                    return synthesizer.call(text, timeout_millis=int(timeout * 1000))
             
-            synthesizer = SpeechSynthesizer(
-                model=model or self.tts_model,
-                voice=voice or self.tts_voice
-            )
-            
-            audio_data = synthesizer.call(text)
+            audio_data = call_with_resilience('tts', synthesize, current_app.config.get('TTS_TIMEOUT', 30))
             
             if audio_data:
                 if output_path:
@@ -412,16 +537,14 @@ class BailianClient:
                 else:
                     return audio_data
             else:
-                print(f"语音合成返回空数据")
+                logger.warning("语音合成返回空数据")
                 return None
                 
         except ImportError:
-            print("[TTS] 未安装 dashscope SDK，尝试使用 HTTP API")
+            logger.warning("[TTS] 未安装 dashscope SDK，尝试使用 HTTP API")
             return self._text_to_speech_http(text, model, voice, speed, output_path)
         except Exception as e:
-            print(f"语音合成失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"语音合成失败: {e}")
             return None
     
     def _text_to_speech_http(self,
@@ -447,7 +570,7 @@ class BailianClient:
             }
         }
         
-        try:
+        def do_request(timeout: float):
             response = requests.post(
                 url,
                 headers={
@@ -455,8 +578,14 @@ class BailianClient:
                     'Content-Type': 'application/json'
                 },
                 json=payload,
-                timeout=60
+                timeout=timeout
             )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise UpstreamError(response.text, response.status_code)
+            return response
+        
+        try:
+            response = call_with_resilience('tts', do_request, current_app.config.get('TTS_TIMEOUT', 30))
             
             if response.status_code == 200:
                 result = response.json()
@@ -473,16 +602,17 @@ class BailianClient:
                     else:
                         return audio_data
                 else:
-                    print(f"语音合成返回格式异常: {result}")
+                    logger.error(f"语音合成返回格式异常: {result}")
                     return None
             else:
-                print(f"语音合成请求失败: {response.status_code} - {response.text}")
+                logger.error(f"语音合成请求失败: {response.status_code} - {response.text}")
                 return None
                 
-        except requests.exceptions.RequestException as e:
-            print(f"语音合成请求失败: {e}")
+        except (requests.exceptions.RequestException, UpstreamError, CircuitOpenError, DeadlineExceeded) as e:
+            logger.error(f"语音合成请求失败: {e}")
             return None
     
+    @traced('bailian.text_to_speech_with_dashscope')
     def text_to_speech_with_dashscope(self,
                                      text: str,
                                      model: Optional[str] = None,
@@ -502,20 +632,14 @@ class BailianClient:
             有output_path时返回文件路径，否则返回音频字节数据
         """
         try:
-            import dashscope
-            from dashscope.audio.tts_v2 import SpeechSynthesizer
+            # 从合成器池领取 (复用已建立的连接)，密钥由池按调用提供
+            pool = get_synthesizer_pool(current_app.config)
             
-            # 设置 API Key
-            dashscope.api_key = self.api_key
+            def synthesize(timeout: float):
+                with pool.synthesizer(model or self.tts_model, voice or self.tts_voice) as synthesizer:
+                    return synthesizer.call(text, timeout_millis=int(timeout * 1000))
             
-            # 创建合成器
-            synthesizer = SpeechSynthesizer(
-                model=model or self.tts_model,
-                voice=voice or self.tts_voice
-            )
-            
-            # 执行合成
-            audio = synthesizer.call(text)
+            audio = call_with_resilience('tts', synthesize, current_app.config.get('TTS_TIMEOUT', 30))
             
             if output_path:
                 os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
@@ -526,12 +650,13 @@ class BailianClient:
                 return audio
                 
         except ImportError:
-            print("未安装 dashscope SDK，请运行: pip install dashscope")
+            logger.error("未安装 dashscope SDK，请运行: pip install dashscope")
             return None
         except Exception as e:
-            print(f"语音合成失败: {e}")
+            logger.error(f"语音合成失败: {e}")
             return None
     
+    @traced('bailian.generate_memoir')
     def generate_memoir(self, chat_history: List[Dict[str, str]]) -> Optional[str]:
         """
         基于聊天记录生成回忆录
@@ -542,163 +667,165 @@ class BailianClient:
         Returns:
             生成的回忆录文章
         """
-        system_prompt = """你是一位专业的回忆录撰写助手。请基于以下对话内容，生成一篇温馨、真实的回忆录文章。
-
-要求：
-1. 语言风格要贴合老年人的口语习惯，朴实、温暖
-2. 保留对话中的真实情感和细节
-3. 文章结构清晰，有时间、地点、人物、事件经过
-4. 适当润色，但不要过度修饰，保持真实性
-5. 文章字数控制在800-1500字
-
-请直接输出文章正文，不需要标题。"""
-
-        chat_text = "\n".join([
-            f"{'老人' if msg['role'] == 'user' else 'AI'}：{msg['content']}"
-            for msg in chat_history
-        ])
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"请根据以下对话生成回忆录：\n\n{chat_text}"}
-        ]
+        def compose(source_text: str, summarized: bool) -> Optional[str]:
+            header = MEMOIR_FROM_SUMMARY_HEADER if summarized else MEMOIR_FROM_CHAT_HEADER
+            messages = make_messages(MEMOIR_SYSTEM_PROMPT, f"{header}{source_text}", self.chat_model)
+            return self.chat_completion(messages, temperature=0.8, purpose='memoir')
 
-        return self.chat_completion(messages, temperature=0.8)
+        # 长会话先分段摘要再合成，短会话直接使用对话原文
+        return self.memoir_pipeline.generate(chat_history, compose)
     
-    def generate_followup_question(self, chat_history: List[Dict[str, str]]) -> Optional[str]:
+    @traced('bailian.generate_followup_question')
+    def generate_followup_question(self, chat_history: List[Dict[str, str]],
+                                   cache_result: bool = True) -> Optional[str]:
         """
         基于聊天历史生成追问问题
         
         Args:
-            chat_history: 聊天历史 (最近6条)
+            chat_history: 聊天历史 (按 token 预算截取最近的消息)
+            cache_result: 是否把结果写入追问缓存 (投机生成时为 False，被采用后再调用 cache_followup)
             
         Returns:
             生成的追问问题
         """
-        system_prompt = """你是一位善于引导老年人回忆过去的AI助手。请基于对话历史，生成一个自然、温和的追问问题，帮助老人挖掘更多细节。
+        # 相同或相近的开场白直接复用缓存的追问
+        cache = self.followup_cache
+        last_text, context_hash = split_history(chat_history) if cache else (None, '')
+        if last_text:
+            cached = cache.get(last_text, context_hash, self.chat_model)
+            if cached:
+                logger.debug("[Cache] 追问缓存命中")
+                return cached
 
-要求：
-1. 问题要具体，针对老人提到的某个人、地点或事件
-2. 语气亲切、耐心，像晚辈在听长辈讲故事
-3. 问题不要太复杂，一次只问一个方面
-4. 如果老人已经讲得很详细，可以表示理解和共情
+        # 按 token 预算从最新的消息开始填充历史
+        builder = PromptBuilder(self.chat_model, limit=current_app.config.get('FOLLOWUP_PROMPT_TOKENS', 1500))
+        messages, _ = builder.build(
+            FOLLOWUP_SYSTEM_PROMPT,
+            chat_history,
+            format_chat_line,
+            header=FOLLOWUP_HEADER,
+            footer=FOLLOWUP_FOOTER
+        )
 
-请只输出问题本身，不要有多余的解释。"""
+        response = self.chat_completion(messages, temperature=0.9, purpose='followup')
+        if cache_result:
+            self.cache_followup(chat_history, response)
+        return response
 
-        chat_text = "\n".join([
-            f"{'老人' if msg['role'] == 'user' else 'AI'}：{msg['content']}"
-            for msg in chat_history[-6:]  # 只取最近6条
-        ])
+    def cache_followup(self, chat_history: List[Dict[str, str]], response: Optional[str]):
+        """把为 chat_history 生成的追问写入缓存"""
+        cache = self.followup_cache
+        if not cache or not response:
+            return
+        last_text, context_hash = split_history(chat_history)
+        if last_text:
+            cache.set(last_text, context_hash, self.chat_model, response)
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"对话历史：\n\n{chat_text}\n\n请生成一个追问问题："}
-        ]
-
-        return self.chat_completion(messages, temperature=0.9)
-
-    def create_realtime_asr_connection(self, 
-                                       on_result: callable,
-                                       on_error: callable = None,
-                                       on_close: callable = None):
+    def create_streaming_asr(self,
+                             on_partial: callable = None,
+                             on_final: callable = None,
+                             on_error: callable = None) -> StreamingASR:
         """
-        创建实时语音识别连接
-        使用阿里云百炼实时语音识别API
+        创建实时语音识别会话
+        传输层由 asr_realtime_transport 配置决定 (websocket 使用预热连接池 / sdk 使用 dashscope Recognition)
         
         Args:
-            on_result: 识别结果回调函数
-            on_error: 错误回调函数
-            on_close: 连接关闭回调函数
+            on_partial: 中间结果回调，参数为 ASRResult
+            on_final: 句子结束回调，参数为 ASRResult
+            on_error: 不可恢复的错误回调，参数为错误信息
             
         Returns:
-            实时ASR连接对象
+            StreamingASR，调用 start() 后开始连接
         """
+        config = current_app.config
+        return StreamingASR(
+            create_transport_factory(config),
+            on_partial=on_partial,
+            on_final=on_final,
+            on_error=on_error,
+            sample_rate=config.get('ASR_SAMPLE_RATE', 16000),
+            replay_ms=config.get('ASR_REPLAY_MS', 3000),
+            buffer_ms=config.get('ASR_BUFFER_MS', 10000),
+            max_reconnects=config.get('ASR_MAX_RECONNECTS', 2),
+            open_timeout=config.get('ASR_OPEN_TIMEOUT', 5)
+        )
+
+    def iter_text_to_speech(self,
+                            text: str,
+                            model: Optional[str] = None,
+                            voice: Optional[str] = None) -> Generator[bytes, None, None]:
+        """
+        流式语音合成，按到达顺序逐块产出音频
+        收到第一块音频前的失败按 tts 接口的策略重试；之后的失败直接抛出 (已产出的音频无法撤回)
+
+        Args:
+            text: 要合成的文本
+            model: 模型名称
+            voice: 音色名称
+
+        Yields:
+            音频块 (mp3)
+        """
+        import queue
+        from dashscope.audio.tts_v2 import ResultCallback
+
+        pool = get_synthesizer_pool(current_app.config)
+        timeout = current_app.config.get('TTS_TIMEOUT', 30)
+        done = object()
+
+        class ChunkQueue(ResultCallback):
+            """把 SDK 回调线程收到的音频块交给调用方"""
+
+            def __init__(self):
+                self.chunks = queue.Queue()
+
+            def on_data(self, data: bytes):
+                self.chunks.put(bytes(data))
+
+            def on_complete(self):
+                self.chunks.put(done)
+
+            def on_error(self, message):
+                self.chunks.put(UpstreamError(f'语音合成失败: {message}'))
+
+        def open_stream(attempt_timeout: float):
+            callback = ChunkQueue()
+            synthesizer = pool.acquire(model or self.tts_model, voice or self.tts_voice, callback)
+            try:
+                # 设置回调后 call 只提交任务，音频通过回调到达
+                synthesizer.call(text)
+                first = callback.chunks.get(timeout=attempt_timeout)
+            except queue.Empty:
+                pool.release(synthesizer, reusable=False)
+                raise TimeoutError('等待首个音频块超时')
+            except BaseException:
+                pool.release(synthesizer, reusable=False)
+                raise
+            if isinstance(first, Exception):
+                pool.release(synthesizer, reusable=False)
+                raise first
+            return synthesizer, callback.chunks, first
+
+        synthesizer, chunks, item = call_with_resilience('tts', open_stream, timeout)
+        finished = False
         try:
-            import dashscope
-            from dashscope.audio.asr import Recognition, RecognitionCallback
-            import gevent
-            
-            dashscope.api_key = self.api_key
-            
-            class RealtimeASRConnection:
-                def __init__(self, api_key, on_result, on_error, on_close):
-                    self.api_key = api_key
-                    self.on_result = on_result
-                    self.on_error = on_error
-                    self.on_close = on_close
-                    self.recognition = None
-                    self._is_running = False
-                
-                def start(self):
-                    dashscope.api_key = self.api_key
-                    
-                    class ASRCallback(RecognitionCallback):
-                        def __init__(self, parent):
-                            self.parent = parent
-                        
-                        def on_open(self):
-                            print("[ASR] 连接已打开")
-                        
-                        def on_close(self):
-                            print("[ASR] 连接已关闭")
-                            if self.parent.on_close:
-                                self.parent.on_close(None)
-                        
-                        def on_event(self, result):
-                            print(f"[ASR] on_event 被调用, result类型: {type(result)}")
-                            
-                            if hasattr(result, 'get_sentence'):
-                                sentence = result.get_sentence()
-                                print(f"[ASR] sentence: {sentence}")
-                                if sentence:
-                                    text = sentence.get('text', '')
-                                    print(f"[ASR] 识别文本: {text}")
-                                    if text and self.parent.on_result:
-                                        gevent.spawn(self.parent.on_result, text, sentence.get('end_time', 0))
-                            else:
-                                print(f"[ASR] result没有get_sentence方法")
-                                if hasattr(result, 'output'):
-                                    print(f"[ASR] result.output: {result.output}")
-                        
-                        def on_error(self, error):
-                            print(f"[ASR] 错误: {error}")
-                            if self.parent.on_error:
-                                self.parent.on_error(str(error))
-                    
-                    callback = ASRCallback(self)
-                    self.recognition = Recognition(
-                        model='paraformer-realtime-v2',
-                        format='pcm',
-                        sample_rate=16000,
-                        language_hints=['zh', 'en'],
-                        callback=callback
-                    )
-                    self._is_running = True
-                    self.recognition.start()
-                
-                def send_audio(self, audio_data: bytes):
-                    if self.recognition and self._is_running:
-                        self.recognition.send_audio_frame(audio_data)
-                
-                def stop(self):
-                    if self.recognition:
-                        self._is_running = False
-                        result = self.recognition.stop()
-                        if self.on_close:
-                            self.on_close(result)
-            
-            return RealtimeASRConnection(self.api_key, on_result, on_error, on_close)
-            
-        except ImportError:
-            print("[RealtimeASR] 未安装 dashscope SDK")
-            if on_error:
-                on_error("未安装 dashscope SDK")
-            return None
-        except Exception as e:
-            print(f"[RealtimeASR] 创建连接失败: {e}")
-            if on_error:
-                on_error(str(e))
-            return None
+            while item is not done:
+                yield item
+                try:
+                    item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError('等待音频块超时')
+                if isinstance(item, Exception):
+                    raise item
+            finished = True
+        finally:
+            if not finished:
+                # 客户端断开或出错时取消合成任务
+                try:
+                    synthesizer.streaming_cancel()
+                except Exception:
+                    pass
+            pool.release(synthesizer, reusable=finished)
 
     def stream_text_to_speech(self, 
                               text: str,
@@ -719,29 +846,19 @@ class BailianClient:
             完整音频数据
         """
         try:
-            import dashscope
-            from dashscope.audio.tts_v2 import SpeechSynthesizer
-            
-            dashscope.api_key = self.api_key
-            
-            synthesizer = SpeechSynthesizer(
-                model=model or self.tts_model,
-                voice=voice or self.tts_voice
-            )
-            
-            audio_data = b''
-            for audio_chunk in synthesizer.stream_call(text):
-                audio_data += audio_chunk
+            # 先收集音频块最后一次拼接，避免逐块拼接 bytes 的平方级复制
+            chunks = []
+            for audio_chunk in self.iter_text_to_speech(text, model, voice):
+                chunks.append(audio_chunk)
                 if on_audio_chunk:
                     on_audio_chunk(audio_chunk)
-            
-            return audio_data
+            return b''.join(chunks)
             
         except ImportError:
-            print("[StreamTTS] 未安装 dashscope SDK")
+            logger.error("[StreamTTS] 未安装 dashscope SDK")
             return None
         except Exception as e:
-            print(f"[StreamTTS] 流式语音合成失败: {e}")
+            logger.error(f"[StreamTTS] 流式语音合成失败: {e}")
             return None
 
 
@@ -1,6 +1,15 @@
+import time
+import threading
 import pymysql
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from flask import current_app
+from .metrics import DB_QUERY_SECONDS, DB_ERRORS, DB_CONNECTIONS
+from . import tracing
+
+def _statement(sql):
+    # 只记录 SQL 模板 (参数中可能有用户数据)
+    return ' '.join(sql.split())[:200]
+
 
 class MySQLDB:
     _instance = None
@@ -21,8 +30,29 @@ class MySQLDB:
             cursorclass=pymysql.cursors.DictCursor
         )
 
+    def _connect(self):
+        # 每次查询新建连接，耗时计入查询耗时
+        started = time.perf_counter()
+        try:
+            conn = self.get_connection()
+        except Exception:
+            DB_ERRORS.inc(db='mysql')
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, db='mysql')
+            raise
+        DB_CONNECTIONS.inc(db='mysql', state='in_use')
+        return conn, started
+
+    def _finish(self, conn, started):
+        conn.close()
+        DB_CONNECTIONS.dec(db='mysql', state='in_use')
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, db='mysql')
+
     def execute(self, sql, params=None, fetchone=False):
-        conn = self.get_connection()
+        with tracing.span('mysql.query', tracing.KIND_CLIENT, **{'db.statement': _statement(sql)}):
+            return self._execute(sql, params, fetchone)
+
+    def _execute(self, sql, params, fetchone):
+        conn, started = self._connect()
         try:
             with conn.cursor() as cursor:
                 cursor.execute(sql, params)
@@ -31,22 +61,99 @@ class MySQLDB:
                     return cursor.fetchone()
                 return cursor.fetchall()
         except Exception as e:
+            DB_ERRORS.inc(db='mysql')
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            self._finish(conn, started)
 
     def execute_many(self, sql, params_list):
-        conn = self.get_connection()
+        with tracing.span('mysql.query', tracing.KIND_CLIENT, **{'db.statement': _statement(sql)}):
+            self._execute_many(sql, params_list)
+
+    def _execute_many(self, sql, params_list):
+        conn, started = self._connect()
         try:
             with conn.cursor() as cursor:
                 cursor.executemany(sql, params_list)
                 conn.commit()
         except Exception as e:
+            DB_ERRORS.inc(db='mysql')
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            self._finish(conn, started)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """把 pymongo 连接池事件记录到 echotalk_db_connections"""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        DB_CONNECTIONS.inc(db='mongodb', state='open')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        DB_CONNECTIONS.dec(db='mongodb', state='open')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        DB_ERRORS.inc(db='mongodb')
+
+    def connection_checked_out(self, event):
+        DB_CONNECTIONS.inc(db='mongodb', state='checked_out')
+
+    def connection_checked_in(self, event):
+        DB_CONNECTIONS.dec(db='mongodb', state='checked_out')
+
+
+class MongoTraceListener(monitoring.CommandListener):
+    """把当前 trace 中的 MongoDB 命令记录为子 span (命令事件在发起命令的线程中同步触发)"""
+
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if tracing.current_span() is None:
+            return
+        collection = event.command.get(event.command_name)
+        span = tracing.start_span(f"mongo.{event.command_name}", tracing.KIND_CLIENT, **{
+            'db.system': 'mongodb',
+            'db.mongodb.collection': collection if isinstance(collection, str) else '',
+        })
+        if span is not None:
+            with self._lock:
+                self._spans[(event.request_id, event.connection_id)] = span
+
+    def _finish(self, event, error=None):
+        with self._lock:
+            span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            if error:
+                span.error = error
+            span.end()
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure))
+
 
 class MongoDB:
     _instance = None
@@ -57,7 +164,7 @@ class MongoDB:
         return cls._instance
 
     def init_app(self, app):
-        self.client = MongoClient(app.config['MONGO_URI'])
+        self.client = MongoClient(app.config['MONGO_URI'], event_listeners=[MongoPoolMetrics(), MongoTraceListener()])
         self.db = self.client.get_default_database()
 
     def get_collection(self, name):
@@ -0,0 +1,324 @@
+"""
+磁盘清理
+后台线程按目录策略清理上传目录中的文件：
+    - 保留期：最后修改时间早于 max_age 的文件直接删除
+    - 配额：目录总大小超过 max_bytes 时，按最近访问时间 (LRU) 从最久未使用的文件开始删除
+
+扫描是增量的：每个目录保留一个 os.scandir 游标，每轮只处理 batch_size 个条目，
+目录中有上百万个文件时也不会长时间占用 CPU 和磁盘；一遍扫完后再按配额淘汰，
+内存中只保留最久未使用的 evict_candidates 个候选文件
+
+多个 worker 进程共享上传目录时，只有持有锁文件 (flock) 的进程清理，其它进程定期尝试接替；
+持有者退出时锁由操作系统释放
+"""
+import os
+import time
+import heapq
+import fnmatch
+import tempfile
+import threading
+import logging
+from itertools import islice
+from typing import Optional, List, Dict, Iterator, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - 非 POSIX 平台，不做进程间互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class CleanupPolicy:
+    """单个目录的清理策略"""
+
+    def __init__(self,
+                 name: str,
+                 path: str,
+                 max_age: Optional[float] = None,
+                 max_bytes: Optional[int] = None,
+                 pattern: Optional[str] = None,
+                 recursive: bool = True,
+                 exclude: Optional[List[str]] = None,
+                 evict_candidates: int = 10000):
+        """
+        Args:
+            name: 策略名称 (统计中使用)
+            path: 目录
+            max_age: 保留期 (秒)，None 表示不按时间清理
+            max_bytes: 目录总大小上限 (字节)，None 表示不限制
+            pattern: 只处理匹配的文件名 (fnmatch)，如 echotalk_*
+            recursive: 是否扫描子目录
+            exclude: 不清理的子目录 (相对 path)，如永久保存的实时对话录音 realtime
+            evict_candidates: 一遍扫描中保留的淘汰候选数
+        """
+        self.name = name
+        self.path = os.path.abspath(path)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.pattern = pattern
+        self.recursive = recursive
+        self.exclude = {os.path.join(self.path, sub) for sub in exclude or []}
+        self.evict_candidates = evict_candidates
+
+
+class _Pass:
+    """一个目录的一遍扫描 (跨多轮执行)"""
+
+    def __init__(self, policy: CleanupPolicy):
+        self.entries = self._walk(policy.path, policy)
+        self.total_bytes = 0
+        self.files = 0
+        # 最久未使用的候选文件：按 -最近使用时间 组织的大顶堆，堆顶是候选中最近使用的
+        self.candidates: List[Tuple[float, str, int]] = []
+
+    def _walk(self, root: str, policy: CleanupPolicy) -> Iterator[os.DirEntry]:
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if policy.recursive and entry.path not in policy.exclude:
+                            yield from self._walk(entry.path, policy)
+                            _remove_if_empty(entry.path, policy.max_age)
+                    elif entry.is_file(follow_symlinks=False):
+                        if policy.pattern is None or fnmatch.fnmatch(entry.name, policy.pattern):
+                            yield entry
+        except FileNotFoundError:
+            return
+
+    def add_candidate(self, last_used: float, path: str, size: int, limit: int):
+        item = (-last_used, path, size)
+        if len(self.candidates) < limit:
+            heapq.heappush(self.candidates, item)
+        elif item > self.candidates[0]:
+            heapq.heapreplace(self.candidates, item)
+
+
+def _remove_if_empty(path: str, max_age: Optional[float]):
+    """删除过了保留期的空目录 (如 tts 下的子目录)，刚创建的目录可能马上要写入，不删除"""
+    try:
+        if time.time() - os.stat(path).st_mtime > min(max_age or 3600, 3600):
+            os.rmdir(path)
+    except OSError:
+        pass
+
+
+class Janitor:
+    """后台磁盘清理"""
+
+    def __init__(self, policies: List[CleanupPolicy], interval: float = 300,
+                 batch_size: int = 5000, batch_pause: float = 0.2, lock_path: Optional[str] = None):
+        """
+        Args:
+            policies: 清理策略
+            interval: 所有目录扫完一遍后，间隔多久开始下一遍 (秒)
+            batch_size: 每个目录每轮处理的条目数
+            batch_pause: 同一遍扫描中两轮之间的间隔 (秒)
+            lock_path: 进程间互斥的锁文件，None 表示不互斥
+        """
+        self.policies = policies
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._passes: Dict[str, _Pass] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+        self.stats = {policy.name: {'path': policy.path, 'passes': 0, 'scanned': 0,
+                                    'expired': 0, 'evicted': 0, 'reclaimed_bytes': 0,
+                                    'total_bytes': None, 'files': None, 'last_pass': None}
+                      for policy in policies}
+
+    def start(self):
+        """在当前进程中启动清理线程 (gunicorn --preload 时在 fork 之后的 worker 中启动)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                # fork 前打开的锁文件属于父进程
+                self._lock_file = None
+                threading.Thread(target=self._loop, daemon=True, name='janitor').start()
+                logger.info(f"[Janitor] 已启动，清理 {len(self.policies)} 个目录")
+
+    def stop(self):
+        self._stop.set()
+
+    def _acquire_leadership(self) -> bool:
+        """尝试获取锁文件，获取成功后一直持有到进程退出"""
+        if self._lock_file is not None or self.lock_path is None or fcntl is None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        except OSError as e:
+            logger.warning(f"[Janitor] 无法打开锁文件 {self.lock_path}: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"[Janitor] 进程 {os.getpid()} 负责清理")
+        return True
+
+    @property
+    def active(self) -> bool:
+        """本进程是否负责清理"""
+        return self._pid == os.getpid() and (self._lock_file is not None or self.lock_path is None or fcntl is None)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            # 其它进程正在清理
+            if not self._acquire_leadership():
+                self._stop.wait(self.interval)
+                continue
+            try:
+                busy = self.run_once()
+            except Exception as e:
+                logger.error(f"[Janitor] 清理失败: {e}")
+                busy = False
+            self._stop.wait(self.batch_pause if busy else self.interval)
+
+    def run_once(self) -> bool:
+        """
+        每个目录处理一批条目
+
+        Returns:
+            是否还有目录没有扫完本遍
+        """
+        busy = False
+        for policy in self.policies:
+            busy = self._step(policy) or busy
+        return busy
+
+    def run_full(self) -> Dict:
+        """同步执行完整的一遍清理 (命令行或测试使用)"""
+        while self.run_once():
+            pass
+        return self.snapshot()
+
+    def _step(self, policy: CleanupPolicy) -> bool:
+        scan = self._passes.get(policy.name)
+        if scan is None:
+            scan = self._passes[policy.name] = _Pass(policy)
+        now = time.time()
+        stats = self.stats[policy.name]
+        count = 0
+        for entry in islice(scan.entries, self.batch_size):
+            count += 1
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if policy.max_age is not None and now - st.st_mtime > policy.max_age:
+                self._delete(policy, entry.path, st.st_size, 'expired')
+                continue
+            scan.total_bytes += st.st_size
+            scan.files += 1
+            if policy.max_bytes is not None:
+                scan.add_candidate(max(st.st_atime, st.st_mtime), entry.path, st.st_size,
+                                   policy.evict_candidates)
+        with self._lock:
+            stats['scanned'] += count
+        if count == self.batch_size:
+            return True
+
+        # 本遍扫描结束，按配额淘汰
+        if policy.max_bytes is not None and scan.total_bytes > policy.max_bytes:
+            for _, path, size in sorted(scan.candidates, reverse=True):
+                if scan.total_bytes <= policy.max_bytes:
+                    break
+                if self._delete(policy, path, size, 'evicted'):
+                    scan.total_bytes -= size
+                    scan.files -= 1
+        with self._lock:
+            stats['passes'] += 1
+            stats['total_bytes'] = scan.total_bytes
+            stats['files'] = scan.files
+            stats['last_pass'] = int(now)
+        del self._passes[policy.name]
+        return False
+
+    def _delete(self, policy: CleanupPolicy, path: str, size: int, reason: str) -> bool:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"[Janitor] 删除失败 {path}: {e}")
+            return False
+        with self._lock:
+            stats = self.stats[policy.name]
+            stats[reason] += 1
+            stats['reclaimed_bytes'] += size
+        return True
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            policies = {name: dict(stats) for name, stats in self.stats.items()}
+        return {
+            'pid': os.getpid(),
+            # 不负责清理的 worker 统计为空，由持有锁文件的 worker 清理
+            'active': self.active,
+            'reclaimed_bytes': sum(stats['reclaimed_bytes'] for stats in policies.values()),
+            'policies': policies
+        }
+
+
+def _mb(value: int) -> Optional[int]:
+    return value * 1024 * 1024 if value > 0 else None
+
+
+def _seconds(value: float, unit: float) -> Optional[float]:
+    return value * unit if value > 0 else None
+
+
+def create_janitor(config) -> Janitor:
+    """按配置创建清理策略"""
+    root = config.get('LOCAL_STORAGE_PATH', './uploads')
+    temp_dir = config.get('ASR_TEMP_DIR') or os.path.join(root, 'tmp')
+    temp_age = _seconds(config.get('JANITOR_TEMP_RETENTION_MINUTES', 60), 60)
+    policies = [
+        # 用户录音被 voice_relation 引用，默认不清理；实时对话录音 (voice/realtime) 供家人回放，始终保留
+        CleanupPolicy('voice', os.path.join(root, 'voice'),
+                      max_age=_seconds(config.get('JANITOR_VOICE_RETENTION_DAYS', 0), 86400),
+                      max_bytes=_mb(config.get('JANITOR_VOICE_QUOTA_MB', 0)),
+                      exclude=['realtime']),
+        CleanupPolicy('tts', config.get('TTS_OUTPUT_DIR') or os.path.join(root, 'tts'),
+                      max_age=_seconds(config.get('JANITOR_TTS_RETENTION_HOURS', 24), 3600),
+                      max_bytes=_mb(config.get('JANITOR_TTS_QUOTA_MB', 512))),
+        CleanupPolicy('temp', temp_dir, max_age=temp_age, recursive=False),
+    ]
+    # 旧版本把 echotalk_* 临时文件写在系统临时目录
+    system_temp = tempfile.gettempdir()
+    if os.path.abspath(system_temp) != os.path.abspath(temp_dir):
+        policies.append(CleanupPolicy('system_temp', system_temp, max_age=temp_age,
+                                      pattern='echotalk_*', recursive=False))
+    return Janitor(policies,
+                   interval=config.get('JANITOR_INTERVAL', 300),
+                   batch_size=config.get('JANITOR_BATCH', 5000),
+                   lock_path=config.get('JANITOR_LOCK_FILE') or os.path.join(root, '.janitor.lock'))
+
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+
+def get_janitor(config) -> Janitor:
+    """获取进程内唯一的清理器，并确保本进程的清理线程已启动 (每个进程调用，重复调用无副作用)"""
+    global _janitor
+    if _janitor is None:
+        with _janitor_lock:
+            if _janitor is None:
+                _janitor = create_janitor(config)
+    _janitor.start()
+    return _janitor
+
+
+def janitor_snapshot() -> Optional[Dict]:
+    """清理统计，清理器未启动时返回 None"""
+    return _janitor.snapshot() if _janitor else None
@@ -0,0 +1,288 @@
+"""
+大模型请求路由
+在多个 (模型, 接入点) 目标之间路由 chat/completions 请求：
+    - 按目标统计 p50/p95 延迟
+    - 首个请求超过该目标的 p95 仍未返回时，向下一个健康目标发送对冲请求，先返回者胜出，另一个被取消；
+      每个请求各占一次调用配额，对冲时没有立即可用的配额则不对冲
+    - 每个目标有独立的熔断器，连续失败后暂时跳过
+"""
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Dict, Tuple, Callable
+
+import requests
+
+from .resilience import CircuitBreaker, DeadlineExceeded, error_reason, is_retryable
+from .metrics import UPSTREAM_SECONDS, UPSTREAM_ERRORS
+from .tracing import span, KIND_CLIENT
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """滑动窗口延迟统计"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms: float):
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(int(len(ordered) * p / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class RouteTarget:
+    """路由目标：一个模型在一个接入点上"""
+
+    def __init__(self, model: str, base_url: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.errors = 0
+        self.hedges_won = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.base_url}"
+
+    def snapshot(self) -> Dict:
+        return {
+            'name': self.name,
+            'state': self.breaker.state,
+            'samples': len(self.latency),
+            'p50_ms': self.latency.percentile(50),
+            'p95_ms': self.latency.percentile(95),
+            'errors': self.errors,
+            'hedges_won': self.hedges_won
+        }
+
+
+class _Attempt:
+    """
+    一次对某个目标的请求
+    取消时关闭响应以中断响应体的读取；等待响应头期间无法中断，
+    落败的请求会继续等到响应头返回或超时，结果被丢弃
+    """
+
+    def __init__(self, target: RouteTarget, hedged: bool, release: Optional[Callable[[], None]] = None):
+        self.target = target
+        self.hedged = hedged
+        self.release = release
+        self.session = requests.Session()
+        self.response = None
+        self.cancelled = False
+
+    def run(self, payload: Dict, headers: Dict[str, str], timeout: float) -> Dict:
+        with span('dashscope.chat', KIND_CLIENT, target=self.target.name, hedged=self.hedged):
+            return self._run(payload, headers, timeout)
+
+    def _run(self, payload: Dict, headers: Dict[str, str], timeout: float) -> Dict:
+        start = time.time()
+        try:
+            if self.cancelled:
+                raise RuntimeError('请求已取消')
+            self.response = self.session.post(
+                f"{self.target.base_url}/chat/completions",
+                headers=headers,
+                json=dict(payload, model=self.target.model),
+                timeout=timeout,
+                stream=True
+            )
+            self.response.raise_for_status()
+            result = self.response.json()
+        except BaseException as e:
+            if self.cancelled:
+                # 被取消的请求不说明目标是否健康，只归还半开状态的探测名额
+                self.target.breaker.release_probe()
+                raise
+            self.target.errors += 1
+            UPSTREAM_SECONDS.observe(time.time() - start, api='chat')
+            UPSTREAM_ERRORS.inc(api='chat', reason=error_reason(e))
+            if isinstance(e, Exception) and is_retryable(e):
+                self.target.breaker.record_failure()
+            else:
+                # 429 以外的 4xx (上下文超长、鉴权失败等) 是请求本身的问题，不计入目标的熔断
+                self.target.breaker.release_probe()
+            raise
+        finally:
+            if self.response is not None:
+                self.response.close()
+            self.session.close()
+            if self.release is not None:
+                self.release()
+        UPSTREAM_SECONDS.observe(time.time() - start, api='chat')
+        self.target.latency.add((time.time() - start) * 1000)
+        self.target.breaker.record_success()
+        return result
+
+    def cancel(self):
+        """取消请求：已收到响应头时关闭响应，使读取响应体立即失败"""
+        self.cancelled = True
+        response = self.response
+        if response is not None:
+            response.close()
+        self.session.close()
+
+
+class LLMRouter:
+    """带对冲请求与熔断的大模型路由"""
+
+    def __init__(self,
+                 targets: List[RouteTarget],
+                 hedge_min_ms: float = 500,
+                 hedge_max_ms: float = 5000,
+                 hedge_default_ms: float = 2000,
+                 min_samples: int = 20,
+                 max_workers: int = 16):
+        self.targets = targets
+        self.hedge_min_ms = hedge_min_ms
+        self.hedge_max_ms = hedge_max_ms
+        self.hedge_default_ms = hedge_default_ms
+        self.min_samples = min_samples
+        self.hedges_sent = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-router')
+
+    def _hedge_delay(self, target: RouteTarget) -> float:
+        """对冲等待时间 (秒)：样本足够时取该目标的 p95，并限制在 [min, max] 范围内"""
+        p95 = target.latency.percentile(95) if len(target.latency) >= self.min_samples else None
+        delay_ms = p95 if p95 is not None else self.hedge_default_ms
+        return min(max(delay_ms, self.hedge_min_ms), self.hedge_max_ms) / 1000
+
+    def complete(self, payload: Dict, headers: Dict[str, str], timeout: float,
+                 acquire_quota: Optional[Callable[[Optional[float]], Callable[[], None]]] = None
+                 ) -> Tuple[Dict, RouteTarget]:
+        """
+        发送非流式 chat/completions 请求
+
+        Args:
+            payload: 请求体 (model 字段会被目标的模型覆盖)
+            headers: 请求头
+            timeout: 整体超时 (秒)
+            acquire_quota: 每发出一个请求前调用，参数为最长排队时间 (None 为默认值，0 为不排队)，
+                返回释放配额的函数；None 表示不限流
+
+        Returns:
+            (响应 JSON, 实际应答的目标)
+
+        Raises:
+            RuntimeError: 没有可用目标或全部失败
+            DeadlineExceeded: 配额排队超时
+        """
+        deadline = time.time() + timeout
+        # 这里只按状态筛选，发出请求时才调用 allow() 占用半开状态的探测名额
+        candidates = [target for target in self.targets if target.breaker.state != 'open']
+        if len(candidates) == 1:
+            # 只有一个可用目标时，对冲请求发往同一目标的新连接
+            candidates.append(candidates[0])
+
+        pending = {}
+        last_error = None
+
+        def launch_next(hedged: bool) -> bool:
+            """向下一个放行的目标发出请求，没有可用目标时返回 False"""
+            while candidates:
+                target = candidates.pop(0)
+                release = None
+                if acquire_quota is not None:
+                    try:
+                        # 对冲请求不排队：没有立即可用的配额时不对冲，目标留作失败后的备选
+                        release = acquire_quota(0 if hedged else None)
+                    except DeadlineExceeded:
+                        if not hedged:
+                            raise
+                        candidates.insert(0, target)
+                        return False
+                if not target.breaker.allow():
+                    if release is not None:
+                        release()
+                    continue
+                attempt = _Attempt(target, hedged, release)
+                remaining = max(deadline - time.time(), 0.1)
+                # 在线程池中继续当前的 trace
+                future = self._executor.submit(contextvars.copy_context().run, attempt.run, payload, headers, remaining)
+                pending[future] = attempt
+                return True
+            return False
+
+        if not launch_next(False):
+            raise RuntimeError('所有大模型目标均已熔断')
+        hedge_at = time.time() + self._hedge_delay(next(iter(pending.values())).target)
+
+        try:
+            while pending:
+                now = time.time()
+                if now >= deadline:
+                    break
+                # 还有备选目标时，最多等到对冲时间点
+                wait_until = min(hedge_at, deadline) if candidates else deadline
+                done, _ = wait(list(pending), timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    attempt = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"[Router] {attempt.target.name} 请求失败: {e}")
+                        if not is_retryable(e):
+                            # 请求本身有问题，换目标也会失败
+                            raise RuntimeError(f'大模型请求失败: {e}') from e
+                        continue
+                    if attempt.hedged:
+                        attempt.target.hedges_won += 1
+                    return result, attempt.target
+
+                if not candidates:
+                    continue
+                if not pending:
+                    # 当前请求都已失败，立即切换到下一个目标
+                    if launch_next(False):
+                        hedge_at = time.time() + self._hedge_delay(next(iter(pending.values())).target)
+                elif time.time() >= hedge_at:
+                    if launch_next(True):
+                        attempt = list(pending.values())[-1]
+                        logger.info(f"[Router] 请求超过p95仍未返回，已向 {attempt.target.name} 发送对冲请求")
+                        self.hedges_sent += 1
+                    hedge_at = deadline
+        finally:
+            for attempt in pending.values():
+                attempt.cancel()
+
+        raise RuntimeError(f'大模型请求失败: {last_error or "超时"}')
+
+    def snapshot(self) -> Dict:
+        return {
+            'hedges_sent': self.hedges_sent,
+            'targets': [target.snapshot() for target in self.targets]
+        }
+
+
+def parse_targets(spec: str, default_url: str) -> List[Tuple[str, str]]:
+    """
+    解析路由目标配置
+    格式: "model[@base_url], model[@base_url], ..."，省略 base_url 时使用默认接入点
+    """
+    targets = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        model, _, url = item.partition('@')
+        targets.append((model.strip(), url.strip() or default_url))
+    return targets
@@ -0,0 +1,187 @@
+"""
+日志
+替代各模块中的 print：
+    - 每个模块使用 logging.getLogger(__name__)，级别由 LOG_LEVEL 和按模块的 LOG_LEVELS 控制
+    - 记录在调用线程中只放入队列，由后台线程格式化并写入 stderr 和 LOG_FILE，不阻塞请求和实时语音线程
+    - LOG_JSON 开启时每条记录输出一行 JSON，extra 中的字段作为 JSON 字段
+    - 高频事件 (音频帧、识别中间结果等) 带上 extra={'rate_key': ...}，同一个 key 每秒最多输出 LOG_RATE_LIMIT 条，
+      被丢弃的条数记在下一条输出的 suppressed 字段中
+
+识别文本、对话内容等用户数据只在 DEBUG 级别输出
+"""
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+from typing import Dict, Optional
+
+# LogRecord 的内置属性，其余属性视为 extra 字段
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'rate_key'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按 rate_key 限流：同一个 key 每秒最多放行 per_second 条 (令牌桶)
+    没有 rate_key 的记录不受影响
+    """
+
+    def __init__(self, per_second: float = 1):
+        super().__init__()
+        self.per_second = per_second
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, 'rate_key', None)
+        if key is None or self.per_second <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            # [令牌数, 上次补充时间, 被丢弃的条数]
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.per_second, now, 0]
+            bucket[0] = min(self.per_second, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只在调用线程中展开参数和异常堆栈 (参数可能随后被修改)，格式化留给写日志的线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_QueueHandler] = None
+_lock = threading.Lock()
+
+
+def _parse_levels(value: str) -> Dict[str, str]:
+    """解析 'app.routes.realtime=INFO, pymongo=WARNING'"""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _start_listener(handlers):
+    global _listener
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child(handlers):
+    # fork 时队列中尚未写出的记录属于父进程，由父进程写出，子进程使用新的队列
+    _queue_handler.queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+    _start_listener(handlers)
+
+
+def setup_logging(config):
+    """
+    按配置初始化日志 (重复调用无副作用)
+
+    gunicorn --preload 时在主进程中初始化，fork 出的 worker 中重新启动写日志的线程
+    """
+    global _queue_handler
+    with _lock:
+        if _queue_handler is not None:
+            return
+
+        if config.get('LOG_JSON', True):
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(config.get('LOG_FORMAT') or logging.BASIC_FORMAT)
+        handlers = [logging.StreamHandler(sys.stderr)]
+        log_file = config.get('LOG_FILE')
+        if log_file:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            # 多个 worker 追加写同一个文件，由 logrotate 轮转，不使用 RotatingFileHandler
+            handlers.append(logging.handlers.WatchedFileHandler(log_file, encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue_handler = _QueueHandler(queue.Queue(maxsize=config.get('LOG_QUEUE_SIZE', 10000)))
+        _queue_handler.addFilter(RateLimitFilter(config.get('LOG_RATE_LIMIT', 1)))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(config.get('LOG_LEVEL', 'INFO').upper())
+        for name, level in _parse_levels(config.get('LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _start_listener(handlers)
+        atexit.register(flush_logging)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: _restart_in_child(handlers))
+
+
+def flush_logging():
+    """写出队列中的全部记录 (进程退出前调用)"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def logging_snapshot() -> Optional[dict]:
+    """日志队列状态，未初始化时返回 None"""
+    if _queue_handler is None:
+        return None
+    return {'queued': _queue_handler.queue.qsize(), 'dropped': _queue_handler.dropped}
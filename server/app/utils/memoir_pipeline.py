@@ -0,0 +1,249 @@
+"""
+长会话回忆录生成流水线 (map-reduce)
+将对话分段 -> 并行生成分段摘要 -> 基于摘要合成回忆录
+分段摘要按内容哈希缓存，会话追加新消息后只需重新处理末尾分段
+摘要最多 max_levels 层；层数用完或摘要不再变短时，按比例截断各段摘要
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, List, Dict, Callable, Tuple
+from flask import current_app
+
+from .database import mongo_db
+from .prompt_builder import PromptBuilder, estimate_tokens, estimate_tokens_batch, format_chat_line, make_messages
+from .prompts import CHUNK_SUMMARY_PROMPT, MERGE_SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+
+# 分段摘要提示词版本，修改提示词后递增，使旧缓存失效
+SUMMARY_PROMPT_VERSION = 1
+
+
+def split_into_chunks(lines: List[str], chunk_tokens: int) -> List[List[str]]:
+    """
+    按行切分文本，每段不超过 chunk_tokens 个 token
+    从头开始贪心切分，保证追加新行时前面已完成的分段保持不变
+
+    Args:
+        lines: 文本行列表
+        chunk_tokens: 每段最大 token 数
+
+    Returns:
+        分段列表
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line, line_tokens in zip(lines, estimate_tokens_batch(lines)):
+        line_tokens += 1
+        if current and current_tokens + line_tokens > chunk_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断文本使估算的 token 数不超过 max_tokens"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+    length = int(len(text) * max_tokens / tokens)
+    while length > 0 and estimate_tokens(text[:length]) > max_tokens:
+        length = int(length * 0.9)
+    return text[:length]
+
+
+class SummaryCache:
+    """分段摘要缓存，持久化在 MongoDB，多个 worker 共享；进程内保留最近使用的 max_local 条"""
+
+    COLLECTION = 'memoir_chunk_summary'
+
+    def __init__(self, max_local: int = 1000):
+        # MongoDB 不可用时的进程内兜底 (LRU)
+        self.max_local = max_local
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, summary: str):
+        with self._lock:
+            self._local[key] = summary
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
+
+    @staticmethod
+    def make_key(model: str, level: int, text: str) -> str:
+        raw = f"v{SUMMARY_PROMPT_VERSION}|{model}|{level}|{text}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._local.get(key)
+            if summary is not None:
+                self._local.move_to_end(key)
+                return summary
+        try:
+            doc = mongo_db.get_collection(self.COLLECTION).find_one({'_id': key}, {'summary': 1})
+            if doc:
+                self._remember(key, doc['summary'])
+                return doc['summary']
+        except Exception as e:
+            logger.warning(f"[Memoir] 读取摘要缓存失败: {e}")
+        return None
+
+    def set(self, key: str, summary: str, level: int):
+        self._remember(key, summary)
+        try:
+            mongo_db.get_collection(self.COLLECTION).update_one(
+                {'_id': key},
+                {'$set': {'summary': summary, 'level': level, 'create_time': datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"[Memoir] 写入摘要缓存失败: {e}")
+
+
+class MemoirPipeline:
+    """分层摘要回忆录生成器"""
+
+    def __init__(self, client):
+        self.client = client
+        self.cache = SummaryCache()
+
+    @property
+    def direct_tokens(self) -> int:
+        """素材不超过该 token 数时直接单次生成，受模型上下文窗口和 memoir_prompt_tokens 共同限制"""
+        builder = PromptBuilder(self.client.chat_model,
+                                limit=current_app.config.get('MEMOIR_PROMPT_TOKENS', 6000))
+        return builder.budget
+
+    @property
+    def chunk_tokens(self) -> int:
+        """分段摘要时每段最大 token 数"""
+        return current_app.config.get('MEMOIR_CHUNK_TOKENS', 2000)
+
+    @property
+    def max_levels(self) -> int:
+        """最多摘要的层数"""
+        return current_app.config.get('MEMOIR_MAX_LEVELS', 3)
+
+    @property
+    def max_workers(self) -> int:
+        """并行摘要的最大线程数"""
+        return current_app.config.get('MEMOIR_MAX_WORKERS', 4)
+
+    def _summarize_chunks(self, chunks: List[str], level: int, prompt: str) -> Optional[List[str]]:
+        """
+        并行生成分段摘要，命中缓存的分段直接复用
+
+        Args:
+            chunks: 分段文本列表
+            level: 摘要层级 (1 为原始对话的摘要)
+            prompt: 系统提示词
+
+        Returns:
+            与 chunks 顺序一致的摘要列表，任一分段失败返回 None
+        """
+        model = self.client.chat_model
+        keys = [self.cache.make_key(model, level, chunk) for chunk in chunks]
+        summaries = [self.cache.get(key) for key in keys]
+        pending = [i for i, summary in enumerate(summaries) if summary is None]
+
+        logger.info(f"[Memoir] 第{level}层: 共{len(chunks)}段，缓存命中{len(chunks) - len(pending)}段")
+
+        if pending:
+            app = current_app._get_current_object()
+
+            def summarize(index: int) -> Optional[str]:
+                with app.app_context():
+                    messages = make_messages(prompt, chunks[index], model)
+                    return self.client.chat_completion(messages, temperature=0.3, max_tokens=800,
+                                                       purpose='memoir_summary')
+
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                results = list(executor.map(summarize, pending))
+
+            for index, result in zip(pending, results):
+                if not result:
+                    logger.warning(f"[Memoir] 第{level}层第{index + 1}段摘要失败")
+                    return None
+                summaries[index] = result
+                self.cache.set(keys[index], result, level)
+
+        return summaries
+
+    def build_source_text(self, chat_history: List[Dict[str, str]]) -> Tuple[Optional[str], bool]:
+        """
+        生成用于撰写回忆录的素材文本
+        对话较短时直接返回对话原文，较长时逐层摘要直到长度满足要求；
+        超过 max_levels 层或摘要不再变短 (如模型原样复述) 时按比例截断各段摘要
+
+        Args:
+            chat_history: 聊天历史 [{"role": "user/ai", "content": "..."}]
+
+        Returns:
+            (素材文本, 是否为摘要)，摘要失败时素材文本为 None
+        """
+        lines = [format_chat_line(msg) for msg in chat_history]
+        text = "\n".join(lines)
+        direct_tokens = self.direct_tokens
+        if estimate_tokens(text) <= direct_tokens:
+            return text, False
+
+        level = 1
+        prompt = CHUNK_SUMMARY_PROMPT
+        tokens = estimate_tokens(text)
+        while tokens > direct_tokens:
+            if level > self.max_levels:
+                logger.warning(f"[Memoir] 摘要超过{self.max_levels}层仍超出长度，截断摘要")
+                break
+            chunks = ["\n".join(chunk) for chunk in split_into_chunks(lines, self.chunk_tokens)]
+            summaries = self._summarize_chunks(chunks, level, prompt)
+            if summaries is None:
+                return None, True
+            lines = summaries
+            text = "\n\n".join(summaries)
+            previous, tokens = tokens, estimate_tokens(text)
+            # 已经只剩一段时无需继续合并
+            if len(chunks) == 1:
+                break
+            if tokens >= previous:
+                logger.warning(f"[Memoir] 第{level}层摘要没有变短 ({previous} -> {tokens} tokens)，截断摘要")
+                break
+            level += 1
+            prompt = MERGE_SUMMARY_PROMPT
+
+        if tokens > direct_tokens:
+            # 每段摘要按相同的 token 预算截断，保留整个会话各部分的内容
+            per_chunk = direct_tokens // len(lines) - 1
+            text = "\n\n".join(truncate_to_tokens(line, per_chunk) for line in lines)
+        return text, True
+
+    def generate(self, chat_history: List[Dict[str, str]],
+                 compose: Callable[[str, bool], Optional[str]]) -> Optional[str]:
+        """
+        生成回忆录
+
+        Args:
+            chat_history: 聊天历史
+            compose: 合成函数 compose(素材文本, 是否为摘要) -> 文章
+
+        Returns:
+            生成的回忆录文章
+        """
+        source, summarized = self.build_source_text(chat_history)
+        if source is None:
+            return None
+        return compose(source, summarized)
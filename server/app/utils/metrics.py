@@ -0,0 +1,358 @@
+"""
+运行指标
+进程内的计数器 / 仪表 / 直方图，由 /metrics 以 Prometheus 文本格式输出
+
+多进程 (gunicorn 多个 worker)：配置 METRICS_DIR 后，每个进程定期把自己的指标写入
+METRICS_DIR/metrics_<pid>.json，/metrics 合并目录中所有进程的文件：
+    - 计数器和直方图按进程求和，已退出进程的最终值继续计入，直到文件超过 dead_ttl 被删除
+    - 仪表只合并存活进程的值
+其它进程的数据最多滞后 flush_interval 秒；未配置 METRICS_DIR 时只输出本进程的指标
+"""
+import os
+import json
+import time
+import glob
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Callable, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def export(self) -> Dict:
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {'type': self.kind, 'help': self.documentation, 'labels': list(self.labelnames), 'samples': samples}
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """分桶统计的耗时分布"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [各桶计数 (非累计)..., 总和, 总数]
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块的耗时 (秒)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def export(self) -> Dict:
+        data = super().export()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics[metric.name] = metric
+
+    def on_collect(self, func: Callable[[], None]):
+        """注册采集前执行的回调，用于刷新连接池大小、队列长度等仪表"""
+        self._collectors.append(func)
+        return func
+
+    def export(self) -> Dict[str, Dict]:
+        for func in self._collectors:
+            try:
+                func()
+            except Exception as e:
+                logger.warning(f"[Metrics] 采集失败: {e}")
+        return {name: metric.export() for name, metric in self._metrics.items()}
+
+
+REGISTRY = Registry()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge(snapshots: List[Tuple[Dict, bool]]) -> Dict[str, Dict]:
+    """
+    合并多个进程导出的指标
+
+    Args:
+        snapshots: [(进程导出的指标, 进程是否存活)]
+
+    Returns:
+        合并后的指标，格式与 Registry.export 相同
+    """
+    merged: Dict[str, Dict] = {}
+    for metrics, alive in snapshots:
+        for name, data in metrics.items():
+            if data['type'] == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, dict(data, samples={}))
+            for labels, value in data['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+    for data in merged.values():
+        data['samples'] = [[list(key), value] for key, value in data['samples'].items()]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: List[str], values: List[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(metrics: Dict[str, Dict]) -> str:
+    """输出 Prometheus 文本格式 (0.0.4)"""
+    lines = []
+    for name in sorted(metrics):
+        data = metrics[name]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        names = data['labels']
+        for values, value in sorted(data['samples']):
+            if data['type'] != 'histogram':
+                lines.append(f"{name}{_labels(names, values)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(data['buckets'], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, values, ('le', _number(bound)))} {cumulative}")
+            # 超过最大桶的样本只计入 +Inf
+            lines.append(f"{name}_bucket{_labels(names, values, ('le', '+Inf'))} {value[-1]}")
+            lines.append(f"{name}_sum{_labels(names, values)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(names, values)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+class MultiProcessExporter:
+    """把本进程的指标定期写入共享目录，并合并所有进程的指标"""
+
+    def __init__(self, registry: Registry, directory: str, flush_interval: float = 5, dead_ttl: float = 3600):
+        self.registry = registry
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.dead_ttl = dead_ttl
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def ensure_started(self):
+        """在当前进程中启动定期写入 (gunicorn --preload 时在 fork 之后的 worker 中调用)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._loop, daemon=True, name='metrics-flush').start()
+
+    def _loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"[Metrics] 写入指标失败: {e}")
+            time.sleep(self.flush_interval)
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics_{pid}.json")
+
+    def flush(self):
+        pid = os.getpid()
+        path = self._path(pid)
+        temp_path = f"{path}.tmp"
+        # 后台线程和抓取请求都会写入，共用同一个临时文件
+        with self._flush_lock:
+            with open(temp_path, 'w') as f:
+                json.dump(self.registry.export(), f)
+            os.replace(temp_path, path)
+
+    def collect(self) -> Dict[str, Dict]:
+        self.flush()
+        now = time.time()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+                alive = _pid_alive(pid)
+                if not alive and now - os.path.getmtime(path) > self.dead_ttl:
+                    os.unlink(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append((json.load(f), alive))
+            except (ValueError, OSError):
+                continue
+        return merge(snapshots)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def init_metrics(config) -> Optional[MultiProcessExporter]:
+    """按配置启用多进程指标 (每个进程调用，重复调用无副作用)"""
+    global _exporter
+    directory = config.get('METRICS_DIR')
+    if not directory:
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = MultiProcessExporter(REGISTRY, directory,
+                                                 flush_interval=config.get('METRICS_FLUSH_INTERVAL', 5))
+    _exporter.ensure_started()
+    return _exporter
+
+
+def generate_latest() -> str:
+    """当前的全部指标 (Prometheus 文本格式)"""
+    metrics = _exporter.collect() if _exporter else REGISTRY.export()
+    return render(metrics)
+
+
+# ============================================================
+# 指标定义
+# ============================================================
+HTTP_REQUEST_SECONDS = Histogram(
+    'echotalk_http_request_duration_seconds', 'HTTP 请求处理耗时 (到响应开始返回)',
+    ['blueprint', 'route', 'method'])
+HTTP_REQUESTS = Counter(
+    'echotalk_http_requests_total', 'HTTP 请求数', ['blueprint', 'route', 'method', 'status'])
+
+UPSTREAM_SECONDS = Histogram(
+    'echotalk_upstream_request_duration_seconds', '百炼平台单次调用耗时 (每次重试单独计入)', ['api'])
+UPSTREAM_ERRORS = Counter(
+    'echotalk_upstream_errors_total', '百炼平台调用失败次数', ['api', 'reason'])
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    'echotalk_llm_first_token_seconds', '流式对话补全的首 token 延迟', ['purpose'])
+
+REALTIME_TURN_SECONDS = Histogram(
+    'echotalk_realtime_turn_stage_seconds',
+    '实时对话一轮的各阶段耗时: vad_wait 最后一次识别结果到判定说完 / '
+    'llm_total 说完到回复生成完毕 (追问为非流式生成) / tts_first_byte 开始合成到首个音频块 / '
+    'tts_total 合成总耗时',
+    ['stage'])
+SPECULATIONS = Counter(
+    'echotalk_speculations_total', '实时对话投机预取: started 发起 / committed 被采用 / wasted 作废', ['outcome'])
+SPECULATION_SAVED_SECONDS = Counter('echotalk_speculation_saved_seconds_total', '采用投机结果节省的等待时间')
+REALTIME_SESSIONS = Gauge('echotalk_realtime_sessions', '进行中的实时对话 WebSocket 会话数')
+REALTIME_TURNS_IN_FLIGHT = Gauge('echotalk_realtime_turns_in_flight', '正在生成回复的实时对话轮数')
+
+DB_QUERY_SECONDS = Histogram(
+    'echotalk_db_query_duration_seconds', '数据库查询耗时 (MySQL 含建立连接)', ['db'])
+DB_ERRORS = Counter('echotalk_db_errors_total', '数据库查询失败次数', ['db'])
+DB_CONNECTIONS = Gauge(
+    'echotalk_db_connections', '数据库连接数: MySQL 为正在使用的连接，MongoDB 为连接池中已建立 (open) 和被占用 (checked_out) 的连接',
+    ['db', 'state'])
+
+EVENT_LOOP_BLOCKED = Counter('echotalk_event_loop_blocked_total', '协程阻塞 gevent 事件循环超过阈值的次数 (需开启阻塞检测)')
+
+QUEUE_DEPTH = Gauge('echotalk_queue_depth', '后台任务队列中等待或执行中的任务数', ['queue'])
+POOL_CONNECTIONS = Gauge('echotalk_pool_connections', '预热连接池中的空闲连接数', ['pool'])
+
+
+@REGISTRY.on_collect
+def _collect_queues():
+    """刷新各连接池和后台队列的仪表"""
+    from .session_recorder import recorder_stats
+    from .asr_pool import asr_pool_snapshot
+    from .tts_pool import synthesizer_pool_snapshot
+    from . import audio_transcoder
+
+    QUEUE_DEPTH.set(recorder_stats.snapshot()['pending'], queue='recording')
+    transcoder = audio_transcoder._transcoder
+    QUEUE_DEPTH.set(transcoder.snapshot()['in_flight'] if transcoder else 0, queue='transcode')
+    asr_pool = asr_pool_snapshot()
+    POOL_CONNECTIONS.set(asr_pool['ready'] if asr_pool else 0, pool='asr')
+    tts_pool = synthesizer_pool_snapshot()
+    POOL_CONNECTIONS.set(tts_pool['idle'] if tts_pool else 0, pool='tts')
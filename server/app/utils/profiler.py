@@ -0,0 +1,390 @@
+"""
+性能剖析
+线上 worker 的延迟毛刺在本地难以复现，这里提供两个可以在运行中的进程上按需开启的工具：
+
+    - SamplingProfiler: 采样剖析。独立的系统线程按固定间隔读取 sys._current_frames()，
+      统计各线程的调用栈，输出折叠栈 (flamegraph.pl / speedscope 可直接读取) 或 SVG 火焰图。
+      gevent 下所有协程共用一个系统线程，采到的是当时正在运行的协程的调用栈，
+      Hub.run 表示事件循环空闲
+    - BlockingMonitor: 事件循环阻塞检测。在 hub 所在线程安装 greenlet 切换钩子，
+      另一个系统线程定期检查：同一个协程连续运行超过阈值即视为阻塞了 hub
+      (同步的 requests / time.sleep / pymysql 调用等)，记录该协程的调用栈和实际阻塞时长
+
+两个工具都使用未被 monkey patch 的系统线程和 sleep，协程阻塞 hub 时照常工作
+"""
+import os
+import sys
+import time
+import zlib
+import sysconfig
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from html import escape
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(RuntimeError):
+    """本进程已有剖析在进行中"""
+
+
+def _real_thread_api():
+    """未被 gevent monkey patch 的 start_new_thread / sleep"""
+    if 'gevent.monkey' in sys.modules:
+        from gevent.monkey import get_original
+        return get_original('_thread', 'start_new_thread'), get_original('time', 'sleep')
+    import _thread
+    return _thread.start_new_thread, time.sleep
+
+
+def wait(seconds: float):
+    """等待 seconds 秒：在 gevent hub 所在线程中让出 hub，否则阻塞当前线程"""
+    if 'gevent' in sys.modules:
+        from gevent._hub_local import get_hub_if_exists
+        if get_hub_if_exists() is not None:
+            import gevent
+            gevent.sleep(seconds)
+            return
+    time.sleep(seconds)
+
+
+# 第三方库和标准库的文件只显示包内路径
+_LIB_DIRS = sorted({os.path.join(sysconfig.get_paths()[name], '') for name in ('purelib', 'platlib', 'stdlib')},
+                   key=len, reverse=True)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    for prefix in _LIB_DIRS:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+            break
+    else:
+        # 项目内的文件显示相对路径
+        filename = os.path.relpath(filename) if os.path.isabs(filename) else filename
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _collapse(frame, max_depth: int) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < max_depth:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """按固定间隔采样所有线程的调用栈"""
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64):
+        """
+        Args:
+            interval: 采样间隔 (秒)
+            max_depth: 每个调用栈最多保留的层数 (从栈顶算起)
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._done = threading.Event()
+
+    def _run(self, seconds: float, sleep):
+        own = threading.get_ident()
+        names = {}
+        started = time.perf_counter()
+        deadline = started + seconds
+        try:
+            while time.perf_counter() < deadline:
+                frames = sys._current_frames()
+                if len(names) != len(frames):
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = [f"[{names.get(ident, ident)}]"] + _collapse(frame, self.max_depth)
+                    self.stacks[';'.join(stack)] += 1
+                del frames
+                self.samples += 1
+                sleep(self.interval)
+        finally:
+            self.duration = time.perf_counter() - started
+            self._done.set()
+
+    def run(self, seconds: float) -> 'SamplingProfiler':
+        """
+        采样 seconds 秒后返回 (期间当前协程让出 hub)
+
+        Args:
+            seconds: 采样时长
+
+        Returns:
+            self
+        """
+        start_new_thread, sleep = _real_thread_api()
+        self.started_at = time.time()
+        start_new_thread(self._run, (seconds, sleep))
+        wait(seconds)
+        while not self._done.is_set():
+            wait(0.01)
+        return self
+
+    def collapsed(self) -> str:
+        """折叠栈格式：每行 '帧;帧;帧 次数'"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 20) -> List[Dict]:
+        """按自身采样数 (栈顶函数) 排列的热点"""
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        return [{'frame': frame, 'samples': count} for frame, count in own.most_common(limit)]
+
+    def flamegraph(self, title: str = 'EchoTalk') -> str:
+        """SVG 火焰图"""
+        return render_flamegraph(self.stacks, title=f"{title} ({self.samples} samples, {self.duration:.1f}s)")
+
+
+def render_flamegraph(stacks: Dict[str, int], title: str = '', width: int = 1200, row: int = 16) -> str:
+    """
+    把折叠栈渲染为 SVG 火焰图
+
+    Args:
+        stacks: {折叠栈: 采样数}
+        title: 标题
+        width: 图宽 (像素)
+        row: 每层高度 (像素)
+
+    Returns:
+        SVG 文本
+    """
+    # 前缀树: 节点为 [名称, 采样数, {子节点}]
+    root = ['all', 0, {}]
+    for stack, count in stacks.items():
+        root[1] += count
+        node = root
+        for frame in stack.split(';'):
+            child = node[2].get(frame)
+            if child is None:
+                child = node[2][frame] = [frame, 0, {}]
+            child[1] += count
+            node = child
+
+    total = root[1] or 1
+    rects: List[Tuple[float, int, float, str, int]] = []
+
+    def layout(node, x: float, depth: int):
+        rects.append((x, depth, node[1] / total * width, node[0], node[1]))
+        for child in sorted(node[2].values(), key=lambda n: n[0]):
+            layout(child, x, depth + 1)
+            x += child[1] / total * width
+
+    layout(root, 0.0, 0)
+    depth = max((r[1] for r in rects), default=0) + 1
+    height = depth * row + 40
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="Verdana" font-size="11">',
+        '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{escape(title)}</text>',
+    ]
+    for x, level, w, name, count in rects:
+        if w < 0.3:
+            continue
+        y = height - (level + 1) * row - 4
+        # 按名称取稳定的暖色，同一函数在不同位置颜色一致
+        hue = zlib.crc32(name.encode()) % 50
+        label = escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},80%,60%)" rx="2"/>'
+        )
+        chars = int(w / 7)
+        if chars >= 3:
+            text = name if len(name) <= chars else name[:chars - 2] + '..'
+            parts.append(f'<text x="{x + 3:.1f}" y="{y + row - 4}">{escape(text)}</text>')
+        parts.append('</g>')
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+_profile_lock = threading.Lock()
+
+
+def profile(seconds: float, interval: float = 0.01) -> SamplingProfiler:
+    """
+    对本进程采样剖析 seconds 秒 (同一时间只允许一个)
+
+    Raises:
+        ProfilerBusy: 已有剖析在进行中
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy('已有剖析在进行中')
+    try:
+        return SamplingProfiler(interval=interval).run(seconds)
+    finally:
+        _profile_lock.release()
+
+
+class BlockingMonitor:
+    """检测长时间占用 gevent hub 的协程"""
+
+    def __init__(self, threshold: float = 0.1, history: int = 50):
+        """
+        Args:
+            threshold: 同一协程连续运行超过多久视为阻塞 (秒)
+            history: 保留最近多少条阻塞记录
+        """
+        self.threshold = threshold
+        self.reports: deque = deque(maxlen=history)
+        self.stats = {'blocked': 0, 'max_blocked_ms': 0.0}
+        self._hub = None
+        self._hub_thread = None
+        self._previous_trace = None
+        # (切换时间, 切换到的协程, 序号)，由 hub 线程整体替换，监控线程只读
+        self._switch = None
+        self._seq = 0
+        # 正在阻塞的那次切换的序号和记录，协程让出 hub 时补上实际阻塞时长
+        self._blocked_seq = -1
+        self._blocked_report = None
+        self._running = False
+        # 每次 start 加一，停止后重新开启时旧的监控线程自行退出
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """在 hub 所在线程中调用 (gevent 服务器的主线程或请求协程中)"""
+        import greenlet
+        from gevent import get_hub
+        with self._lock:
+            if self._running:
+                return
+            self._hub = get_hub()
+            self._hub_thread = threading.get_ident()
+            self._seq = 0
+            self._blocked_seq = -1
+            self._switch = (time.perf_counter(), greenlet.getcurrent(), 0)
+            self._previous_trace = greenlet.settrace(self._on_switch)
+            self._running = True
+            self._generation += 1
+        start_new_thread, sleep = _real_thread_api()
+        start_new_thread(self._watch, (sleep, self._generation))
+        logger.info(f"[Profiler] 事件循环阻塞检测已开启，阈值 {self.threshold * 1000:.0f}ms")
+
+    def stop(self):
+        """在 start 所在的线程中调用"""
+        import greenlet
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            greenlet.settrace(self._previous_trace)
+            self._previous_trace = None
+
+    def _on_switch(self, event, args):
+        # 在 hub 线程的每次协程切换时调用，只做最少的工作
+        now = time.perf_counter()
+        if self._blocked_seq == self._seq:
+            self._finish_blocked(now)
+        self._seq += 1
+        self._switch = (now, args[1], self._seq)
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _finish_blocked(self, now: float):
+        report = self._blocked_report
+        self._blocked_seq = -1
+        if report is None:
+            return
+        blocked_ms = round((now - report['_started']) * 1000, 1)
+        report['blocked_ms'] = blocked_ms
+        report['finished'] = True
+        with self._lock:
+            self.stats['max_blocked_ms'] = max(self.stats['max_blocked_ms'], blocked_ms)
+        logger.warning(f"[Profiler] 协程阻塞事件循环 {blocked_ms}ms: {report['greenlet']} @ {report['where']}",
+                       extra={'rate_key': 'profiler.blocked', 'blocked_ms': blocked_ms})
+
+    def _watch(self, sleep, generation: int):
+        while self._running and self._generation == generation:
+            sleep(self.threshold / 2)
+            switched_at, current, seq = self._switch
+            if current is self._hub or seq == self._blocked_seq:
+                continue
+            elapsed = time.perf_counter() - switched_at
+            if elapsed < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._hub_thread)
+            # 取栈期间协程可能已经让出 hub
+            if frame is None or self._switch[2] != seq:
+                continue
+            self._record(current, seq, switched_at, elapsed, frame)
+
+    def _record(self, current, seq: int, switched_at: float, elapsed: float, frame):
+        from app.utils.metrics import EVENT_LOOP_BLOCKED
+        stack = traceback.format_stack(frame)
+        where = _frame_label(frame)
+        report = {
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pid': os.getpid(),
+            'greenlet': repr(current)[:200],
+            'where': where,
+            'blocked_ms': round(elapsed * 1000, 1),
+            'finished': False,
+            'stack': [line.rstrip() for line in stack[-30:]],
+            '_started': switched_at,
+        }
+        self._blocked_report = report
+        self._blocked_seq = seq
+        with self._lock:
+            self.reports.append(report)
+            self.stats['blocked'] += 1
+        EVENT_LOOP_BLOCKED.inc()
+
+    def snapshot(self, since: Optional[float] = None) -> Dict:
+        """
+        Args:
+            since: 只返回该时间 (time.perf_counter) 之后开始的阻塞记录
+
+        Returns:
+            检测状态和最近的阻塞记录 (最新的在前)
+        """
+        with self._lock:
+            reports = [dict(r) for r in self.reports if since is None or r['_started'] >= since]
+            stats = dict(self.stats)
+        for report in reports:
+            report.pop('_started')
+        reports.reverse()
+        return {'running': self._running, 'threshold_ms': self.threshold * 1000, **stats, 'reports': reports}
+
+
+_monitor: Optional[BlockingMonitor] = None
+_monitor_lock = threading.Lock()
+
+
+def get_blocking_monitor(config) -> BlockingMonitor:
+    """获取进程内唯一的阻塞检测器 (未开启)"""
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                _monitor = BlockingMonitor(
+                    threshold=config.get('PROFILER_BLOCKING_THRESHOLD_MS', 100) / 1000,
+                    history=config.get('PROFILER_BLOCKING_HISTORY', 50)
+                )
+    return _monitor
+
+
+def blocking_monitor_snapshot() -> Optional[Dict]:
+    """阻塞检测状态，本进程尚未创建时返回 None"""
+    return _monitor.snapshot() if _monitor is not None else None
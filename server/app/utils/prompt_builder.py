@@ -0,0 +1,287 @@
+"""
+提示词组装与 token 预算
+提供中英文混合文本的快速 token 估算、按模型预算从新到旧填充聊天历史，
+固定前缀的显式上下文缓存标记，以及每次调用的 prompt/completion token 用量统计
+"""
+import math
+import threading
+import time
+import logging
+from collections import deque
+from typing import Optional, List, Dict, Callable, Tuple
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+# 估算系数：中文等宽字符约 0.7 token/字，英文数字等 ASCII 字符约 4 字符/token
+WIDE_TOKENS_PER_CHAR = 0.7
+NARROW_CHARS_PER_TOKEN = 4.0
+# 每条消息的格式开销 (role 标记、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 各对话模型的上下文窗口 (token)
+CHAT_MODEL_CONTEXT_TOKENS = {
+    'qwen-turbo': 131072,
+    'qwen-plus': 131072,
+    'qwen-max': 32768,
+    'qwen-max-latest': 32768,
+    'deepseek-r1': 65536,
+    'deepseek-v3': 65536,
+}
+DEFAULT_CONTEXT_TOKENS = 32768
+
+# 支持显式上下文缓存 (cache_control) 的模型，缓存前缀至少 1024 token
+EXPLICIT_CACHE_MODELS = {'qwen-max', 'qwen-plus', 'qwen-turbo'}
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    快速估算文本的 token 数
+    利用 UTF-8 编码长度与字符数之差推算多字节字符数量，
+    整个计算只有一次 encode 和两次 len，全部在 C 层完成，不逐字符遍历
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 数
+    """
+    if not text:
+        return 0
+    n_chars = len(text)
+    # ASCII 占 1 字节，常用汉字和中文标点占 3 字节
+    n_wide = (len(text.encode('utf-8')) - n_chars) // 2
+    n_narrow = n_chars - n_wide
+    return math.ceil(n_wide * WIDE_TOKENS_PER_CHAR + n_narrow / NARROW_CHARS_PER_TOKEN)
+
+
+def estimate_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    批量估算 token 数
+
+    Args:
+        texts: 文本列表
+
+    Returns:
+        与 texts 顺序一致的 token 数列表
+    """
+    char_counts = list(map(len, texts))
+    byte_counts = [len(text.encode('utf-8')) for text in texts]
+    results = []
+    for n_chars, n_bytes in zip(char_counts, byte_counts):
+        n_wide = (n_bytes - n_chars) // 2
+        results.append(math.ceil(n_wide * WIDE_TOKENS_PER_CHAR + (n_chars - n_wide) / NARROW_CHARS_PER_TOKEN))
+    return results
+
+
+def format_chat_line(msg: Dict[str, str]) -> str:
+    """将单条聊天记录格式化为文本行"""
+    return f"{'老人' if msg['role'] == 'user' else 'AI'}：{msg['content']}"
+
+
+def message_text(msg: Dict) -> str:
+    """获取消息文本，兼容 content 为分块列表的格式"""
+    content = msg['content']
+    if isinstance(content, str):
+        return content
+    return ''.join(block.get('text', '') for block in content)
+
+
+def estimate_messages_tokens(messages: List[Dict]) -> int:
+    """估算消息列表的 prompt token 数"""
+    return sum(estimate_tokens_batch([message_text(msg) for msg in messages])) + \
+        MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+
+def mark_cache_prefix(messages: List[Dict], model: str) -> List[Dict]:
+    """
+    为固定的 system 前缀添加显式缓存标记
+    仅在 prompt_cache = explicit、模型支持且前缀足够长时生效，
+    否则原样返回，由服务端隐式缓存按前缀自动匹配
+
+    Args:
+        messages: 消息列表，第一条为 system 消息
+        model: 模型名称
+
+    Returns:
+        消息列表
+    """
+    if current_app.config.get('PROMPT_CACHE_MODE', 'explicit') != 'explicit':
+        return messages
+    if model not in EXPLICIT_CACHE_MODELS or not messages or messages[0]['role'] != 'system':
+        return messages
+    system_text = message_text(messages[0])
+    if estimate_tokens(system_text) < current_app.config.get('PROMPT_CACHE_MIN_TOKENS', 1024):
+        return messages
+    marked = {
+        "role": "system",
+        "content": [{"type": "text", "text": system_text, "cache_control": {"type": "ephemeral"}}]
+    }
+    return [marked] + messages[1:]
+
+
+def make_messages(system_prompt: str, user_content: str, model: str) -> List[Dict]:
+    """组装固定 system 前缀 + 可变 user 内容的消息列表"""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+    return mark_cache_prefix(messages, model)
+
+
+class PromptBuilder:
+    """按模型 token 预算组装提示词"""
+
+    def __init__(self, model: str, max_tokens: Optional[int] = None, limit: int = 0):
+        """
+        Args:
+            model: 对话模型名称
+            max_tokens: 为生成内容预留的 token 数，默认使用 CHAT_MAX_TOKENS
+            limit: 额外的 prompt 预算上限，0 表示只受模型上下文窗口限制
+        """
+        self.model = model
+        self.max_tokens = max_tokens or current_app.config.get('CHAT_MAX_TOKENS', 2000)
+        self.limit = limit
+
+    @property
+    def budget(self) -> int:
+        """可用于 prompt 的 token 数"""
+        context = CHAT_MODEL_CONTEXT_TOKENS.get(self.model, DEFAULT_CONTEXT_TOKENS)
+        budget = context - self.max_tokens
+        if self.limit:
+            budget = min(budget, self.limit)
+        return max(budget, 0)
+
+    def fit_history(self,
+                    history: List[Dict[str, str]],
+                    render: Callable[[Dict[str, str]], str],
+                    reserved: int = 0) -> Tuple[List[str], int]:
+        """
+        从最新的消息开始向前填充，直到用完预算
+
+        Args:
+            history: 聊天历史 (按时间正序)
+            render: 单条消息的渲染函数
+            reserved: 已被系统提示词等固定内容占用的 token 数
+
+        Returns:
+            (按时间正序的渲染结果, 使用的 token 数)
+        """
+        remaining = self.budget - reserved
+        lines = [render(msg) for msg in history]
+        # 每行额外计 1 个 token 的换行开销
+        costs = estimate_tokens_batch(lines)
+        selected = []
+        used = 0
+        for line, cost in zip(reversed(lines), reversed(costs)):
+            if used + cost + 1 > remaining:
+                break
+            selected.append(line)
+            used += cost + 1
+        selected.reverse()
+        return selected, used
+
+    def build(self,
+              system_prompt: str,
+              history: List[Dict[str, str]],
+              render: Callable[[Dict[str, str]], str],
+              header: str = '',
+              footer: str = '') -> Tuple[List[Dict[str, str]], int]:
+        """
+        组装 system + user 两条消息，user 消息由 header、历史和 footer 组成
+        system_prompt 应为固定常量，变化的内容都放在 user 消息中以保证前缀可缓存
+
+        Returns:
+            (消息列表, 估算的 prompt token 数)
+        """
+        reserved = estimate_tokens(system_prompt) + estimate_tokens(header) + \
+            estimate_tokens(footer) + MESSAGE_OVERHEAD_TOKENS * 2
+        lines, used = self.fit_history(history, render, reserved)
+        if len(lines) < len(history):
+            logger.debug(f"[Prompt] 历史超出预算({self.budget} tokens)，保留最近{len(lines)}/{len(history)}条")
+        history_text = "\n".join(lines)
+        messages = make_messages(system_prompt, f"{header}{history_text}{footer}", self.model)
+        return messages, reserved + used
+
+
+class UsageTracker:
+    """
+    记录每次对话调用的 token 用量与耗时
+    供成本与延迟看板使用，按 (用途, 模型) 聚合并保留最近的调用明细
+    """
+
+    def __init__(self, max_recent: int = 200):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._recent = deque(maxlen=max_recent)
+
+    def record(self,
+               purpose: str,
+               model: str,
+               estimated_prompt_tokens: int,
+               usage: Optional[Dict[str, int]],
+               latency_ms: float,
+               finish_reason: Optional[str] = None):
+        """
+        记录一次调用
+
+        Args:
+            purpose: 调用用途 (followup/memoir/summary/chat)
+            model: 模型名称
+            estimated_prompt_tokens: 本地估算的 prompt token 数
+            usage: 接口返回的 usage 字段，可能为 None
+            latency_ms: 调用耗时 (毫秒)
+            finish_reason: 结束原因，length 表示输出达到 max_tokens 被截断
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get('prompt_tokens') or estimated_prompt_tokens
+        completion_tokens = usage.get('completion_tokens') or 0
+        # 命中服务端上下文缓存的 prompt token 数
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        entry = {
+            'time': time.time(),
+            'purpose': purpose,
+            'model': model,
+            'estimated_prompt_tokens': estimated_prompt_tokens,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'latency_ms': round(latency_ms, 1),
+            'finish_reason': finish_reason
+        }
+        with self._lock:
+            self._recent.append(entry)
+            totals = self._totals.setdefault(f"{purpose}:{model}", {
+                'purpose': purpose,
+                'model': model,
+                'calls': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cached_tokens': 0,
+                'truncated': 0,
+                'latency_ms': 0.0
+            })
+            totals['calls'] += 1
+            totals['prompt_tokens'] += prompt_tokens
+            totals['completion_tokens'] += completion_tokens
+            totals['cached_tokens'] += cached_tokens
+            if finish_reason == 'length':
+                totals['truncated'] += 1
+            totals['latency_ms'] += latency_ms
+        logger.debug(f"[Usage] {purpose}/{model}: prompt={prompt_tokens} (估算{estimated_prompt_tokens}) "
+                     f"completion={completion_tokens} cached={cached_tokens} 耗时={latency_ms:.0f}ms")
+
+    def snapshot(self) -> Dict[str, list]:
+        """获取聚合统计与最近调用明细"""
+        with self._lock:
+            totals = []
+            for item in self._totals.values():
+                item = dict(item)
+                item['avg_latency_ms'] = round(item['latency_ms'] / item['calls'], 1)
+                item['latency_ms'] = round(item['latency_ms'], 1)
+                totals.append(item)
+            return {'totals': totals, 'recent': list(self._recent)}
+
+
+usage_tracker = UsageTracker()
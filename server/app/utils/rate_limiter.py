@@ -0,0 +1,334 @@
+"""
+百炼平台配额限流
+所有 worker 共用一个 ALIYUN_API_KEY，平台按接口限制 QPS 和并发连接数。
+这里按接口 (chat/asr/asr_realtime/tts) 配置令牌桶和并发上限，在发出请求前排队等待配额，
+超过最长等待时间才失败，避免突发请求直接触发 429。
+
+后端：
+    mongo - 令牌桶和并发租约保存在 MongoDB，使用原子更新，多个 worker 共享配额
+    local - 进程内限流；mongo 后端不可用时自动回退
+"""
+import time
+import uuid
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, Tuple
+
+from pymongo import MongoClient, ReturnDocument
+from pymongo.uri_parser import parse_uri
+
+from .resilience import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTimeout(DeadlineExceeded):
+    """排队等待配额超时"""
+
+
+class LocalBackend:
+    """进程内令牌桶与并发计数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._leases = {}
+
+    def take_token(self, api: str, qps: float, burst: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(api, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * qps)
+            granted = tokens >= 1
+            if granted:
+                tokens -= 1
+            self._buckets[api] = (tokens, now)
+        return granted, tokens
+
+    def acquire_lease(self, api: str, limit: int, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            leases = {k: exp for k, exp in self._leases.get(api, {}).items() if exp > now}
+            granted = len(leases) < limit
+            if granted:
+                leases[lease_id] = now + ttl
+            self._leases[api] = leases
+        return granted
+
+    def renew_lease(self, api: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            leases = self._leases.get(api, {})
+            if leases.get(lease_id, 0) <= now:
+                return False
+            leases[lease_id] = now + ttl
+        return True
+
+    def release_lease(self, api: str, lease_id: str):
+        with self._lock:
+            self._leases.get(api, {}).pop(lease_id, None)
+
+    def state(self, api: str) -> Dict:
+        now = time.time()
+        with self._lock:
+            tokens, _ = self._buckets.get(api, (None, now))
+            in_flight = sum(1 for exp in self._leases.get(api, {}).values() if exp > now)
+        return {'tokens': tokens, 'in_flight': in_flight}
+
+
+class MongoBackend:
+    """
+    MongoDB 共享令牌桶与并发租约
+    每个接口一个文档，使用聚合管道更新在一次原子操作中完成补充令牌和扣减。
+    使用独立的客户端和很短的超时：MongoDB 不可用时很快失败并回退到进程内后端，
+    不会按默认的 30 秒服务器选择超时阻塞调用方
+    """
+
+    COLLECTION = 'rate_limit_bucket'
+
+    def __init__(self, uri: str, timeout_ms: int = 200):
+        self.uri = uri
+        self.timeout_ms = timeout_ms
+        self._coll = None
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        if self._coll is None:
+            with self._lock:
+                if self._coll is None:
+                    # 首次使用时才创建客户端，避免在 gunicorn --preload 的主进程中创建后被 fork
+                    client = MongoClient(self.uri,
+                                         serverSelectionTimeoutMS=self.timeout_ms,
+                                         connectTimeoutMS=self.timeout_ms,
+                                         socketTimeoutMS=self.timeout_ms,
+                                         retryWrites=False, retryReads=False)
+                    self._coll = client[parse_uri(self.uri)['database'] or 'echotalk'][self.COLLECTION]
+        return self._coll
+
+    def take_token(self, api: str, qps: float, burst: float) -> Tuple[bool, float]:
+        now = time.time()
+        refilled = {'$min': [burst, {'$add': [
+            {'$ifNull': ['$tokens', burst]},
+            {'$multiply': [{'$max': [0, {'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}]}, qps]}
+        ]}]}
+        doc = self._collection().find_one_and_update(
+            {'_id': f'bucket:{api}'},
+            [
+                {'$set': {'tokens': refilled, 'updated_at': now}},
+                {'$set': {
+                    'granted': {'$gte': ['$tokens', 1]},
+                    'tokens': {'$cond': [{'$gte': ['$tokens', 1]}, {'$subtract': ['$tokens', 1]}, '$tokens']}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bool(doc.get('granted')), doc.get('tokens', 0)
+
+    def acquire_lease(self, api: str, limit: int, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        active = {'$filter': {'input': {'$ifNull': ['$leases', []]}, 'cond': {'$gt': ['$$this.exp', now]}}}
+        doc = self._collection().find_one_and_update(
+            {'_id': f'leases:{api}'},
+            [
+                {'$set': {'leases': active}},
+                {'$set': {'leases': {'$cond': [
+                    {'$lt': [{'$size': '$leases'}, limit]},
+                    {'$concatArrays': ['$leases', [{'id': lease_id, 'exp': now + ttl}]]},
+                    '$leases'
+                ]}}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return any(lease.get('id') == lease_id for lease in doc.get('leases', []))
+
+    def renew_lease(self, api: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        result = self._collection().update_one(
+            {'_id': f'leases:{api}', 'leases': {'$elemMatch': {'id': lease_id, 'exp': {'$gt': now}}}},
+            {'$set': {'leases.$.exp': now + ttl}}
+        )
+        return result.matched_count > 0
+
+    def release_lease(self, api: str, lease_id: str):
+        self._collection().update_one({'_id': f'leases:{api}'}, {'$pull': {'leases': {'id': lease_id}}})
+
+    def state(self, api: str) -> Dict:
+        now = time.time()
+        bucket = self._collection().find_one({'_id': f'bucket:{api}'}) or {}
+        leases = (self._collection().find_one({'_id': f'leases:{api}'}) or {}).get('leases', [])
+        return {
+            'tokens': bucket.get('tokens'),
+            'in_flight': sum(1 for lease in leases if lease.get('exp', 0) > now)
+        }
+
+
+class RateLimiter:
+    """按接口的令牌桶 + 并发限流器"""
+
+    def __init__(self,
+                 limits: Dict[str, Dict[str, float]],
+                 backend: str = 'local',
+                 max_wait: float = 5.0,
+                 lease_ttl: float = 300,
+                 mongo_uri: Optional[str] = None,
+                 mongo_timeout_ms: int = 200):
+        """
+        Args:
+            limits: {api: {'qps': 每秒请求数, 'burst': 桶容量, 'concurrency': 最大并发}}，0 表示不限制
+            backend: mongo / local
+            max_wait: 默认最长排队时间 (秒)
+            lease_ttl: 并发租约的有效期 (秒)，长时间持有时需定期 renew；进程异常退出时租约到期自动释放
+            mongo_uri: mongo 后端的连接地址
+            mongo_timeout_ms: mongo 后端的连接和读写超时 (毫秒)
+        """
+        self.limits = limits
+        self.max_wait = max_wait
+        self.lease_ttl = lease_ttl
+        self._local = LocalBackend()
+        self._shared = MongoBackend(mongo_uri, mongo_timeout_ms) if backend == 'mongo' and mongo_uri else None
+        # 共享后端故障后的冷却截止时间，期间直接使用进程内后端
+        self._shared_down_until = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def _call_backend(self, method: str, *args):
+        """优先使用共享后端，失败时回退到进程内后端"""
+        if self._shared is not None and time.time() >= self._shared_down_until:
+            try:
+                return getattr(self._shared, method)(*args)
+            except Exception as e:
+                self._shared_down_until = time.time() + 30
+                logger.warning(f"[RateLimit] 共享后端不可用，30秒内使用进程内限流: {e}")
+        return getattr(self._local, method)(*args)
+
+    def _count(self, api: str, key: str, value: float = 1):
+        with self._stats_lock:
+            stats = self._stats.setdefault(api, {'granted': 0, 'queued': 0, 'timeouts': 0, 'wait_ms': 0.0})
+            stats[key] += value
+
+    def acquire(self, api: str, max_wait: Optional[float] = None) -> Optional[str]:
+        """
+        获取一次调用配额，配额不足时排队等待
+
+        Args:
+            api: 接口名称
+            max_wait: 最长等待时间 (秒)，默认使用配置值
+
+        Returns:
+            并发租约ID，接口未限制并发时返回 None
+
+        Raises:
+            RateLimitTimeout: 等待超时
+        """
+        limit = self.limits.get(api) or {}
+        qps = limit.get('qps') or 0
+        concurrency = int(limit.get('concurrency') or 0)
+        if not qps and not concurrency:
+            return None
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.time()
+        deadline = start + max_wait
+        queued = False
+
+        if qps:
+            burst = limit.get('burst') or qps
+            while True:
+                granted, tokens = self._call_backend('take_token', api, qps, burst)
+                if granted:
+                    break
+                sleep_for = max((1 - tokens) / qps, 0.01)
+                if time.time() + sleep_for > deadline:
+                    self._count(api, 'timeouts')
+                    raise RateLimitTimeout(f'{api} 配额排队超时')
+                queued = True
+                time.sleep(sleep_for)
+
+        lease_id = None
+        if concurrency:
+            lease_id = uuid.uuid4().hex
+            backoff = 0.02
+            while not self._call_backend('acquire_lease', api, concurrency, lease_id, self.lease_ttl):
+                if time.time() + backoff > deadline:
+                    self._count(api, 'timeouts')
+                    raise RateLimitTimeout(f'{api} 并发数已满，排队超时')
+                queued = True
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 0.5)
+
+        self._count(api, 'granted')
+        if queued:
+            self._count(api, 'queued')
+            self._count(api, 'wait_ms', (time.time() - start) * 1000)
+        return lease_id
+
+    def renew(self, api: str, lease_id: Optional[str]) -> bool:
+        """
+        续期并发租约，长时间持有的租约 (如实时语音识别会话) 需每隔 lease_ttl / 3 左右续期一次
+
+        Returns:
+            租约是否仍然有效 (已过期的租约不会被恢复)
+        """
+        if not lease_id:
+            return True
+        return self._call_backend('renew_lease', api, lease_id, self.lease_ttl)
+
+    def release(self, api: str, lease_id: Optional[str]):
+        """释放并发租约"""
+        if lease_id:
+            self._call_backend('release_lease', api, lease_id)
+
+    @contextmanager
+    def limit(self, api: str, max_wait: Optional[float] = None):
+        """在配额内执行一次调用"""
+        lease_id = self.acquire(api, max_wait)
+        try:
+            yield
+        finally:
+            self.release(api, lease_id)
+
+    def utilization(self) -> Dict[str, Dict]:
+        """各接口当前配额使用情况"""
+        result = {}
+        for api, limit in self.limits.items():
+            state = self._call_backend('state', api)
+            with self._stats_lock:
+                stats = dict(self._stats.get(api, {}))
+            concurrency = int(limit.get('concurrency') or 0)
+            burst = limit.get('burst') or limit.get('qps') or 0
+            tokens = state.get('tokens')
+            result[api] = dict(
+                stats,
+                qps=limit.get('qps') or 0,
+                burst=burst,
+                tokens_available=tokens,
+                token_utilization=round(1 - tokens / burst, 3) if burst and tokens is not None else None,
+                concurrency=concurrency,
+                in_flight=state.get('in_flight', 0),
+                concurrency_utilization=round(state.get('in_flight', 0) / concurrency, 3) if concurrency else None
+            )
+        return result
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(config) -> RateLimiter:
+    """获取进程内唯一的限流器"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter(
+                    config.get('QUOTA_LIMITS', {}),
+                    backend=config.get('QUOTA_BACKEND', 'local'),
+                    max_wait=config.get('QUOTA_MAX_WAIT_MS', 5000) / 1000,
+                    lease_ttl=config.get('QUOTA_LEASE_TTL', 300),
+                    mongo_uri=config.get('MONGO_URI'),
+                    mongo_timeout_ms=config.get('QUOTA_MONGO_TIMEOUT_MS', 200)
+                )
+    return _rate_limiter
@@ -0,0 +1,338 @@
+"""
+上游调用弹性策略
+为百炼平台的对话、语音识别、语音合成、文件上传等调用提供统一的：
+    - 有界指数退避重试 (full jitter)，只重试超时、连接错误、429 和 5xx
+    - 截止时间传递：HTTP 请求开始时设定截止时间，所有上游调用的超时和重试都不会超过它
+    - 按接口的熔断器，上游持续异常时快速失败，不再占用 worker
+"""
+import time
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from typing import Optional, Callable, Dict, Any
+
+import requests
+from flask import g, has_app_context, current_app
+
+from .metrics import UPSTREAM_SECONDS, UPSTREAM_ERRORS
+from .tracing import span, KIND_CLIENT
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """上游返回了错误响应"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+
+class DeadlineExceeded(Exception):
+    """已超过请求截止时间"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    closed: 正常放行；连续失败 failure_threshold 次后进入 open
+    open: 直接拒绝；经过 reset_timeout 秒后进入 half_open
+    half_open: 放行一个探测请求，成功则 closed，失败则重新 open
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.time() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """是否放行请求"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """结束探测但不改变熔断状态 (调用未得出上游是否恢复的结论，如截止时间已到、参数错误)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+
+
+# ============================================================
+# 截止时间
+# ============================================================
+_local = threading.local()
+
+
+def set_request_deadline(seconds: float):
+    """为当前 HTTP 请求设置截止时间 (在 before_request 中调用)"""
+    g.request_deadline = time.time() + seconds
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """
+    为当前线程设置截止时间，用于没有 HTTP 请求的场景 (如实时语音的后台线程)
+    嵌套时取更早的截止时间
+    """
+    previous = getattr(_local, 'deadline', None)
+    deadline = time.time() + seconds
+    _local.deadline = min(deadline, previous) if previous else deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining_time() -> Optional[float]:
+    """距截止时间的剩余秒数，未设置截止时间返回 None"""
+    deadlines = [getattr(_local, 'deadline', None)]
+    if has_app_context():
+        deadlines.append(g.get('request_deadline'))
+    deadlines = [d for d in deadlines if d]
+    if not deadlines:
+        return None
+    return min(deadlines) - time.time()
+
+
+def bounded_timeout(timeout: float) -> float:
+    """将单次调用超时限制在剩余时间内"""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded('已超过请求截止时间')
+    return min(timeout, remaining)
+
+
+# ============================================================
+# 重试与熔断
+# ============================================================
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(exc: Exception) -> bool:
+    """判断异常是否值得重试：超时、连接错误、429、5xx"""
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                        TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, 'status_code', None)
+    if status is None and isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return False
+
+
+def error_reason(exc: Exception) -> str:
+    """失败原因分类 (指标标签)"""
+    if isinstance(exc, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(exc, (requests.exceptions.Timeout, TimeoutError, DeadlineExceeded)):
+        return 'timeout'
+    if isinstance(exc, (requests.exceptions.ConnectionError, ConnectionError)):
+        return 'connection'
+    status = getattr(exc, 'status_code', None)
+    if status is None and isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+    if status == 429:
+        return '429'
+    if status is not None:
+        return '5xx' if status >= 500 else '4xx'
+    return 'other'
+
+
+class ResiliencePolicy:
+    """重试参数"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待时间 (full jitter)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# 接口对应的配额 (见 rate_limiter)
+ENDPOINT_QUOTA = {
+    'chat': 'chat',
+    'asr': 'asr',
+    'asr_upload': 'asr',
+    'tts': 'tts',
+}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """获取接口对应的熔断器"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            config = current_app.config if has_app_context() else {}
+            breaker = CircuitBreaker(config.get('RESILIENCE_BREAKER_FAILURES', 5),
+                                     config.get('RESILIENCE_BREAKER_RESET', 30))
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def default_policy() -> ResiliencePolicy:
+    config = current_app.config if has_app_context() else {}
+    return ResiliencePolicy(
+        max_attempts=config.get('RESILIENCE_MAX_ATTEMPTS', 3),
+        base_delay=config.get('RESILIENCE_BASE_DELAY_MS', 200) / 1000,
+        max_delay=config.get('RESILIENCE_MAX_DELAY_MS', 2000) / 1000
+    )
+
+
+def call_with_resilience(endpoint: str,
+                         func: Callable[[float], Any],
+                         timeout: float,
+                         policy: Optional[ResiliencePolicy] = None,
+                         retryable: Callable[[Exception], bool] = is_retryable) -> Any:
+    """
+    带重试、截止时间和熔断的上游调用
+
+    Args:
+        endpoint: 接口名称，每个接口一个熔断器
+        func: 实际调用，参数为本次尝试可用的超时 (秒)
+        timeout: 单次尝试的最大超时 (秒)
+        policy: 重试参数，默认读取配置
+        retryable: 判断异常是否可重试
+
+    Returns:
+        func 的返回值
+
+    Raises:
+        CircuitOpenError: 熔断器打开
+        DeadlineExceeded: 超过截止时间
+        Exception: func 抛出的不可重试异常，或重试耗尽后的最后一个异常
+    """
+    policy = policy or default_policy()
+    breaker = get_breaker(endpoint)
+
+    for attempt in range(policy.max_attempts):
+        # 先检查截止时间再占用探测名额，截止时间已到时不会让半开的熔断器一直处于探测中
+        attempt_timeout = bounded_timeout(timeout)
+        if not breaker.allow():
+            UPSTREAM_ERRORS.inc(api=endpoint, reason='circuit_open')
+            raise CircuitOpenError(f'{endpoint} 已熔断，暂停调用')
+        recorded = False
+        try:
+            with quota_limit(ENDPOINT_QUOTA.get(endpoint)):
+                # 只统计实际调用的耗时，不含配额排队
+                started = time.perf_counter()
+                try:
+                    with span(f"dashscope.{endpoint}", KIND_CLIENT, attempt=attempt + 1):
+                        result = func(attempt_timeout)
+                finally:
+                    UPSTREAM_SECONDS.observe(time.perf_counter() - started, api=endpoint)
+            breaker.record_success()
+            recorded = True
+            return result
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(api=endpoint, reason=error_reason(e))
+            if not retryable(e):
+                # 参数错误等客户端问题不计入熔断，也不能据此关闭熔断器
+                raise
+            breaker.record_failure()
+            recorded = True
+            delay = policy.backoff(attempt)
+            remaining = remaining_time()
+            if attempt + 1 >= policy.max_attempts or (remaining is not None and remaining <= delay):
+                raise
+            logger.warning(f"[Resilience] {endpoint} 第{attempt + 1}次调用失败({e})，{delay:.2f}s 后重试")
+        finally:
+            # 截止时间到达、配额排队超时、不可重试的错误等未记录结果的退出，都要归还探测名额
+            if not recorded:
+                breaker.release_probe()
+        time.sleep(delay)
+
+
+def _no_release():
+    pass
+
+
+def acquire_quota(api: Optional[str], max_wait: Optional[float] = None) -> Callable[[], None]:
+    """
+    获取一次调用的百炼平台配额，排队时间不超过请求截止时间
+    没有应用上下文 (无法读取配置) 时不限流
+
+    Args:
+        api: 接口名称
+        max_wait: 最长排队时间 (秒)，默认使用配置值；0 表示没有可用配额时立即失败
+
+    Returns:
+        释放配额的函数 (可以在其它线程中调用)
+
+    Raises:
+        RateLimitTimeout: 排队超时
+    """
+    if not api or not has_app_context():
+        return _no_release
+    from .rate_limiter import get_rate_limiter
+    limiter = get_rate_limiter(current_app.config)
+    max_wait = limiter.max_wait if max_wait is None else max_wait
+    remaining = remaining_time()
+    if remaining is not None:
+        max_wait = max(min(max_wait, remaining), 0)
+    lease_id = limiter.acquire(api, max_wait)
+    return lambda: limiter.release(api, lease_id)
+
+
+@contextmanager
+def quota_limit(api: Optional[str]):
+    """在百炼平台配额内执行调用，排队时间不超过请求截止时间"""
+    release = acquire_quota(api)
+    try:
+        yield
+    finally:
+        release()
+
+
+def breaker_states() -> Dict[str, str]:
+    """各接口熔断器状态"""
+    with _breakers_lock:
+        return {endpoint: breaker.state for endpoint, breaker in _breakers.items()}
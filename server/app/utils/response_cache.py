@@ -0,0 +1,141 @@
+"""
+追问回复缓存
+很多老人的开场白非常相似，对相同或相近的最后一句话直接复用之前生成的追问，省去一次大模型调用
+
+两级匹配：
+    精确匹配 - 归一化后的最后一句用户发言 + 上文哈希完全一致
+    相似匹配 - 上文哈希一致时，按字符 n-gram 的 Jaccard 相似度不低于阈值
+缓存条目有 TTL 并按 LRU 淘汰
+"""
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, FrozenSet
+
+
+# 归一化时去掉的标点、空白，以及句尾语气词
+_PUNCT_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+_PARTICLE_PATTERN = re.compile(r'[啊呀呢吧嘛哦噢呃嗯]+$')
+# 太短的句子只做精确匹配
+MIN_SIMILAR_LENGTH = 4
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本：全角转半角、转小写、去掉标点空白和句尾语气词"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _PARTICLE_PATTERN.sub('', _PUNCT_PATTERN.sub('', text))
+
+
+def char_ngrams(text: str, n: int = 2) -> FrozenSet[str]:
+    """字符 n-gram 集合"""
+    if len(text) <= n:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def split_history(chat_history: List[Dict[str, str]]) -> Tuple[Optional[str], str]:
+    """
+    拆分聊天历史为 (最后一句用户发言, 上文哈希)
+    最后一条不是用户发言时无法缓存，返回 (None, '')
+    """
+    if not chat_history or chat_history[-1].get('role') != 'user':
+        return None, ''
+    context = '\n'.join(
+        f"{msg.get('role')}:{normalize_text(msg.get('content', ''))}" for msg in chat_history[:-1]
+    )
+    context_hash = hashlib.sha1(context.encode('utf-8')).hexdigest() if context else ''
+    return chat_history[-1].get('content', ''), context_hash
+
+
+class ResponseCache:
+    """带精确/相似两级匹配、TTL 和 LRU 淘汰的回复缓存"""
+
+    def __init__(self,
+                 max_size: int = 1000,
+                 ttl: int = 3600,
+                 threshold: float = 0.85,
+                 ngram: int = 2):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.ngram = ngram
+        self._lock = threading.Lock()
+        # key -> (response, ngrams, expire_at)
+        self._entries = OrderedDict()
+        self.stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0}
+
+    def _make_key(self, normalized: str, context_hash: str, model: str) -> str:
+        return f"{model}|{context_hash}|{normalized}"
+
+    def get(self, text: str, context_hash: str, model: str) -> Optional[str]:
+        """
+        查询缓存
+
+        Args:
+            text: 最后一句用户发言
+            context_hash: 上文哈希
+            model: 模型名称
+
+        Returns:
+            缓存的回复，未命中返回 None
+        """
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        now = time.time()
+        key = self._make_key(normalized, context_hash, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.stats['exact_hits'] += 1
+                return entry[0]
+
+            if len(normalized) >= MIN_SIMILAR_LENGTH:
+                grams = char_ngrams(normalized, self.ngram)
+                prefix = f"{model}|{context_hash}|"
+                best_key, best_score = None, 0.0
+                for candidate_key, (_, candidate_grams, expire_at) in self._entries.items():
+                    if expire_at <= now or not candidate_key.startswith(prefix):
+                        continue
+                    score = jaccard(grams, candidate_grams)
+                    if score > best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key and best_score >= self.threshold:
+                    self._entries.move_to_end(best_key)
+                    self.stats['similar_hits'] += 1
+                    return self._entries[best_key][0]
+
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, text: str, context_hash: str, model: str, response: str):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        normalized = normalize_text(text)
+        if not normalized or not response:
+            return
+        key = self._make_key(normalized, context_hash, model)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (response, char_ngrams(normalized, self.ngram), now + self.ttl)
+            self._entries.move_to_end(key)
+            # 先清掉已过期的最旧条目，再按容量淘汰
+            while self._entries:
+                oldest_key, oldest = next(iter(self._entries.items()))
+                if oldest[2] > now and len(self._entries) <= self.max_size:
+                    break
+                self._entries.pop(oldest_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
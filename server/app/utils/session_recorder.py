@@ -0,0 +1,207 @@
+"""
+实时对话录音
+实时对话中客户端只发送 PCM 音频帧，原来没有任何录音留存。录音器按话轮缓存 PCM：
+    - 每个话轮结束时切出一段，在进程池中编码为 Opus (没有 ffmpeg 时为 WAV)，写入存储并插入 voice_relation
+    - 切段返回 Future，结果为 voice_relation.id，用于回填 chat_log 中用户发言的 voice_relation_id
+    - 单段超过 max_segment_seconds 自动切段，等待保存的段数超过 max_pending 时丢弃新段，
+      因此无论会话多长，每个会话占用的内存不超过 (max_pending + 1) 段
+"""
+import os
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict
+
+from .database import mysql_db, mongo_db
+
+logger = logging.getLogger(__name__)
+
+
+class RecorderStats:
+    """录音统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'segments': 0, 'dropped': 0, 'failures': 0, 'empty': 0, 'pending': 0,
+                       'pcm_bytes': 0, 'stored_bytes': 0}
+
+    def record(self, key: str, value: int = 1):
+        with self._lock:
+            self._stats[key] += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['compression'] = round(stats['pcm_bytes'] / stats['stored_bytes'], 1) if stats['stored_bytes'] else None
+        return stats
+
+
+recorder_stats = RecorderStats()
+
+# 切段后的编码、上传和写库都在这里执行，不占用接收音频的线程
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recorder')
+    return _executor
+
+
+class SessionRecorder:
+    """单个实时会话的录音器"""
+
+    def __init__(self,
+                 app,
+                 storage,
+                 transcoder,
+                 user_id: int,
+                 session_id: int,
+                 sample_rate: int = 16000,
+                 bitrate_kbps: int = 32,
+                 max_segment_seconds: int = 60,
+                 max_pending: int = 4,
+                 workers: int = 2,
+                 stats: RecorderStats = recorder_stats):
+        """
+        Args:
+            app: Flask 应用 (后台线程中写库需要应用上下文)
+            storage: 存储后端
+            transcoder: 音频处理器 (AudioTranscoder)
+            user_id: 用户ID
+            session_id: 会话ID
+            sample_rate: PCM 采样率
+            bitrate_kbps: Opus 码率
+            max_segment_seconds: 单段最长时长 (秒)，超过后自动切段
+            max_pending: 每个会话最多同时等待保存的段数
+            workers: 全局保存线程数
+            stats: 统计对象
+        """
+        self.app = app
+        self.storage = storage
+        self.transcoder = transcoder
+        self.user_id = user_id
+        self.session_id = session_id
+        self.bitrate_kbps = bitrate_kbps
+        self.max_bytes = max_segment_seconds * sample_rate * 2
+        self.max_pending = max_pending
+        self.workers = workers
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._pending = 0
+        self._closed = False
+
+    def append(self, pcm: bytes):
+        """追加一帧 PCM"""
+        with self._lock:
+            if self._closed:
+                return
+            self._buffer.extend(pcm)
+            full = len(self._buffer) >= self.max_bytes
+        if full:
+            logger.info(f"[Recorder] 单段超过最长时长，自动切段: session_id={self.session_id}")
+            self.cut()
+
+    def cut(self) -> Optional[Future]:
+        """
+        切出当前缓存的音频并异步保存
+
+        Returns:
+            结果为 voice_relation.id 的 Future (整段静音或保存失败时结果为 None)；
+            没有缓存的音频或等待保存的段数已满时返回 None
+        """
+        with self._lock:
+            if not self._buffer:
+                return None
+            pcm = bytes(self._buffer)
+            self._buffer.clear()
+            if self._pending >= self.max_pending:
+                self.stats.record('dropped')
+                logger.warning(f"[Recorder] 等待保存的录音过多，丢弃 {len(pcm)} bytes: session_id={self.session_id}")
+                return None
+            self._pending += 1
+        self.stats.record('pending')
+        return _get_executor(self.workers).submit(self._save, pcm)
+
+    def _save(self, pcm: bytes) -> Optional[int]:
+        encoded = None
+        try:
+            encoded = self.transcoder.encode_pcm(pcm, self.bitrate_kbps)
+            if encoded is None:
+                self.stats.record('empty')
+                return None
+            path, fmt = encoded
+            key = f"voice/realtime/{self.session_id}/{uuid.uuid4().hex}.{fmt}"
+            content_type = 'audio/ogg' if fmt == 'opus' else 'audio/wav'
+            size = self.storage.put_file(key, path, content_type)
+            voice_url = self.storage.public_url(key)
+
+            with self.app.app_context():
+                insert_sql = '''
+                    INSERT INTO voice_relation (user_id, session_id, voice_url, voice_type, create_time)
+                    VALUES (%s, %s, %s, 0, NOW())
+                '''
+                mysql_db.execute(insert_sql, (self.user_id, self.session_id, voice_url))
+                voice_sql = '''
+                    SELECT id FROM voice_relation
+                    WHERE session_id = %s AND voice_url = %s
+                    ORDER BY create_time DESC
+                    LIMIT 1
+                '''
+                voice_record = mysql_db.execute(voice_sql, (self.session_id, voice_url), fetchone=True)
+
+            self.stats.record('segments')
+            self.stats.record('pcm_bytes', len(pcm))
+            self.stats.record('stored_bytes', size)
+            return voice_record['id'] if voice_record else None
+        except Exception as e:
+            self.stats.record('failures')
+            logger.error(f"[Recorder] 保存录音失败: {e}")
+            return None
+        finally:
+            if encoded:
+                try:
+                    os.unlink(encoded[0])
+                except OSError:
+                    pass
+            with self._lock:
+                self._pending -= 1
+            self.stats.record('pending', -1)
+
+    def link(self, segment: Optional[Future], message_id):
+        """
+        录音保存完成后回填 chat_log 中对应发言的 voice_relation_id
+
+        Args:
+            segment: cut() 返回的 Future
+            message_id: chat_log 文档的 _id
+        """
+        if segment is None:
+            return
+
+        def update(future: Future):
+            voice_id = future.result()
+            if voice_id is None:
+                return
+            try:
+                mongo_db.get_collection('chat_log').update_one(
+                    {'_id': message_id}, {'$set': {'voice_relation_id': voice_id}}
+                )
+            except Exception as e:
+                logger.error(f"[Recorder] 回填 voice_relation_id 失败: {e}")
+
+        segment.add_done_callback(update)
+
+    def close(self) -> Optional[Future]:
+        """保存剩余的音频，之后追加的音频被忽略"""
+        segment = self.cut()
+        with self._lock:
+            self._closed = True
+            self._buffer = bytearray()
+        return segment
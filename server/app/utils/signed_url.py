@@ -0,0 +1,103 @@
+"""
+上传目录文件的签名URL
+为 LOCAL_STORAGE_PATH 下的文件生成带过期时间的 HMAC 签名URL，
+语音识别直接把该URL交给 Transcription，省去上传到百炼临时存储 (Files.upload + Files.get) 的两次调用
+签名密钥使用 MEDIA_SIGNING_KEY，未设置时使用 SECRET_KEY；代码库和部署文档中的默认值不能用于签名
+"""
+import os
+import hmac
+import time
+import hashlib
+from typing import Optional
+from urllib.parse import quote
+
+from flask import current_app
+
+from config import DEFAULT_SECRET_KEY
+
+# 代码库和部署文档 (install.sh / DEPLOY.md) 中出现的 SECRET_KEY 示例值
+PLACEHOLDER_SECRET_KEYS = {
+    DEFAULT_SECRET_KEY,
+    'change-this-secret-key-in-production',
+    'your-secret-key-here-change-in-production',
+}
+
+
+def resolve_signing_key(config) -> Optional[bytes]:
+    """签名密钥：MEDIA_SIGNING_KEY，未设置时使用非默认的 SECRET_KEY；都不可用时返回 None"""
+    key = config.get('MEDIA_SIGNING_KEY')
+    if not key:
+        key = config.get('SECRET_KEY')
+        if not key or key in PLACEHOLDER_SECRET_KEYS:
+            return None
+    return key.encode('utf-8')
+
+
+def check_signing_key(config):
+    """
+    启动时检查签名密钥，开启 asr_signed_url 时密钥不可用则抛出异常
+
+    Raises:
+        RuntimeError: 未设置 MEDIA_SIGNING_KEY 且 SECRET_KEY 为默认值
+    """
+    if config.get('ASR_SIGNED_URL', False) and resolve_signing_key(config) is None:
+        raise RuntimeError('已开启 asr_signed_url，但未设置环境变量 MEDIA_SIGNING_KEY 且 SECRET_KEY 为默认值，'
+                           '任何人都可以用代码库中的默认密钥伪造签名URL')
+
+
+def _signing_key() -> bytes:
+    key = resolve_signing_key(current_app.config)
+    if key is None:
+        raise RuntimeError('未设置签名URL密钥 (MEDIA_SIGNING_KEY 或非默认的 SECRET_KEY)')
+    return key
+
+
+def storage_root() -> str:
+    """上传文件根目录的绝对路径"""
+    return os.path.abspath(current_app.config.get('LOCAL_STORAGE_PATH', './uploads'))
+
+
+def relative_media_path(file_path: str) -> Optional[str]:
+    """文件相对于上传根目录的路径，不在根目录下时返回 None"""
+    root = storage_root()
+    path = os.path.abspath(file_path)
+    if os.path.commonpath([root, path]) != root or path == root:
+        return None
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def sign(rel_path: str, expires: int) -> str:
+    message = f"{rel_path}\n{expires}".encode('utf-8')
+    return hmac.new(_signing_key(), message, hashlib.sha256).hexdigest()
+
+
+def verify(rel_path: str, expires: str, signature: str) -> bool:
+    """校验签名和过期时间"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    if resolve_signing_key(current_app.config) is None:
+        return False
+    return hmac.compare_digest(sign(rel_path, expires), signature or '')
+
+
+def make_signed_url(file_path: str, ttl: Optional[int] = None) -> Optional[str]:
+    """
+    生成文件的签名URL
+
+    Args:
+        file_path: 上传根目录下的文件路径
+        ttl: 有效期 (秒)，默认读取配置
+
+    Returns:
+        外部可访问的签名URL；文件不在上传目录下或未配置外部访问地址时返回 None
+    """
+    base_url = current_app.config.get('PUBLIC_BASE_URL', '').rstrip('/')
+    rel_path = relative_media_path(file_path)
+    if not base_url or not rel_path:
+        return None
+    expires = int(time.time()) + (ttl or current_app.config.get('SIGNED_URL_TTL', 600))
+    return f"{base_url}/api/media/{quote(rel_path)}?e={expires}&s={sign(rel_path, expires)}"
@@ -0,0 +1,171 @@
+"""
+实时对话的投机预取
+用户还没说完时，识别结果已经稳定了一小段时间，就提前用这段文本生成追问：
+    - 话轮结束时最终文本与投机文本一致 (归一化后)，直接采用投机结果，省去等待大模型的时间
+    - 用户继续说话导致文本变化，投机结果作废：尚未开始的生成不再发起；已发出的请求无法中断，
+      结果被丢弃，生成函数不应有副作用 (如写入追问缓存)，被采用时由 on_commit 补上
+投机次数、作废数和节省的时间同时计入 /metrics (echotalk_speculations_total 等)
+"""
+import time
+import threading
+import logging
+from typing import Optional, Callable, Dict
+
+from .response_cache import normalize_text
+from .metrics import SPECULATIONS, SPECULATION_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculationStats:
+    """投机预取统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'committed': 0, 'wasted': 0, 'saved_ms': 0.0}
+
+    def record(self, key: str, value: float = 1):
+        with self._lock:
+            self._stats[key] += value
+        if key == 'saved_ms':
+            SPECULATION_SAVED_SECONDS.inc(value / 1000)
+        else:
+            SPECULATIONS.inc(value, outcome=key)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        finished = stats['committed'] + stats['wasted']
+        stats['waste_rate'] = round(stats['wasted'] / finished, 3) if finished else None
+        stats['avg_saved_ms'] = round(stats['saved_ms'] / stats['committed'], 1) if stats['committed'] else None
+        stats['saved_ms'] = round(stats['saved_ms'], 1)
+        return stats
+
+
+speculation_stats = SpeculationStats()
+
+
+class _Speculation:
+    """一次投机生成"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.key = normalize_text(text)
+        self.started_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.done = threading.Event()
+        # 作废后结果不再使用
+        self.cancelled = False
+
+
+class Speculator:
+    """单个实时会话的投机预取器"""
+
+    def __init__(self,
+                 generate: Callable[[str], Optional[str]],
+                 stable_ms: float = 250,
+                 min_chars: int = 4,
+                 stats: SpeculationStats = speculation_stats,
+                 on_commit: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            generate: 根据用户发言生成回复 (在后台线程中调用，不应有副作用)
+            stable_ms: 识别文本保持不变多久后开始投机 (毫秒)
+            min_chars: 归一化后少于该字数的文本不投机
+            stats: 统计对象
+            on_commit: 投机结果被采用时调用，参数为 (投机文本, 结果)
+        """
+        self.generate = generate
+        self.on_commit = on_commit
+        self.stable = stable_ms / 1000
+        self.min_chars = min_chars
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._text = ''
+        self._since = 0.0
+        self._current: Optional[_Speculation] = None
+
+    def observe(self, text: str):
+        """
+        观察当前的识别文本 (定时调用)
+        文本变化时作废进行中的投机；稳定超过 stable_ms 时发起新的投机
+        """
+        now = time.time()
+        with self._lock:
+            if text != self._text:
+                self._text = text
+                self._since = now
+                if self._current and normalize_text(text) != self._current.key:
+                    self._discard()
+                return
+            if self._current or now - self._since < self.stable:
+                return
+            key = normalize_text(text)
+            if len(key) < self.min_chars:
+                return
+            speculation = _Speculation(text)
+            self._current = speculation
+        self.stats.record('started')
+        threading.Thread(target=self._run, args=(speculation,), daemon=True).start()
+
+    def _run(self, speculation: _Speculation):
+        try:
+            if not speculation.cancelled:
+                result = self.generate(speculation.text)
+                if not speculation.cancelled:
+                    speculation.result = result
+        except Exception as e:
+            logger.warning(f"[Speculation] 投机生成失败: {e}")
+        finally:
+            speculation.finished_at = time.time()
+            speculation.done.set()
+
+    def _discard(self, speculation: Optional[_Speculation] = None):
+        speculation = speculation or self._current
+        if speculation is self._current:
+            self._current = None
+        speculation.cancelled = True
+        self.stats.record('wasted')
+
+    def take(self, text: str, timeout: float = 30) -> Optional[str]:
+        """
+        话轮结束时领取投机结果
+
+        Args:
+            text: 最终文本
+            timeout: 等待进行中的投机完成的最长时间 (秒)
+
+        Returns:
+            文本一致且生成成功时返回投机结果，否则返回 None (调用方正常生成)
+        """
+        with self._lock:
+            speculation = self._current
+            self._current = None
+            self._text = ''
+            if speculation is None:
+                return None
+            if normalize_text(text) != speculation.key:
+                self._discard(speculation)
+                return None
+        ended_at = time.time()
+        if not speculation.done.wait(timeout) or not speculation.result:
+            self._discard(speculation)
+            return None
+        # 节省的时间：话轮结束时投机请求已经运行的时长 (不超过生成耗时)
+        saved = min(ended_at, speculation.finished_at) - speculation.started_at
+        self.stats.record('committed')
+        self.stats.record('saved_ms', saved * 1000)
+        logger.debug(f"[Speculation] 采用投机结果，节省 {saved * 1000:.0f}ms")
+        if self.on_commit:
+            try:
+                self.on_commit(speculation.text, speculation.result)
+            except Exception as e:
+                logger.warning(f"[Speculation] 处理采用的投机结果失败: {e}")
+        return speculation.result
+
+    def cancel(self):
+        """放弃进行中的投机 (如会话结束)"""
+        with self._lock:
+            if self._current:
+                self._discard()
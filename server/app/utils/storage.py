@@ -0,0 +1,344 @@
+"""
+对象存储
+统一的文件存储接口，按 STORAGE_PROVIDER 选择后端：
+    local - 写入 LOCAL_STORAGE_PATH，由 nginx 的 /uploads/ 对外提供
+    oss / cos / s3 - 通过 S3 兼容接口 (SigV4 签名) 写入对象存储；阿里云 OSS、腾讯云 COS 都提供 S3 兼容接口，
+                     s3 可指向 benchmarks/mock_s3_server.py 用于测试
+
+写入均为流式：按分片读取输入流，小文件一次 PUT，大文件使用分片上传并发上传多个分片，
+内存中最多同时保留 part_size * concurrency 字节
+"""
+import os
+import hmac
+import shutil
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, BinaryIO, Dict, List
+from urllib.parse import quote, urlparse
+from xml.etree import ElementTree
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class StorageError(Exception):
+    """存储后端返回错误"""
+
+
+def _read_full(stream: BinaryIO, size: int) -> bytes:
+    """
+    读取 size 字节，直到读满或到达流末尾
+    request.stream 等原始流的 read(n) 可能只返回当前已到达的部分数据
+    """
+    data = stream.read(size)
+    if not data or len(data) >= size:
+        return data
+    chunks = [data]
+    received = len(data)
+    while received < size:
+        data = stream.read(size - received)
+        if not data:
+            break
+        chunks.append(data)
+        received += len(data)
+    return b''.join(chunks)
+
+
+class TeeReader:
+    """读取时把数据同时写入另一个文件，用于一边上传一边保留本地副本"""
+
+    def __init__(self, stream: BinaryIO, copy_to: BinaryIO):
+        self.stream = stream
+        self.copy_to = copy_to
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self.copy_to.write(data)
+        return data
+
+
+class Storage(ABC):
+    """存储后端接口"""
+
+    @abstractmethod
+    def put_stream(self, key: str, stream: BinaryIO, content_type: str = 'application/octet-stream') -> int:
+        """
+        流式写入对象
+
+        Args:
+            key: 对象路径，如 voice/xxx.mp3
+            stream: 可读的二进制流
+            content_type: MIME 类型
+
+        Returns:
+            写入的字节数
+        """
+
+    def put_file(self, key: str, path: str, content_type: str = 'application/octet-stream') -> int:
+        with open(path, 'rb') as f:
+            return self.put_stream(key, f, content_type)
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        """对象的长期访问地址"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除对象，对象不存在时不报错"""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """对象在本机的路径，非本地存储返回 None"""
+        return None
+
+
+class LocalStorage(Storage):
+    """本地文件存储"""
+
+    def __init__(self, root: str, public_base_url: str = '', chunk_size: int = 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.public_base_url = public_base_url.rstrip('/')
+        self.chunk_size = chunk_size
+
+    def local_path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise StorageError(f'非法的对象路径: {key}')
+        return path
+
+    def put_stream(self, key, stream, content_type='application/octet-stream'):
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名，读取方不会看到写了一半的文件
+        temp_path = f"{path}.part"
+        try:
+            with open(temp_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, self.chunk_size)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            # 客户端断开、读取失败等，删除写了一半的临时文件
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def public_url(self, key):
+        return f"{self.public_base_url}/uploads/{quote(key)}"
+
+    def delete(self, key):
+        try:
+            os.unlink(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+class S3CompatibleStorage(Storage):
+    """S3 兼容对象存储 (阿里云 OSS / 腾讯云 COS / S3)"""
+
+    UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+    def __init__(self,
+                 endpoint: str,
+                 bucket: str,
+                 access_key: str,
+                 secret_key: str,
+                 region: str = 'us-east-1',
+                 path_style: bool = False,
+                 public_url: str = '',
+                 part_size: int = 8 * 1024 * 1024,
+                 concurrency: int = 4,
+                 timeout: float = 60):
+        """
+        Args:
+            endpoint: 接入地址，如 https://oss-cn-hangzhou.aliyuncs.com
+            bucket: 存储桶
+            access_key: 访问密钥ID
+            secret_key: 访问密钥
+            region: 签名使用的地域
+            path_style: True 使用 endpoint/bucket/key 形式，False 使用 bucket.endpoint/key 形式
+            public_url: 对象的公开访问前缀 (如 CDN 地址)，默认使用存储桶地址
+            part_size: 分片大小 (字节)，S3 协议要求除最后一片外不小于 5MB
+            concurrency: 并发上传的分片数
+            timeout: 单次请求超时 (秒)
+        """
+        if '://' not in endpoint:
+            endpoint = f"https://{endpoint}"
+        parsed = urlparse(endpoint)
+        self.scheme = parsed.scheme
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.path_style = path_style
+        self.host = parsed.netloc if path_style else f"{bucket}.{parsed.netloc}"
+        self.public_base = (public_url or self._object_base()).rstrip('/')
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def _object_base(self) -> str:
+        base = f"{self.scheme}://{self.host}"
+        return f"{base}/{self.bucket}" if self.path_style else base
+
+    def _path(self, key: str) -> str:
+        path = f"/{quote(key, safe='/~')}"
+        return f"/{self.bucket}{path}" if self.path_style else path
+
+    def _signed_headers(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str]) -> Dict[str, str]:
+        """AWS Signature Version 4"""
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        headers = dict(headers, host=self.host)
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = self.UNSIGNED_PAYLOAD
+
+        names = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_headers = ''.join(f"{name}:{lowered[name]}\n" for name in names)
+        signed_names = ';'.join(names)
+        canonical_query = '&'.join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())
+        )
+        canonical_request = '\n'.join([method, path, canonical_query, canonical_headers,
+                                       signed_names, self.UNSIGNED_PAYLOAD])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+        signing_key = _hmac(_hmac(_hmac(_hmac(f"AWS4{self.secret_key}".encode('utf-8'), date),
+                                        self.region), 's3'), 'aws4_request')
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_names}, Signature={signature}")
+        headers.pop('host')
+        return headers
+
+    def _request(self, method: str, key: str, query: Optional[Dict[str, str]] = None,
+                 data: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        query = query or {}
+        path = self._path(key)
+        signed = self._signed_headers(method, path, query, headers or {})
+        url = f"{self.scheme}://{self.host}{path}"
+        response = self._session.request(method, url, params=query, data=data, headers=signed, timeout=self.timeout)
+        if response.status_code >= 300:
+            raise StorageError(f'{method} {key} 失败: {response.status_code} {response.text[:200]}')
+        return response
+
+    def put_stream(self, key, stream, content_type='application/octet-stream'):
+        first = _read_full(stream, self.part_size)
+        second = _read_full(stream, self.part_size) if len(first) == self.part_size else b''
+        if not second:
+            self._request('PUT', key, data=first, headers={'Content-Type': content_type})
+            return len(first)
+        return self._multipart_upload(key, stream, content_type, [first, second])
+
+    def _multipart_upload(self, key: str, stream: BinaryIO, content_type: str, head_parts: List[bytes]) -> int:
+        response = self._request('POST', key, query={'uploads': ''}, headers={'Content-Type': content_type})
+        upload_id = ElementTree.fromstring(response.content).findtext('{*}UploadId')
+        etags = {}
+        # 限制同时在内存中的分片数
+        slots = threading.BoundedSemaphore(self.concurrency)
+        errors = []
+
+        def upload_part(number: int, data: bytes):
+            try:
+                part = self._request('PUT', key, query={'partNumber': str(number), 'uploadId': upload_id}, data=data)
+                etags[number] = part.headers.get('ETag', '')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        total = 0
+        number = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                pending = list(head_parts)
+                while not errors:
+                    data = pending.pop(0) if pending else _read_full(stream, self.part_size)
+                    if not data:
+                        break
+                    number += 1
+                    total += len(data)
+                    slots.acquire()
+                    executor.submit(upload_part, number, data)
+            if errors:
+                raise errors[0]
+            body = ''.join(
+                f"<Part><PartNumber>{n}</PartNumber><ETag>{etags[n]}</ETag></Part>" for n in sorted(etags)
+            )
+            self._request('POST', key, query={'uploadId': upload_id},
+                          data=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode('utf-8'),
+                          headers={'Content-Type': 'application/xml'})
+        except Exception:
+            try:
+                self._request('DELETE', key, query={'uploadId': upload_id})
+            except Exception:
+                pass
+            raise
+        logger.info(f"[Storage] 分片上传完成: {key}, {number} 个分片, {total} bytes")
+        return total
+
+    def public_url(self, key):
+        return f"{self.public_base}/{quote(key, safe='/~')}"
+
+    def delete(self, key):
+        self._request('DELETE', key)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(config) -> Storage:
+    """按配置创建存储后端"""
+    provider = config.get('STORAGE_PROVIDER', 'local')
+    part_size = config.get('STORAGE_PART_SIZE_MB', 8) * 1024 * 1024
+    concurrency = config.get('STORAGE_CONCURRENCY', 4)
+    if provider == 'oss':
+        return S3CompatibleStorage(
+            config.get('OSS_ENDPOINT'), config.get('OSS_BUCKET'),
+            config.get('OSS_ACCESS_KEY_ID'), config.get('OSS_ACCESS_KEY_SECRET'),
+            region=config.get('OSS_REGION'), public_url=config.get('STORAGE_PUBLIC_URL', ''),
+            part_size=part_size, concurrency=concurrency
+        )
+    if provider == 'cos':
+        return S3CompatibleStorage(
+            f"cos.{config.get('COS_REGION')}.myqcloud.com", config.get('COS_BUCKET'),
+            config.get('COS_SECRET_ID'), config.get('COS_SECRET_KEY'),
+            region=config.get('COS_REGION'), public_url=config.get('STORAGE_PUBLIC_URL', ''),
+            part_size=part_size, concurrency=concurrency
+        )
+    if provider == 's3':
+        return S3CompatibleStorage(
+            config.get('S3_ENDPOINT'), config.get('S3_BUCKET'),
+            config.get('S3_ACCESS_KEY_ID'), config.get('S3_SECRET_ACCESS_KEY'),
+            region=config.get('S3_REGION', 'us-east-1'), path_style=config.get('S3_PATH_STYLE', True),
+            public_url=config.get('STORAGE_PUBLIC_URL', ''),
+            part_size=part_size, concurrency=concurrency
+        )
+    return LocalStorage(config.get('LOCAL_STORAGE_PATH', './uploads'),
+                        config.get('STORAGE_PUBLIC_URL') or config.get('PUBLIC_BASE_URL', ''))
+
+
+def get_storage(config) -> Storage:
+    """获取进程内唯一的存储后端"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(config)
+    return _storage
@@ -0,0 +1,364 @@
+"""
+流式语音识别组件
+实时对话统一使用 StreamingASR：
+    - 识别结果分为中间结果 (partial) 和句子结束的最终结果 (final) 两类事件
+    - 连接建立期间收到的音频帧先缓存，连接就绪后按顺序补发
+    - 上游连接在一句话中途断开时自动重连，并重放最近 N 毫秒的音频，避免丢字
+    - 底层协议由可替换的传输层实现：websocket (百炼实时识别协议，也可指向本地模拟服务) / sdk (dashscope Recognition)
+"""
+import json
+import base64
+import threading
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional, Callable, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ASRResult:
+    """一条识别结果"""
+
+    __slots__ = ('text', 'is_final', 'begin_time', 'end_time')
+
+    def __init__(self, text: str, is_final: bool = False, begin_time: int = 0, end_time: Optional[int] = None):
+        self.text = text
+        self.is_final = is_final
+        self.begin_time = begin_time
+        self.end_time = end_time
+
+    def __repr__(self):
+        return f"ASRResult({self.text!r}, final={self.is_final})"
+
+
+def parse_sentence(sentence: Dict[str, Any]) -> Optional[ASRResult]:
+    """将服务端返回的 sentence 转换为 ASRResult"""
+    if not sentence:
+        return None
+    return ASRResult(
+        text=sentence.get('text', ''),
+        is_final=bool(sentence.get('sentence_end')),
+        begin_time=sentence.get('begin_time') or 0,
+        end_time=sentence.get('end_time')
+    )
+
+
+class ASRTransport(ABC):
+    """
+    传输层接口
+    connect 后通过回调上报 on_result(ASRResult)、on_error(str)、on_close()
+    """
+
+    @abstractmethod
+    def connect(self,
+                on_result: Callable[[ASRResult], None],
+                on_error: Callable[[str], None],
+                on_close: Callable[[], None]):
+        """建立连接 (不等待连接就绪)"""
+
+    @abstractmethod
+    def wait_open(self, timeout: float) -> bool:
+        """等待连接就绪，超时返回 False"""
+
+    @abstractmethod
+    def send_audio(self, data: bytes):
+        """发送一帧 PCM 音频"""
+
+    @abstractmethod
+    def close(self):
+        """结束识别并关闭连接"""
+
+
+class WebSocketTransport(ASRTransport):
+    """百炼实时识别 WebSocket 协议，连接从预热连接池领取"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._conn = None
+
+    def connect(self, on_result, on_error, on_close):
+        def handle_message(ws, message):
+            try:
+                data = json.loads(message)
+            except ValueError:
+                return
+            header = data.get('header') or {}
+            if header.get('event') == 'task-failed':
+                on_error(header.get('error_message') or '识别任务失败')
+                return
+            payload = data.get('payload') or {}
+            result = parse_sentence((payload.get('output') or payload).get('sentence'))
+            if result:
+                on_result(result)
+
+        self._conn = self.pool.acquire()
+        self._conn.bind(
+            on_message=handle_message,
+            on_error=lambda ws, error: on_error(str(error)),
+            on_close=lambda ws, code, msg: on_close()
+        )
+
+    def wait_open(self, timeout: float) -> bool:
+        return self._conn.wait_open(timeout)
+
+    def send_audio(self, data: bytes):
+        self._conn.send(json.dumps({
+            "header": {
+                "action": "send_audio"
+            },
+            "payload": {
+                "audio": base64.b64encode(data).decode('utf-8')
+            }
+        }))
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+
+
+class SDKTransport(ASRTransport):
+    """dashscope SDK 的 Recognition 实时识别"""
+
+    def __init__(self, api_key: str, model: str = 'paraformer-realtime-v2', sample_rate: int = 16000):
+        self.api_key = api_key
+        self.model = model
+        self.sample_rate = sample_rate
+        self._recognition = None
+        self._opened = threading.Event()
+
+    def connect(self, on_result, on_error, on_close):
+        from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
+
+        opened = self._opened
+
+        class Callback(RecognitionCallback):
+            def on_open(self):
+                opened.set()
+
+            def on_event(self, result):
+                sentence = result.get_sentence()
+                if isinstance(sentence, dict):
+                    parsed = parse_sentence(dict(sentence, sentence_end=RecognitionResult.is_sentence_end(sentence)))
+                    if parsed:
+                        on_result(parsed)
+
+            def on_error(self, result):
+                on_error(getattr(result, 'message', None) or str(result))
+
+            def on_close(self):
+                on_close()
+
+        # 密钥随请求传入，不修改全局的 dashscope.api_key
+        self._recognition = Recognition(
+            model=self.model,
+            format='pcm',
+            sample_rate=self.sample_rate,
+            language_hints=['zh', 'en'],
+            callback=Callback(),
+            api_key=self.api_key
+        )
+        self._recognition.start()
+
+    def wait_open(self, timeout: float) -> bool:
+        return self._opened.wait(timeout)
+
+    def send_audio(self, data: bytes):
+        self._recognition.send_audio_frame(data)
+
+    def close(self):
+        if self._recognition:
+            try:
+                self._recognition.stop()
+            except Exception:
+                pass
+
+
+class StreamingASR:
+    """流式语音识别会话"""
+
+    def __init__(self,
+                 transport_factory: Callable[[], ASRTransport],
+                 on_partial: Optional[Callable[[ASRResult], None]] = None,
+                 on_final: Optional[Callable[[ASRResult], None]] = None,
+                 on_error: Optional[Callable[[str], None]] = None,
+                 sample_rate: int = 16000,
+                 replay_ms: int = 3000,
+                 buffer_ms: int = 10000,
+                 max_reconnects: int = 2,
+                 open_timeout: float = 5):
+        """
+        Args:
+            transport_factory: 创建传输层的工厂，重连时会再次调用
+            on_partial: 中间结果回调
+            on_final: 句子结束回调
+            on_error: 不可恢复的错误回调 (重连次数用尽等)
+            sample_rate: PCM 采样率 (16bit 单声道)
+            replay_ms: 断线重连后重放的音频时长 (毫秒)，只重放尚未得到最终结果的部分
+            buffer_ms: 连接建立期间最多缓存的音频时长 (毫秒)，超出时丢弃最早的帧
+            max_reconnects: 最大重连次数
+            open_timeout: 等待连接就绪的超时 (秒)
+        """
+        self.transport_factory = transport_factory
+        self.on_partial = on_partial
+        self.on_final = on_final
+        self.on_error = on_error
+        self.replay_ms = replay_ms
+        self.buffer_ms = buffer_ms
+        self.max_reconnects = max_reconnects
+        self.open_timeout = open_timeout
+        self._bytes_per_ms = sample_rate * 2 / 1000
+        self._lock = threading.Lock()
+        self._transport = None
+        self._generation = 0
+        self._open = False
+        self._closing = False
+        # 连接就绪前待发送的帧
+        self._pending = deque()
+        self._pending_bytes = 0
+        # 尚未得到最终结果的最近音频，用于重连后重放
+        self._replay = deque()
+        self._replay_bytes = 0
+        self._opened = threading.Event()
+        self.reconnects = 0
+
+    def _duration_ms(self, size: int) -> float:
+        return size / self._bytes_per_ms
+
+    def start(self):
+        """建立连接 (不阻塞)，就绪后自动补发缓存的音频"""
+        self._connect()
+
+    def wait_open(self, timeout: Optional[float] = None) -> bool:
+        """等待首次连接就绪"""
+        return self._opened.wait(self.open_timeout if timeout is None else timeout)
+
+    def _connect(self):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._open = False
+        transport = self.transport_factory()
+        self._transport = transport
+
+        def current() -> bool:
+            return generation == self._generation and not self._closing
+
+        def handle_result(result: ASRResult):
+            if not current():
+                return
+            if result.is_final:
+                # 这段音频已经得到最终结果，不再需要重放
+                with self._lock:
+                    self._replay.clear()
+                    self._replay_bytes = 0
+                if self.on_final:
+                    self.on_final(result)
+            elif self.on_partial:
+                self.on_partial(result)
+
+        def handle_error(message: str):
+            if current():
+                logger.error(f"[StreamingASR] 识别错误: {message}")
+
+        def handle_close():
+            if current():
+                threading.Thread(target=self._reconnect, daemon=True).start()
+
+        transport.connect(handle_result, handle_error, handle_close)
+        threading.Thread(target=self._flush_when_open, args=(transport, generation), daemon=True).start()
+
+    def _flush_when_open(self, transport: ASRTransport, generation: int):
+        if not transport.wait_open(self.open_timeout):
+            with self._lock:
+                if generation != self._generation or self._closing:
+                    return
+                # 先让旧连接的回调失效，再关闭
+                self._generation += 1
+            logger.warning(f"[StreamingASR] 连接未能在{self.open_timeout}秒内就绪")
+            transport.close()
+            self._reconnect()
+            return
+        with self._lock:
+            if generation != self._generation or self._closing:
+                return
+            try:
+                while self._pending:
+                    transport.send_audio(self._pending[0])
+                    self._pending_bytes -= len(self._pending.popleft())
+            except Exception as e:
+                logger.warning(f"[StreamingASR] 补发缓存音频失败: {e}")
+                return
+            self._open = True
+        self._opened.set()
+
+    def _reconnect(self):
+        with self._lock:
+            if self._closing:
+                return
+            if self.reconnects >= self.max_reconnects:
+                self._closing = True
+                give_up = True
+            else:
+                self.reconnects += 1
+                give_up = False
+                # 未发送过的旧帧在前，接着重放尚未得到最终结果的音频 (其中已包含断线期间的新帧)
+                replay_ids = {id(frame) for frame in self._replay}
+                self._pending = deque(frame for frame in self._pending if id(frame) not in replay_ids)
+                self._pending.extend(self._replay)
+                self._pending_bytes = sum(len(frame) for frame in self._pending)
+        if give_up:
+            logger.warning("[StreamingASR] 重连次数已用尽")
+            if self.on_error:
+                self.on_error('语音识别连接已断开')
+            return
+        logger.warning(f"[StreamingASR] 上游连接断开，第{self.reconnects}次重连，"
+                       f"重放 {self._duration_ms(self._replay_bytes):.0f}ms 音频")
+        try:
+            self._connect()
+        except Exception as e:
+            logger.warning(f"[StreamingASR] 重连失败: {e}")
+            self._reconnect()
+
+    def send_audio(self, data: bytes):
+        """发送一帧 PCM 音频"""
+        if not data:
+            return
+        with self._lock:
+            if self._closing:
+                return
+            self._replay.append(data)
+            self._replay_bytes += len(data)
+            while self._replay and self._duration_ms(self._replay_bytes - len(self._replay[0])) >= self.replay_ms:
+                self._replay_bytes -= len(self._replay.popleft())
+
+            if self._open:
+                try:
+                    self._transport.send_audio(data)
+                    return
+                except Exception as e:
+                    # 发送失败说明连接已断开，等待重连后补发
+                    logger.warning(f"[StreamingASR] 发送音频失败: {e}")
+                    self._open = False
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            while self._pending and self._duration_ms(self._pending_bytes) > self.buffer_ms:
+                self._pending_bytes -= len(self._pending.popleft())
+
+    def close(self):
+        """结束识别"""
+        with self._lock:
+            self._closing = True
+            transport = self._transport
+        if transport:
+            transport.close()
+
+
+def create_transport_factory(config) -> Callable[[], ASRTransport]:
+    """根据配置创建传输层工厂"""
+    if config.get('ASR_REALTIME_TRANSPORT', 'websocket') == 'sdk':
+        return lambda: SDKTransport(config.get('ALIYUN_API_KEY', ''),
+                                    sample_rate=config.get('ASR_SAMPLE_RATE', 16000))
+    from .asr_pool import get_asr_pool
+    pool = get_asr_pool(config)
+    return lambda: WebSocketTransport(pool)
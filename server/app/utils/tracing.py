@@ -0,0 +1,461 @@
+"""
+链路追踪
+每个 HTTP 请求和每个实时对话话轮是一条 trace，其中的数据库查询、百炼平台调用、语音合成、WebSocket 发送等是子 span：
+    - 输出 OpenTelemetry (OTLP/JSON) 格式：exporter=otlp 时发送到采集器的 /v1/traces，exporter=file 时每条 trace 一行写入文件
+    - HTTP 请求带有 W3C traceparent 头时沿用其 trace ID，上游标记为已采样的一定导出
+    - 头部采样：按 sample_rate 决定是否导出；慢 trace (超过 slow_ms) 无论是否采样都导出，
+      并以缩进树的形式写入慢 trace 文件，最近的若干条可在 /admin/traces 查看
+    - 当前 span 保存在 contextvars 中 (每个线程 / greenlet 独立)，新线程中需要用 contextvars.copy_context() 传递
+
+没有进行中的 trace 时 span() 直接返回空 span，几乎没有开销
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Any
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# OTLP SpanKind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current: contextvars.ContextVar = contextvars.ContextVar('echotalk_span', default=None)
+
+
+class Span:
+    """一个操作的耗时记录"""
+    __slots__ = ('name', 'trace', 'span_id', 'parent_id', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name: str, trace: 'Trace', parent_id: Optional[str], kind: int,
+                 attributes: Optional[Dict], start_ns: Optional[int]):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    """没有进行中的 trace 时使用"""
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_exception(self, exc: BaseException):
+        pass
+
+    def end(self, end_ns: Optional[int] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """一条 trace 中的全部 span"""
+
+    def __init__(self, trace_id: str, sampled: bool, slow_ms: float, max_spans: int):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> bool:
+        with self._lock:
+            if self.finished or len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return False
+            self.spans.append(span)
+            return True
+
+
+def parse_traceparent(header: Optional[str]):
+    """解析 W3C traceparent 头，返回 (trace_id, 父 span ID, 是否已采样)，格式不对时返回 None"""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == '0' * 32:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(traces: List[Trace], service_name: str) -> Dict:
+    """转换为 OTLP/JSON 的 ExportTraceServiceRequest"""
+    spans = []
+    for trace in traces:
+        for span in trace.spans:
+            item = {
+                'traceId': trace.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': span.kind,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns or span.start_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+            }
+            if span.parent_id:
+                item['parentSpanId'] = span.parent_id
+            spans.append(item)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [
+            {'key': 'service.name', 'value': {'stringValue': service_name}},
+            {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+        ]},
+        'scopeSpans': [{'scope': {'name': 'echotalk'}, 'spans': spans}],
+    }]}
+
+
+def render_tree(trace: Trace) -> Dict:
+    """慢 trace 的可读形式：按开始时间排列的 span 树"""
+    root = trace.spans[0]
+    children: Dict[Optional[str], List[Span]] = {}
+    for span in trace.spans[1:]:
+        children.setdefault(span.parent_id, []).append(span)
+    rows = []
+
+    def visit(span: Span, depth: int):
+        row = {
+            'span': '  ' * depth + span.name,
+            'offset_ms': round((span.start_ns - root.start_ns) / 1e6, 1),
+            'duration_ms': round(span.duration_ms, 1),
+        }
+        if span.attributes:
+            row['attributes'] = span.attributes
+        if span.error:
+            row['error'] = span.error
+        rows.append(row)
+        for child in sorted(children.get(span.span_id, []), key=lambda s: s.start_ns):
+            visit(child, depth + 1)
+
+    visit(root, 0)
+    return {
+        'trace_id': trace.trace_id,
+        'name': root.name,
+        'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(root.start_ns / 1e9)),
+        'duration_ms': round(root.duration_ms, 1),
+        'dropped_spans': trace.dropped,
+        'spans': rows,
+    }
+
+
+class TraceExporter:
+    """后台线程批量导出 trace，队列满时丢弃"""
+
+    def __init__(self, exporter: str, service_name: str, otlp_endpoint: str = '',
+                 file_path: str = '', slow_file: str = '', batch_size: int = 50, queue_size: int = 1000):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.otlp_endpoint = otlp_endpoint
+        self.file_path = file_path
+        self.slow_file = slow_file
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._session = requests.Session()
+        self.stats = {'exported': 0, 'dropped': 0, 'failures': 0}
+        self._pid = None
+        self._lock = threading.Lock()
+        for path in (file_path, slow_file):
+            if path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def submit(self, trace: Trace, slow: bool):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((trace, slow))
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def _ensure_started(self):
+        # gunicorn --preload 时在 fork 之后的 worker 中启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop, daemon=True, name='trace-export').start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+                self.stats['exported'] += len(batch)
+            except Exception as e:
+                self.stats['failures'] += 1
+                logger.warning(f"[Trace] 导出失败: {e}", extra={'rate_key': 'trace.export'})
+
+    def _export(self, batch):
+        slow = [trace for trace, is_slow in batch if is_slow]
+        if slow and self.slow_file:
+            with open(self.slow_file, 'a', encoding='utf-8') as f:
+                for trace in slow:
+                    f.write(json.dumps(render_tree(trace), ensure_ascii=False, default=str) + '\n')
+        traces = [trace for trace, _ in batch]
+        if self.exporter == 'otlp' and self.otlp_endpoint:
+            response = self._session.post(self.otlp_endpoint, json=to_otlp(traces, self.service_name), timeout=5)
+            response.raise_for_status()
+        elif self.exporter == 'file' and self.file_path:
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                for trace in traces:
+                    f.write(json.dumps(to_otlp([trace], self.service_name), ensure_ascii=False) + '\n')
+
+
+class Tracer:
+    """创建 trace 和 span"""
+
+    def __init__(self, exporter: Optional[TraceExporter], sample_rate: float = 0.01,
+                 slow_ms: float = 3000, max_spans: int = 500, keep_slow: int = 50):
+        """
+        Args:
+            exporter: 导出器，None 表示只保留慢 trace 在内存中
+            sample_rate: 头部采样率 (0-1)
+            slow_ms: 默认的慢 trace 阈值 (毫秒)
+            max_spans: 每条 trace 最多记录的 span 数
+            keep_slow: 内存中保留的最近慢 trace 数
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_spans = max_spans
+        self.recent_slow = deque(maxlen=keep_slow)
+        self.stats = {'traces': 0, 'sampled': 0, 'slow': 0}
+        self._lock = threading.Lock()
+
+    def start_trace(self, name: str, attributes: Optional[Dict] = None, traceparent: Optional[str] = None,
+                    start_ns: Optional[int] = None, kind: int = KIND_SERVER,
+                    slow_ms: Optional[float] = None) -> Span:
+        """开始一条 trace，返回根 span (需要用 end_trace 结束)"""
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+            sampled = sampled or random.random() < self.sample_rate
+        else:
+            trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < self.sample_rate
+        trace = Trace(trace_id, sampled, slow_ms if slow_ms is not None else self.slow_ms, self.max_spans)
+        root = Span(name, trace, parent_id, kind, attributes, start_ns)
+        trace.add(root)
+        return root
+
+    def start_span(self, name: str, parent: Span, attributes: Optional[Dict] = None,
+                   start_ns: Optional[int] = None, kind: int = KIND_INTERNAL) -> Optional[Span]:
+        """在 parent 所在的 trace 中开始一个子 span (不设为当前 span)，超过 span 数上限时返回 None"""
+        span = Span(name, parent.trace, parent.span_id, kind, attributes, start_ns)
+        return span if parent.trace.add(span) else None
+
+    def end_trace(self, root: Span):
+        """结束 trace，按采样和耗时决定是否导出"""
+        root.end()
+        trace = root.trace
+        with trace._lock:
+            if trace.finished:
+                return
+            trace.finished = True
+        slow = root.duration_ms >= trace.slow_ms
+        with self._lock:
+            self.stats['traces'] += 1
+            self.stats['sampled'] += trace.sampled
+            self.stats['slow'] += slow
+        if slow:
+            self.recent_slow.append(trace)
+            logger.warning(f"[Trace] 慢 trace: {root.name} {root.duration_ms:.0f}ms",
+                           extra={'trace_id': trace.trace_id, 'rate_key': 'trace.slow'})
+        if self.exporter and (slow or (trace.sampled and self.exporter.exporter != 'none')):
+            self.exporter.submit(trace, slow)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        if self.exporter:
+            stats['export'] = dict(self.exporter.stats)
+        stats['recent_slow'] = [render_tree(trace) for trace in list(self.recent_slow)[::-1]]
+        return stats
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def init_tracing(config) -> Optional[Tracer]:
+    """按配置创建进程内唯一的 tracer (重复调用无副作用)"""
+    global _tracer
+    if not config.get('TRACING_ENABLED', False):
+        return None
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                exporter = None
+                if config.get('TRACING_EXPORTER', 'none') != 'none' or config.get('TRACING_SLOW_FILE'):
+                    exporter = TraceExporter(
+                        config.get('TRACING_EXPORTER', 'none'),
+                        service_name=config.get('TRACING_SERVICE_NAME', 'echotalk'),
+                        otlp_endpoint=config.get('TRACING_OTLP_ENDPOINT', ''),
+                        file_path=config.get('TRACING_FILE', ''),
+                        slow_file=config.get('TRACING_SLOW_FILE', '')
+                    )
+                _tracer = Tracer(exporter,
+                                 sample_rate=config.get('TRACING_SAMPLE_RATE', 0.01),
+                                 slow_ms=config.get('TRACING_SLOW_MS', 3000))
+    return _tracer
+
+
+def tracing_snapshot() -> Optional[Dict]:
+    """追踪统计和最近的慢 trace，未启用时返回 None"""
+    return _tracer.snapshot() if _tracer else None
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def activate(span: Span):
+    """把 span 设为当前 span，返回用于 deactivate 的 token"""
+    return _current.set(span)
+
+
+def deactivate(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # 流式响应结束时可能已不在设置 token 的上下文中
+        _current.set(None)
+
+
+def ns_ago(seconds: float) -> int:
+    """seconds 秒之前的时间戳 (纳秒)，用于把 time.perf_counter 记录的时间点换算为 span 的开始时间"""
+    return time.time_ns() - int(seconds * 1e9)
+
+
+@contextmanager
+def trace(name: str, attributes: Optional[Dict] = None, traceparent: Optional[str] = None,
+          start_ns: Optional[int] = None, slow_ms: Optional[float] = None):
+    """
+    开始一条 trace 并设为当前 span；未启用追踪时返回空 span
+
+    Args:
+        name: 根 span 名称
+        attributes: 属性
+        traceparent: 上游的 W3C traceparent
+        start_ns: 开始时间 (纳秒)，默认为现在
+        slow_ms: 慢 trace 阈值，默认使用配置
+    """
+    if _tracer is None:
+        yield NOOP_SPAN
+        return
+    root = _tracer.start_trace(name, attributes, traceparent, start_ns, slow_ms=slow_ms)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        _tracer.end_trace(root)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """在当前 trace 中记录一个子 span；没有进行中的 trace 时返回空 span"""
+    parent = _current.get()
+    if parent is None or _tracer is None:
+        yield NOOP_SPAN
+        return
+    child = _tracer.start_span(name, parent, attributes, kind=kind)
+    if child is None:
+        yield NOOP_SPAN
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, **attributes) -> Optional[Span]:
+    """在当前 trace 中开始一个子 span，但不设为当前 span (由调用方 end)；没有进行中的 trace 时返回 None"""
+    parent = _current.get()
+    if parent is None or _tracer is None:
+        return None
+    return _tracer.start_span(name, parent, attributes, kind=kind)
+
+
+def add_span(name: str, start_ns: int, end_ns: Optional[int] = None, **attributes):
+    """在当前 trace 中补记一个已经结束的 span (如等待用户说完的时间)"""
+    parent = _current.get()
+    if parent is None or _tracer is None:
+        return
+    child = _tracer.start_span(name, parent, attributes, start_ns=start_ns)
+    if child is not None:
+        child.end(end_ns)
+
+
+def traced(name: str, kind: int = KIND_INTERNAL):
+    """把函数调用记录为当前 trace 中的 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,182 @@
+"""
+语音合成连接复用
+dashscope 的 SpeechSynthesizer 每次新建都要重新做 TLS + WebSocket 握手。这里使用 SDK 提供的
+SpeechSynthesizerObjectPool：预先建立 size 个连接，借出时由 SDK 按本次的模型、音色和回调更新参数，
+归还后供下次复用；池中的连接由 SDK 的后台线程定期重建 (服务端会关闭长时间空闲的连接)
+
+密钥：SDK 构造合成器时要求全局的 dashscope.api_key 不为空，但握手使用的 Authorization 请求头
+可以由 headers 覆盖。密钥通过 headers 随每个合成器传入，不在运行中修改全局的 dashscope.api_key
+(全局密钥为空时只在创建池时设置一次，满足 SDK 的非空检查)。其它接口 (Files / Transcription / Recognition)
+直接按调用传入 api_key
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict
+
+
+def auth_headers(api_key: str) -> Dict[str, str]:
+    """合成器握手使用的请求头，覆盖 SDK 从全局 dashscope.api_key 生成的 Authorization"""
+    return {'Authorization': f'Bearer {api_key}'}
+
+
+def ensure_sdk_api_key(api_key: str):
+    """SDK 要求全局 dashscope.api_key 非空，未设置时设置一次 (实际密钥以 auth_headers 为准)"""
+    import dashscope
+    if not dashscope.api_key:
+        dashscope.api_key = api_key
+
+
+class SynthesizerPool:
+    """基于 SDK SpeechSynthesizerObjectPool 的语音合成器池"""
+
+    def __init__(self, api_key: str, size: int = 4, url: Optional[str] = None):
+        """
+        Args:
+            api_key: 百炼 API Key
+            size: 预先建立的连接数 (1~100)
+            url: WebSocket 地址，默认使用 SDK 的地址
+        """
+        self.api_key = api_key
+        self.size = size
+        self.url = url
+        self.headers = auth_headers(api_key)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'created_ms': 0.0, 'reused_ms': 0.0}
+
+    def _sdk_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = self._create_sdk_pool()
+        return self._pool
+
+    def _create_sdk_pool(self):
+        from dashscope.audio.tts_v2 import SpeechSynthesizerObjectPool
+
+        ensure_sdk_api_key(self.api_key)
+        result = {}
+
+        def create():
+            try:
+                result['pool'] = SpeechSynthesizerObjectPool(max_size=self.size, url=self.url, headers=self.headers)
+            except BaseException as e:
+                result['error'] = e
+
+        # SDK 的重连线程不是守护线程，会阻止进程退出；线程的守护属性继承自创建它的线程，
+        # 因此在守护线程中创建池
+        creator = threading.Thread(target=create, daemon=True, name='tts-pool-init')
+        creator.start()
+        creator.join()
+        if 'error' in result:
+            raise result['error']
+        return result['pool']
+
+    def acquire(self, model: str, voice: str, callback=None):
+        """
+        领取一个合成器
+
+        Args:
+            model: 模型名称
+            voice: 音色名称
+            callback: ResultCallback，None 表示同步合成 (call 返回完整音频)
+
+        Returns:
+            SpeechSynthesizer (池中没有可用连接时是一个新建的、首次合成时才连接的合成器)
+        """
+        started = time.perf_counter()
+        synthesizer = self._sdk_pool().borrow_synthesizer(model, voice, callback=callback)
+        key = 'reused' if synthesizer.ws is not None else 'created'
+        with self._lock:
+            self._in_use += 1
+            self.stats[key] += 1
+            self.stats[f"{key}_ms"] += (time.perf_counter() - started) * 1000
+        return synthesizer
+
+    def release(self, synthesizer, reusable: bool = True):
+        """
+        归还合成器
+
+        Args:
+            synthesizer: acquire 领取的合成器
+            reusable: 任务是否正常结束；取消或出错的连接上可能还有上个任务的消息，不再复用
+        """
+        from dashscope.audio.tts_v2 import SpeechSynthesizer
+
+        with self._lock:
+            self._in_use = max(self._in_use - 1, 0)
+        ws = synthesizer.ws
+        if reusable and ws and ws.sock and ws.sock.connected:
+            # SDK 归还成功时返回 None，池已满 (如池耗尽时新建的合成器) 时返回 False
+            if self._sdk_pool().return_synthesizer(synthesizer) is not False:
+                return
+        else:
+            with self._lock:
+                self.stats['discarded'] += 1
+            # 归还一个未连接的合成器占位，由 SDK 的后台线程重新建立连接，池的大小不变
+            placeholder = SpeechSynthesizer(model=synthesizer.model, voice=synthesizer.voice,
+                                            url=self.url, headers=self.headers)
+            self._sdk_pool().return_synthesizer(placeholder)
+        self._close(synthesizer)
+
+    @staticmethod
+    def _close(synthesizer):
+        try:
+            synthesizer.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def synthesizer(self, model: str, voice: str, callback=None):
+        """领取合成器，正常结束时归还，出错时关闭"""
+        synthesizer = self.acquire(model, voice, callback)
+        try:
+            yield synthesizer
+        except BaseException:
+            self.release(synthesizer, reusable=False)
+            raise
+        self.release(synthesizer)
+
+    def shutdown(self):
+        """停止 SDK 的重连线程"""
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = self.size
+            stats['in_use'] = self._in_use
+            stats['idle'] = max(self.size - self._in_use, 0) if self._pool is not None else 0
+        acquired = stats['created'] + stats['reused']
+        stats['reuse_rate'] = round(stats['reused'] / acquired, 3) if acquired else None
+        # 新建 (首次合成时才握手) 与复用的平均领取耗时
+        for key in ('created', 'reused'):
+            total = stats.pop(f"{key}_ms")
+            stats[f"avg_{key}_ms"] = round(total / stats[key], 2) if stats[key] else None
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_synthesizer_pool(config) -> SynthesizerPool:
+    """获取进程内唯一的语音合成器池 (SDK 的对象池本身也是进程内单例)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SynthesizerPool(
+                    api_key=config.get('ALIYUN_API_KEY', ''),
+                    size=config.get('TTS_POOL_SIZE', 4),
+                    url=config.get('TTS_WS_URL') or None
+                )
+    return _pool
+
+
+def synthesizer_pool_snapshot() -> Optional[dict]:
+    """合成器池统计，本进程尚未创建时返回 None"""
+    return _pool.snapshot() if _pool is not None else None
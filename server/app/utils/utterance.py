@@ -0,0 +1,84 @@
+"""
+话轮拼装
+把流式识别的结果拼成用户的一整轮发言：
+    - 句子结束 (sentence_end) 的结果依次追加，中间结果单独保存，不会覆盖已确定的句子
+    - 收到句子结束后再等待一个短暂的宽限期，期间没有新的识别结果才认为这一轮说完了
+    - 服务端迟迟没有返回句子结束时，识别结果超过 silence_ms 没有变化也结束这一轮
+"""
+import time
+import threading
+from typing import Optional, List
+
+
+class UtteranceAssembler:
+    """话轮拼装器"""
+
+    def __init__(self, grace_ms: float = 300, silence_ms: float = 1500):
+        """
+        Args:
+            grace_ms: 句子结束后的宽限期 (毫秒)
+            silence_ms: 没有句子结束事件时，识别结果保持不变多久后结束这一轮 (毫秒)
+        """
+        self.grace = grace_ms / 1000
+        self.silence = silence_ms / 1000
+        self._lock = threading.Lock()
+        self._sentences: List[str] = []
+        self._partial = ''
+        self._last_update = 0.0
+        self._turn_end_at = None
+
+    def add_partial(self, text: str):
+        """收到中间结果：用户还在说，取消待定的话轮结束"""
+        with self._lock:
+            if text != self._partial:
+                self._partial = text
+                self._last_update = time.time()
+                self._turn_end_at = None
+
+    def add_final(self, text: str):
+        """收到句子结束：追加句子，宽限期后结束话轮"""
+        with self._lock:
+            if text:
+                self._sentences.append(text)
+            self._partial = ''
+            self._last_update = time.time()
+            if self._sentences:
+                self._turn_end_at = self._last_update + self.grace
+
+    @property
+    def text(self) -> str:
+        """当前话轮的完整文本 (已确定的句子 + 中间结果)"""
+        with self._lock:
+            return self._text()
+
+    def _text(self) -> str:
+        return ''.join(self._sentences) + self._partial
+
+    def poll(self) -> Optional[str]:
+        """
+        检查话轮是否结束
+
+        Returns:
+            结束时返回这一轮的完整文本并清空状态，否则返回 None
+        """
+        now = time.time()
+        with self._lock:
+            if not self._sentences and not self._partial:
+                return None
+            if self._turn_end_at is not None and now >= self._turn_end_at:
+                return self._take()
+            if self._partial and now - self._last_update >= self.silence:
+                return self._take()
+            return None
+
+    def flush(self) -> Optional[str]:
+        """立即结束当前话轮 (如会话结束时)，没有内容返回 None"""
+        with self._lock:
+            return self._take() if (self._sentences or self._partial) else None
+
+    def _take(self) -> str:
+        text = self._text()
+        self._sentences = []
+        self._partial = ''
+        self._turn_end_at = None
+        return text
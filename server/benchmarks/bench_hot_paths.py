@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+服务端热点路径的微基准测试
+单独测量各热点路径的 CPU 耗时，与保存的基线对比，部署前发现性能退化
+
+    sse_parse            _parse_stream_response 解析一段长回忆录的流式响应 (同时给出 MB/s)
+    realtime_frame       实时对话收到一帧音频：JSON 解码 + base64 解码，再编码为识别服务的 send_audio 消息
+    memoir_source        generate_memoir 中把聊天记录拼成素材文本和 messages (直接使用原文的路径)
+    memoir_chunks        长会话按 token 预算切分为摘要分段
+    response_success     success() 经 Flask 序列化为 JSON 响应
+    response_error       error() 经 Flask 序列化为 JSON 响应
+    mysql_execute        MySQLDB.execute 执行一条带参数的查询 (需要 config.ini 中的 MySQL 可连接，否则跳过)
+
+每项先自动确定循环次数使单轮不少于 --min-time / --repeat 秒，共测 --repeat 轮；
+与基线对比时使用各轮中最快一轮的单次耗时 (受机器上其它负载的影响最小)。
+基线保存在 benchmarks/baselines/hot_paths.json，与机器相关：换机器后先在目标机器上用 --save 重新生成
+
+用法:
+    python benchmarks/bench_hot_paths.py                    与基线对比，任一项变慢超过 --tolerance 时退出码为 1
+    python benchmarks/bench_hot_paths.py --save             保存为新的基线
+    python benchmarks/bench_hot_paths.py --filter sse       只运行名称包含 sse 的项
+"""
+import gc
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import platform
+import statistics
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.bailian_client import bailian_client
+from app.utils.response import success, error
+from app.utils.streaming_asr import WebSocketTransport
+from app.utils.memoir_pipeline import split_into_chunks
+from app.utils.prompt_builder import make_messages, format_chat_line, estimate_tokens
+from app.utils.prompts import MEMOIR_SYSTEM_PROMPT, MEMOIR_FROM_CHAT_HEADER
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'hot_paths.json')
+
+SENTENCES = [
+    '我年轻的时候在纺织厂上班，那时候厂里有三千多人。',
+    '每天早上五点就要起床，骑四十分钟自行车去厂里。',
+    '后来厂里评我当了先进工作者，奖了一个搪瓷脸盆。',
+    '我和老伴就是在厂里的联欢会上认识的，他会拉二胡。',
+    '七六年的时候我们有了第一个孩子，那年冬天特别冷。',
+]
+
+
+def make_history(turns: int) -> list:
+    rng = random.Random(turns)
+    history = []
+    for i in range(turns):
+        history.append({'role': 'user', 'content': ''.join(rng.choice(SENTENCES) for _ in range(3))})
+        history.append({'role': 'ai', 'content': f'您说的第{i + 1}件事真让人感动，后来呢？'})
+    return history
+
+
+def make_sse_stream(chars: int) -> bytes:
+    """与百炼兼容接口格式一致的流式响应：每个事件 1~3 个字，最后是 finish_reason、usage 和 [DONE]"""
+    rng = random.Random(chars)
+    text = ''.join(rng.choice(SENTENCES) for _ in range(chars // 20 + 1))[:chars]
+    events = []
+    base = {'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': 1700000000,
+            'model': 'qwen-plus', 'system_fingerprint': None}
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 3)
+        events.append(dict(base, choices=[{'index': 0, 'delta': {'content': text[i:i + size]},
+                                           'finish_reason': None, 'logprobs': None}]))
+        i += size
+    events.append(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop', 'logprobs': None}]))
+    events.append(dict(base, choices=[], usage={'prompt_tokens': 1200, 'completion_tokens': chars,
+                                                 'total_tokens': 1200 + chars}))
+    body = ''.join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events) + 'data: [DONE]\n\n'
+    return body.encode('utf-8')
+
+
+def fake_response(body: bytes) -> requests.Response:
+    """以内存中的字节为响应体的 requests.Response，iter_lines / iter_content 按真实逻辑分块读取"""
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class _Sink:
+    def send(self, message):
+        pass
+
+
+def build_cases(app, args) -> list:
+    """返回 [(名称, 无参函数, 每次调用处理的字节数或 None)]"""
+    cases = []
+
+    stream = make_sse_stream(args.sse_chars)
+
+    def sse_parse():
+        for _ in bailian_client._parse_stream_response(fake_response(stream)):
+            pass
+    cases.append(('sse_parse', sse_parse, len(stream)))
+
+    frame = json.dumps({'type': 'audio_frame', 'audio': base64.b64encode(os.urandom(3200)).decode()})
+    transport = WebSocketTransport(pool=None)
+    transport._conn = _Sink()
+
+    def realtime_frame():
+        data = json.loads(frame)
+        if data.get('type') == 'audio_frame':
+            transport.send_audio(base64.b64decode(data.get('audio')))
+    cases.append(('realtime_frame', realtime_frame, len(frame)))
+
+    history = make_history(args.memoir_turns)
+    pipeline = bailian_client.memoir_pipeline
+    # 超过直接使用原文的预算时会调用大模型分段摘要，不属于 CPU 路径
+    if estimate_tokens('\n'.join(format_chat_line(msg) for msg in history)) > pipeline.direct_tokens:
+        raise SystemExit(f"--memoir-turns {args.memoir_turns} 超过了直接使用原文的 token 预算，请减小")
+
+    def memoir_source():
+        source, _ = pipeline.build_source_text(history)
+        make_messages(MEMOIR_SYSTEM_PROMPT, f"{MEMOIR_FROM_CHAT_HEADER}{source}", bailian_client.chat_model)
+    cases.append(('memoir_source', memoir_source, None))
+
+    long_lines = [format_chat_line(msg) for msg in make_history(args.memoir_turns * 10)]
+    chunk_tokens = pipeline.chunk_tokens
+
+    def memoir_chunks():
+        split_into_chunks(long_lines, chunk_tokens)
+    cases.append(('memoir_chunks', memoir_chunks, None))
+
+    messages = [{'role': m['role'], 'content': m['content'], 'timestamp': '2024-05-01T10:00:00'}
+                for m in make_history(25)]
+
+    def response_success():
+        app.make_response(success({'messages': messages, 'total': len(messages)}))
+    cases.append(('response_success', response_success, None))
+
+    def response_error():
+        app.make_response(error('会话不存在', code=404))
+    cases.append(('response_error', response_error, None))
+
+    from app.utils.database import mysql_db
+    try:
+        mysql_db.execute('SELECT 1')
+    except Exception as e:
+        print(f"[Bench] 跳过 mysql_execute: MySQL 不可用 ({e.__class__.__name__})", flush=True)
+    else:
+        def mysql_execute():
+            mysql_db.execute('SELECT id, nickname FROM user WHERE open_id = %s', ('bench-open-id',), fetchone=True)
+        cases.append(('mysql_execute', mysql_execute, None))
+
+    return cases
+
+
+def measure(func, min_time: float, repeat: int) -> list:
+    """返回每轮中单次调用的耗时 (微秒)，与 timeit 一样测量期间关闭垃圾回收"""
+    func()
+    gc.collect()
+    gc.disable()
+    try:
+        return _measure(func, min_time, repeat)
+    finally:
+        gc.enable()
+
+
+def _measure(func, min_time: float, repeat: int) -> list:
+    loops = 1
+    budget = min_time / repeat
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            break
+        loops = max(loops * 2, int(loops * budget / max(elapsed, 1e-9) * 1.2))
+    results = [elapsed / loops * 1e6]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        results.append((time.perf_counter() - start) / loops * 1e6)
+    return results
+
+
+def machine_info() -> dict:
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'processor': platform.processor() or platform.platform()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务端热点路径微基准测试')
+    parser.add_argument('--filter', default='', help='只运行名称包含该字符串的项')
+    parser.add_argument('--min-time', type=float, default=1.0, help='每项的最短测量时间(秒)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sse-chars', type=int, default=5000, help='流式响应的回忆录字数')
+    parser.add_argument('--memoir-turns', type=int, default=20, help='回忆录素材的对话轮数')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='最小耗时允许变慢的比例')
+    args = parser.parse_args()
+
+    app = create_app()
+    results = {}
+    with app.app_context(), app.test_request_context():
+        for name, func, size in build_cases(app, args):
+            if args.filter and args.filter not in name:
+                continue
+            samples = measure(func, args.min_time, args.repeat)
+            median = statistics.median(samples)
+            results[name] = {'median_us': round(median, 2), 'min_us': round(min(samples), 2)}
+            line = f"{name:<18} 中位数 {median:12.2f} µs  最小 {min(samples):12.2f} µs"
+            if size:
+                results[name]['mb_per_s'] = round(size / median, 2)
+                line += f"  {size / median:8.2f} MB/s"
+            print(line, flush=True)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"[Bench] 基线已保存: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"[Bench] 没有基线 ({args.baseline})，先用 --save 生成")
+        return
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('machine') != machine_info():
+        print(f"[Bench] 注意：基线来自不同的环境 {baseline.get('machine')}")
+    regressions = []
+    for name, current in results.items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        change = current['min_us'] / base['min_us'] - 1
+        print(f"[Bench] {name:<18} 基线最小 {base['min_us']:12.2f} µs  变化 {change:+.1%}")
+        if change > args.tolerance:
+            regressions.append(name)
+    if regressions:
+        print(f"[Bench] 性能退化 (超过 {args.tolerance:.0%}): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+提示词前缀缓存基准测试
+按追问接口的方式逐轮组装请求 (每轮对话历史增加一问一答)，发往本地模拟对话服务，对比首 token 延迟：
+    不缓存         模拟服务关闭前缀缓存，每轮所有 prompt token 都要重新计算
+    固定前缀在前   当前的组装方式：固定的 system 提示词在前，可变的对话历史放在最后的 user 消息中
+    可变内容在前   对照组：同样的内容，但把对话历史放在 system 提示词之前
+
+模拟服务的缓存规则与客户端无关：只按请求内容匹配此前出现过的最长前缀 (见 mock_chat_server.py)，
+不读取 cache_control 标记；命中的 token 数取自响应 usage 中的 cached_tokens。
+延迟的绝对值由模拟服务的耗时模型 (--prefill-ms-per-token) 决定，只用于比较不同的组装方式
+
+用法:
+    python benchmarks/bench_prompt_cache.py --rounds 20
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import requests
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import get_config
+from benchmarks.mock_chat_server import MockChatServer
+from app.utils.sse import iter_sse_data, parse_json
+from app.utils.prompt_builder import PromptBuilder, format_chat_line, message_text
+from app.utils.prompts import FOLLOWUP_SYSTEM_PROMPT, FOLLOWUP_HEADER, FOLLOWUP_FOOTER
+
+HISTORY = [
+    {'role': 'user', 'content': '我年轻的时候在工厂上班，那时候厂里有三千多人。'},
+    {'role': 'ai', 'content': '三千多人，真是个大厂！您在厂里负责什么工作呢？'},
+    {'role': 'user', 'content': '我是车工，每天站在车床前面，一干就是八个小时。'},
+]
+
+
+def build_requests(model: str, rounds: int) -> list:
+    """逐轮组装追问请求 (与 generate_followup_question 相同)"""
+    history = list(HISTORY)
+    batches = []
+    for i in range(rounds):
+        messages, _ = PromptBuilder(model).build(FOLLOWUP_SYSTEM_PROMPT, history, format_chat_line,
+                                                 header=FOLLOWUP_HEADER, footer=FOLLOWUP_FOOTER)
+        batches.append(messages)
+        history = history + [{'role': 'ai', 'content': f'后来呢？第{i + 1}件事您还记得哪些细节？'},
+                             {'role': 'user', 'content': f'第{i + 1}次说起这件事，我还记得很清楚。'}]
+    return batches
+
+
+def variable_first(messages: list) -> list:
+    """对照组：把 user 消息中的可变内容移到 system 提示词之前"""
+    system, user = message_text(messages[0]), message_text(messages[1])
+    return [{'role': 'system', 'content': f"{user}\n\n{system}"},
+            {'role': 'user', 'content': FOLLOWUP_FOOTER.strip()}]
+
+
+def send(url: str, model: str, messages: list):
+    """发送流式请求，返回 (首 token 延迟毫秒, prompt token 数, 命中缓存的 token 数)"""
+    payload = {'model': model, 'messages': messages, 'stream': True,
+               'stream_options': {'include_usage': True}}
+    start = time.perf_counter()
+    ttft, usage = None, {}
+    with requests.post(f"{url}/chat/completions", json=payload, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        for data in iter_sse_data(response):
+            if data == b'[DONE]':
+                break
+            event = parse_json(data) or {}
+            if ttft is None and event.get('choices') and event['choices'][0].get('delta', {}).get('content'):
+                ttft = (time.perf_counter() - start) * 1000
+            if event.get('usage'):
+                usage = event['usage']
+    cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    return ttft, usage.get('prompt_tokens', 0), cached
+
+
+def run(name: str, mock: MockChatServer, model: str, batches: list):
+    mock.reset_cache()
+    results = [send(mock.url, model, messages) for messages in batches]
+    ttfts = [ttft for ttft, _, _ in results]
+    prompt = sum(tokens for _, tokens, _ in results)
+    cached = sum(hit for _, _, hit in results)
+    print(f"{name:<8} 首token延迟: 平均 {statistics.mean(ttfts):7.1f} ms  中位数 {statistics.median(ttfts):7.1f} ms  "
+          f"缓存命中 {cached}/{prompt} token ({cached / prompt:.1%})", flush=True)
+    return ttfts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提示词前缀缓存基准测试')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--model', default='qwen-turbo')
+    parser.add_argument('--prefill-ms-per-token', type=float, default=0.5)
+    args = parser.parse_args()
+
+    # 只需要配置 (prompt_cache_mode 等)，不初始化数据库连接
+    app = Flask(__name__)
+    app.config.from_object(get_config())
+    with app.app_context():
+        stable = build_requests(args.model, args.rounds)
+    marked = sum(isinstance(messages[0]['content'], list) for messages in stable)
+    print(f"[Bench] {args.rounds} 轮，带显式缓存标记的请求 {marked}/{len(stable)} "
+          f"(模拟服务不读取该标记)", flush=True)
+
+    cold_mock = MockChatServer(prefill_ms_per_token=args.prefill_ms_per_token, token_interval_ms=1).start()
+    mock = MockChatServer(prefill_ms_per_token=args.prefill_ms_per_token, token_interval_ms=1,
+                          prefix_cache=True).start()
+    try:
+        cold = run('不缓存', cold_mock, args.model, stable)
+        cached = run('固定前缀在前', mock, args.model, stable)
+        run('可变内容在前', mock, args.model, [variable_first(messages) for messages in stable])
+    finally:
+        cold_mock.stop()
+        mock.stop()
+
+    saved = statistics.mean(cold) - statistics.mean(cached)
+    print(f"[Bench] 固定前缀在前比不缓存的平均首token延迟低 {saved:.1f} ms "
+          f"({saved / statistics.mean(cold):.1%}，取决于模拟服务的耗时模型)", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+流式响应解析吞吐基准测试
+对比三种方式解析同一段长回忆录的流式响应 (与百炼兼容接口格式一致)：
+    iter_lines   旧的做法：iter_lines 默认 512 字节分块，逐行解码为 str，标准库 json 解码每个事件
+    sse+json     app.utils.sse 按字节增量解析，64KB 分块，标准库 json 解码
+    sse+orjson   同上，orjson 解码 (未安装 orjson 时跳过)
+输出每 MB 的解析耗时和 MB/s，并校验三种方式得到的文本、usage 和 finish_reason 一致
+
+用法:
+    python benchmarks/bench_sse_parse.py --chars 5000 --rounds 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import sse
+from benchmarks.bench_hot_paths import make_sse_stream, fake_response
+
+
+def parse_iter_lines(response):
+    """旧的 _parse_stream_response 的解析部分"""
+    text, usage, finish_reason = [], None, None
+    for line in response.iter_lines():
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith('data: '):
+                data = line[6:]
+                if data == '[DONE]':
+                    break
+                try:
+                    json_data = json.loads(data)
+                    if json_data.get('usage'):
+                        usage = json_data['usage']
+                    choices = json_data.get('choices') or [{}]
+                    finish_reason = choices[0].get('finish_reason') or finish_reason
+                    content = choices[0].get('delta', {}).get('content', '')
+                    if content:
+                        text.append(content)
+                except json.JSONDecodeError:
+                    continue
+    return ''.join(text), usage, finish_reason
+
+
+def parse_sse(response):
+    """与新的 _parse_stream_response 相同的解析部分"""
+    text, usage, finish_reason = [], None, None
+    for data in sse.iter_sse_data(response):
+        if data == b'[DONE]':
+            break
+        event = sse.parse_json(data)
+        if not event:
+            continue
+        if event.get('usage'):
+            usage = event['usage']
+        choices = event.get('choices')
+        if not choices:
+            continue
+        choice = choices[0]
+        if choice.get('finish_reason'):
+            finish_reason = choice['finish_reason']
+        delta = choice.get('delta')
+        content = delta.get('content') if delta else None
+        if content:
+            text.append(content)
+    return ''.join(text), usage, finish_reason
+
+
+def measure(parse, body: bytes, rounds: int) -> list:
+    """每轮解析耗时 (秒)"""
+    parse(fake_response(body))
+    results = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        parse(fake_response(body))
+        results.append(time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式响应解析吞吐基准测试')
+    parser.add_argument('--chars', type=int, default=5000, help='回忆录字数')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    body = make_sse_stream(args.chars)
+    mb = len(body) / 1024 / 1024
+    print(f"[Bench] 流式响应 {len(body) / 1024:.0f} KB，{body.count(b'data:')} 个事件", flush=True)
+
+    variants = [('iter_lines', parse_iter_lines, None), ('sse+json', parse_sse, sse.json_loads)]
+    if sse.orjson is not None:
+        variants.append(('sse+orjson', parse_sse, sse.orjson.loads))
+    else:
+        print('[Bench] 未安装 orjson，跳过 sse+orjson')
+
+    original_loads = sse.loads
+    expected = None
+    baseline = None
+    try:
+        for name, parse, loads in variants:
+            if loads is not None:
+                sse.loads = loads
+            result = parse(fake_response(body))
+            if expected is None:
+                expected = result
+            elif result != expected:
+                raise SystemExit(f"[Bench] {name} 的解析结果与 iter_lines 不一致")
+            median = statistics.median(measure(parse, body, args.rounds))
+            baseline = baseline or median
+            print(f"{name:<12} 每 MB {median / mb * 1000:8.2f} ms  {mb / median:8.2f} MB/s  "
+                  f"相对旧的做法 {baseline / median:5.2f}x", flush=True)
+    finally:
+        sse.loads = original_loads
+
+
+if __name__ == '__main__':
+    main()
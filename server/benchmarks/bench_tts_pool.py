@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+语音合成器复用基准测试
+对比 每次新建 SpeechSynthesizer (每次都要握手) 与 从 SynthesizerPool 领取已连接的合成器 两种方式
+单次合成的准备耗时 (建连 + 开始任务) 和总耗时；使用本地模拟合成服务，不访问真实的百炼平台
+
+用法:
+    python benchmarks/bench_tts_pool.py --rounds 20 --handshake-ms 80
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dashscope.audio.tts_v2 import SpeechSynthesizer
+from benchmarks.mock_tts_server import MockTTSServer
+from app.utils.tts_pool import SynthesizerPool, auth_headers, ensure_sdk_api_key
+
+MODEL = 'cosyvoice-v2'
+VOICE = 'longanyang'
+TEXT = '您刚才说在纺织厂上班，那时候一天要工作多久？'
+
+
+def measure_cold(url: str, rounds: int) -> list:
+    """每次新建合成器 (旧的做法)"""
+    results = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        synthesizer = SpeechSynthesizer(model=MODEL, voice=VOICE, url=url, headers=auth_headers('mock-key'))
+        audio = synthesizer.call(TEXT, timeout_millis=10000)
+        results.append((time.perf_counter() - start) * 1000)
+        assert audio
+    return results
+
+
+def measure_pooled(pool: SynthesizerPool, rounds: int) -> list:
+    results = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        with pool.synthesizer(MODEL, VOICE) as synthesizer:
+            audio = synthesizer.call(TEXT, timeout_millis=10000)
+        results.append((time.perf_counter() - start) * 1000)
+        assert audio
+    return results
+
+
+def report(name: str, samples: list):
+    print(f"{name:<8} 单次合成: 平均 {statistics.mean(samples):7.1f} ms  "
+          f"中位数 {statistics.median(samples):7.1f} ms  首次 {samples[0]:7.1f} ms", flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='语音合成器复用基准测试')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--handshake-ms', type=float, default=80)
+    parser.add_argument('--first-chunk-ms', type=float, default=60)
+    args = parser.parse_args()
+
+    ensure_sdk_api_key('mock-key')
+    mock = MockTTSServer(handshake_ms=args.handshake_ms, first_chunk_ms=args.first_chunk_ms).start()
+    try:
+        cold = measure_cold(mock.url, args.rounds)
+        cold_connections = mock.connections
+        pool = SynthesizerPool('mock-key', size=2, url=mock.url)
+        pooled = measure_pooled(pool, args.rounds)
+        pool.shutdown()
+        report('新建', cold)
+        report('复用', pooled)
+        print(f"连接数: 新建 {cold_connections}，复用 {mock.connections - cold_connections}")
+        print(f"合成器池: {pool.snapshot()}")
+    finally:
+        mock.stop()
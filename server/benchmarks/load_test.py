@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+端到端压力测试
+模拟 N 位老人同时使用：一部分进行实时语音对话 (WebSocket 推流 → 识别 → 追问 → 合成)，
+其余走 HTTP 文字对话 + 生成回忆录。百炼平台的对话 / 实时识别 / 语音合成全部由本地模拟服务代替，
+被测服务与线上一样以 gevent WSGIServer 单进程运行 (子进程)，MySQL 和 MongoDB 使用 config.ini 中的实例
+
+统计：
+    realtime_connect  建立实时对话到收到 session_started
+    turn_text         用户说完 (最后一个有声帧发出) 到收到 ai_response
+    turn_audio        用户说完到收到 ai_audio_complete
+    chat_message / chat_history / article_generate  HTTP 接口耗时
+各项的 p50 / p95 / p99、吞吐 (话轮/秒、请求/秒)、错误数，以及被测进程的 CPU 和内存 (读取 /proc)
+
+结果可用 --output 保存为 JSON，下次用 --baseline 对比：任一项 p95 比基线慢超过 --tolerance 时退出码为 1
+
+注意：登录接口目前在本地由 code 生成 openid，不调用微信接口，因此不需要模拟微信服务；
+压测用户以 load-<运行ID>-<序号> 为 code 登录，会在数据库中创建用户、会话和聊天记录，请使用测试库
+
+用法:
+    python benchmarks/load_test.py --users 20 --duration 60
+    python benchmarks/load_test.py --users 50 --realtime-ratio 1 --output logs/load.json --baseline logs/load_base.json
+    python benchmarks/load_test.py --target http://127.0.0.1:5050 ...   压测已启动的服务 (需自行指向模拟服务)
+"""
+import os
+import sys
+import json
+import math
+import time
+import queue
+import random
+import base64
+import argparse
+import threading
+import subprocess
+from collections import defaultdict
+
+import requests
+import websocket
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_chat_server import MockChatServer
+from benchmarks.mock_asr_server import MockASRServer, speech_pcm, silence_pcm
+
+FRAME_MS = 100
+SAMPLE_RATE = 16000
+
+
+def percentile(samples: list, p: float) -> float:
+    """最近秩法求百分位"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered), max(1, math.ceil(p / 100 * len(ordered)))) - 1
+    return ordered[index]
+
+
+class Recorder:
+    """线程安全地收集各项耗时 (毫秒) 和错误"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, ms: float):
+        with self._lock:
+            self.samples[name].append(ms)
+
+    def error(self, name: str):
+        with self._lock:
+            self.errors[name] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        with self._lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+            errors = dict(self.errors)
+        result = {}
+        for name in sorted(set(samples) | set(errors)):
+            values = samples.get(name, [])
+            result[name] = {
+                'count': len(values),
+                'errors': errors.get(name, 0),
+                'throughput': round(len(values) / elapsed, 3) if elapsed else 0,
+                'p50': round(percentile(values, 50), 1),
+                'p95': round(percentile(values, 95), 1),
+                'p99': round(percentile(values, 99), 1),
+                'max': round(max(values), 1) if values else 0,
+            }
+        return result
+
+
+class ProcessSampler:
+    """每秒读取 /proc/<pid> 统计被测进程的 CPU 和常驻内存"""
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss_mb = []
+        self._stop = threading.Event()
+        self._ticks = os.sysconf('SC_CLK_TCK')
+
+    def _cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime / stime 为第 14 / 15 个字段 (去掉 pid 和 comm 后从 0 计为 11 / 12)
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def _rss_mb(self) -> float:
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def _loop(self):
+        last_cpu, last_at = self._cpu_seconds(), time.perf_counter()
+        while not self._stop.wait(self.interval):
+            try:
+                cpu, now = self._cpu_seconds(), time.perf_counter()
+                self.cpu.append((cpu - last_cpu) / (now - last_at) * 100)
+                self.rss_mb.append(self._rss_mb())
+                last_cpu, last_at = cpu, now
+            except (OSError, IndexError, ValueError):
+                return
+
+    def start(self):
+        if os.path.exists(f'/proc/{self.pid}/stat'):
+            threading.Thread(target=self._loop, daemon=True).start()
+        return self
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if not self.cpu:
+            return {}
+        return {
+            'cpu_percent_avg': round(sum(self.cpu) / len(self.cpu), 1),
+            'cpu_percent_max': round(max(self.cpu), 1),
+            'rss_mb_max': round(max(self.rss_mb), 1),
+            'rss_mb_end': round(self.rss_mb[-1], 1),
+        }
+
+
+class VirtualUser:
+    """一位模拟用户：登录后反复开启会话，按比例选择实时语音或文字对话"""
+
+    def __init__(self, index: int, run_id: str, args, recorder: Recorder):
+        self.index = index
+        self.code = f"load-{run_id}-{index}"
+        self.args = args
+        self.recorder = recorder
+        self.base_url = args.target.rstrip('/')
+        self.ws_url = 'ws' + self.base_url[4:]
+        self.http = requests.Session()
+        self.open_id = None
+        self.random = random.Random(index)
+
+    def _post(self, name: str, path: str, payload: dict):
+        """调用接口并记录耗时，失败时返回 None"""
+        start = time.perf_counter()
+        try:
+            response = self.http.post(self.base_url + path, json=payload, timeout=self.args.timeout)
+            body = response.json()
+        except (requests.RequestException, ValueError):
+            self.recorder.error(name)
+            return None
+        if response.status_code != 200 or body.get('code') != 0:
+            self.recorder.error(name)
+            return None
+        self.recorder.add(name, (time.perf_counter() - start) * 1000)
+        return body.get('data') or {}
+
+    def _think(self):
+        time.sleep(self.random.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+
+    def run(self, deadline: float):
+        data = self._post('login', '/api/auth/login', {'code': self.code})
+        if data is None:
+            return
+        self.open_id = data['openId']
+        while time.time() < deadline:
+            data = self._post('session_create', '/api/session/create', {'open_id': self.open_id})
+            if data is None:
+                time.sleep(1)
+                continue
+            session_id = data['session_id']
+            if self.random.random() < self.args.realtime_ratio:
+                self.realtime_session(session_id, deadline)
+            else:
+                self.chat_session(session_id, deadline)
+            self._post('session_end', f'/api/session/{session_id}/end', {})
+
+    def chat_session(self, session_id: int, deadline: float):
+        """文字对话若干轮，然后生成回忆录"""
+        for turn in range(self.args.turns):
+            if time.time() >= deadline:
+                return
+            self._post('chat_message', '/api/chat/message', {
+                'session_id': session_id, 'open_id': self.open_id,
+                'message': f'我年轻的时候在纺织厂上班，第{turn + 1}件事我记得特别清楚。'
+            })
+            self._think()
+        start = time.perf_counter()
+        try:
+            response = self.http.get(f"{self.base_url}/api/chat/history/{session_id}", timeout=self.args.timeout)
+            response.raise_for_status()
+            self.recorder.add('chat_history', (time.perf_counter() - start) * 1000)
+        except requests.RequestException:
+            self.recorder.error('chat_history')
+        self._post('article_generate', '/api/article/generate', {'session_id': session_id})
+
+    def realtime_session(self, session_id: int, deadline: float):
+        """实时语音对话：按真实时间推送音频帧，每轮说 speech_ms 毫秒后保持静音直到收到合成语音"""
+        start = time.perf_counter()
+        try:
+            ws = websocket.create_connection(f"{self.ws_url}/ws/realtime/{session_id}/{self.open_id}",
+                                             timeout=self.args.timeout)
+        except Exception:
+            self.recorder.error('realtime_connect')
+            return
+        inbox = queue.Queue()
+
+        def receive():
+            while True:
+                try:
+                    message = ws.recv()
+                except Exception:
+                    inbox.put(None)
+                    return
+                if not message:
+                    inbox.put(None)
+                    return
+                try:
+                    inbox.put(json.loads(message))
+                except ValueError:
+                    pass
+
+        threading.Thread(target=receive, daemon=True).start()
+        try:
+            if not self._wait_for(inbox, 'session_started', time.perf_counter() + self.args.timeout):
+                self.recorder.error('realtime_connect')
+                return
+            self.recorder.add('realtime_connect', (time.perf_counter() - start) * 1000)
+
+            frame_bytes = SAMPLE_RATE * FRAME_MS // 1000 * 2
+            speech = speech_pcm(self.args.speech_ms, SAMPLE_RATE)
+            silence = base64.b64encode(silence_pcm(FRAME_MS, SAMPLE_RATE)).decode()
+            for _ in range(self.args.turns):
+                if time.time() >= deadline:
+                    break
+                for offset in range(0, len(speech), frame_bytes):
+                    frame = base64.b64encode(speech[offset:offset + frame_bytes]).decode()
+                    ws.send(json.dumps({'type': 'audio_frame', 'audio': frame}))
+                    time.sleep(FRAME_MS / 1000)
+                ended = time.perf_counter()
+                # 说完后继续推静音帧 (小程序录音不会停)，直到这一轮的语音合成完毕
+                got_text = done = False
+                turn_deadline = ended + self.args.timeout
+                while not done and time.perf_counter() < turn_deadline:
+                    ws.send(json.dumps({'type': 'audio_frame', 'audio': silence}))
+                    messages = self._drain(inbox, FRAME_MS / 1000)
+                    if messages is False:
+                        raise ConnectionError('连接已关闭')
+                    for item in messages:
+                        if item.get('type') == 'ai_response' and not got_text:
+                            got_text = True
+                            self.recorder.add('turn_text', (time.perf_counter() - ended) * 1000)
+                        elif item.get('type') == 'ai_audio_complete':
+                            self.recorder.add('turn_audio', (time.perf_counter() - ended) * 1000)
+                            done = True
+                        elif item.get('type') == 'error':
+                            self.recorder.error('turn_audio')
+                            done = True
+                if not done:
+                    self.recorder.error('turn_audio')
+                self._think()
+            ws.send(json.dumps({'type': 'stop_session'}))
+        except Exception:
+            self.recorder.error('realtime_session')
+        finally:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _drain(inbox: queue.Queue, wait: float):
+        """等待最多 wait 秒，取出已收到的消息；连接关闭时返回 False"""
+        items = []
+        try:
+            items.append(inbox.get(timeout=wait))
+            while True:
+                items.append(inbox.get_nowait())
+        except queue.Empty:
+            pass
+        if None in items:
+            return False
+        return items
+
+    @staticmethod
+    def _wait_for(inbox: queue.Queue, message_type: str, deadline: float) -> bool:
+        while time.perf_counter() < deadline:
+            try:
+                item = inbox.get(timeout=max(0.01, deadline - time.perf_counter()))
+            except queue.Empty:
+                return False
+            if item is None or item.get('type') == 'error':
+                return False
+            if item.get('type') == message_type:
+                return True
+        return False
+
+
+def serve(args):
+    """被测服务：与 run.py 相同的 gevent 服务器，百炼平台的地址指向模拟服务"""
+    from gevent.pywsgi import WSGIServer
+    from geventwebsocket.handler import WebSocketHandler
+    from run import app, WSGIHandler
+
+    app.config.update(
+        ALIYUN_API_KEY='mock-key',
+        ALIYUN_API_URL=args.chat_url,
+        ASR_REALTIME_URL=args.asr_url,
+        ASR_REALTIME_TRANSPORT='websocket',
+        TTS_WS_URL=args.tts_url,
+    )
+    if app.config.get('ASR_POOL_SIZE', 0) > 0:
+        from app.utils.asr_pool import get_asr_pool
+        get_asr_pool(app.config)
+    server = WSGIServer(('127.0.0.1', args.port), WSGIHandler(app), handler_class=WebSocketHandler, log=None)
+    server.serve_forever()
+
+
+def start_server(args, chat_url: str, asr_url: str, tts_url: str) -> subprocess.Popen:
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port),
+               '--chat-url', chat_url, '--asr-url', asr_url, '--tts-url', tts_url]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'被测服务启动失败，退出码 {process.returncode}')
+        try:
+            requests.get(f"{args.target}/health", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('被测服务 30 秒内未就绪')
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """对比基线，返回 p95 变慢超过 tolerance 的项"""
+    regressions = []
+    for name, current in result['metrics'].items():
+        base = baseline.get('metrics', {}).get(name)
+        if not base or not base.get('p95') or not current['count']:
+            continue
+        change = current['p95'] / base['p95'] - 1
+        if change > tolerance:
+            regressions.append(f"{name}: p95 {base['p95']} → {current['p95']} ms (+{change:.0%})")
+    return regressions
+
+
+def report(result: dict):
+    print(f"\n[Load] {result['users']} 位用户，{result['elapsed']:.0f} 秒，实时语音占比 {result['realtime_ratio']:.0%}")
+    print(f"{'项目':<18}{'次数':>7}{'错误':>6}{'每秒':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, m in result['metrics'].items():
+        print(f"{name:<20}{m['count']:>7}{m['errors']:>6}{m['throughput']:>8}"
+              f"{m['p50']:>9}{m['p95']:>9}{m['p99']:>9}{m['max']:>9}")
+    if result.get('server'):
+        s = result['server']
+        print(f"[Load] 被测进程 CPU 平均 {s['cpu_percent_avg']}% 峰值 {s['cpu_percent_max']}%，"
+              f"内存峰值 {s['rss_mb_max']} MB")
+    print(f"[Load] 模拟服务请求: {result['upstream']}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端压力测试')
+    parser.add_argument('--users', type=int, default=10, help='并发用户数')
+    parser.add_argument('--duration', type=float, default=60, help='压测时长(秒)')
+    parser.add_argument('--ramp-up', type=float, default=5, help='在多少秒内逐个启动用户')
+    parser.add_argument('--realtime-ratio', type=float, default=0.7, help='选择实时语音对话的会话比例')
+    parser.add_argument('--turns', type=int, default=3, help='每个会话的对话轮数')
+    parser.add_argument('--speech-ms', type=int, default=2500, help='实时对话每轮说话时长')
+    parser.add_argument('--think-ms', type=float, default=2000, help='两轮之间的平均停顿')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--target', default='', help='已启动的被测服务地址，为空时启动子进程')
+    parser.add_argument('--port', type=int, default=5099, help='子进程被测服务的端口')
+    parser.add_argument('--chat-latency-ms', type=float, default=300, help='模拟对话服务的首 token 延迟')
+    parser.add_argument('--token-interval-ms', type=float, default=20)
+    parser.add_argument('--tts-first-chunk-ms', type=float, default=150)
+    parser.add_argument('--output', default='', help='结果写入 JSON 文件')
+    parser.add_argument('--baseline', default='', help='与之前的结果对比')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='p95 允许变慢的比例')
+    # 子进程被测服务使用
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--chat-url', help=argparse.SUPPRESS)
+    parser.add_argument('--asr-url', help=argparse.SUPPRESS)
+    parser.add_argument('--tts-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    from benchmarks.mock_tts_server import MockTTSServer
+    chat = MockChatServer(base_latency_ms=args.chat_latency_ms, token_interval_ms=args.token_interval_ms).start()
+    asr = MockASRServer().start()
+    tts = MockTTSServer(first_chunk_ms=args.tts_first_chunk_ms).start()
+
+    process = None
+    sampler = None
+    if not args.target:
+        args.target = f"http://127.0.0.1:{args.port}"
+        process = start_server(args, chat.url, asr.url, tts.url)
+        sampler = ProcessSampler(process.pid).start()
+    else:
+        print(f"[Load] 请确认被测服务已指向模拟服务: api_url={chat.url} asr_realtime_url={asr.url} "
+              f"tts_ws_url={tts.url}", flush=True)
+
+    recorder = Recorder()
+    run_id = time.strftime('%m%d%H%M%S')
+    started = time.time()
+    deadline = started + args.duration
+    threads = []
+    try:
+        for i in range(args.users):
+            user = VirtualUser(i, run_id, args, recorder)
+            thread = threading.Thread(target=user.run, args=(deadline,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if args.ramp_up and i < args.users - 1:
+                time.sleep(args.ramp_up / args.users)
+        for thread in threads:
+            thread.join(timeout=max(0, deadline - time.time()) + args.timeout * 2)
+        elapsed = time.time() - started
+
+        result = {
+            'run_id': run_id,
+            'users': args.users,
+            'elapsed': round(elapsed, 1),
+            'realtime_ratio': args.realtime_ratio,
+            'metrics': recorder.summary(elapsed),
+            'server': sampler.stop() if sampler else {},
+            'upstream': {'chat': chat.request_count, 'asr_connections': asr.connections,
+                         'tts_tasks': tts.tasks},
+        }
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        for mock in (chat, asr, tts):
+            mock.stop()
+
+    report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[Load] 性能退化 {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+本地模拟的实时语音识别服务 (百炼 paraformer-realtime WebSocket 协议)
+用于测试和基准测试，不访问真实的百炼平台
+
+模拟的识别行为：
+    按帧能量区分说话和静音；说话期间每 partial_interval_ms 返回一次中间结果，
+    文本按 ms_per_char 的语速从脚本句子中逐字展开；
+    说话后静音超过 end_silence_ms 返回 sentence_end=true 的最终结果，并切换到下一句
+    drop_after_frames 可让服务端在收到指定帧数后断开一次连接，用于验证重连与重放
+
+用法:
+    python benchmarks/mock_asr_server.py --port 8091
+    然后在 config.ini 中设置 asr_realtime_url = ws://127.0.0.1:8091/asr
+"""
+import json
+import math
+import time
+import base64
+import struct
+import hashlib
+import argparse
+import threading
+import socketserver
+from array import array
+
+DEFAULT_SCRIPT = [
+    '我年轻的时候在纺织厂上班',
+    '那时候每天早上五点就要起床',
+    '后来厂里评我当了先进工作者',
+]
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def speech_pcm(ms: int, sample_rate: int = 16000, freq: float = 220.0) -> bytes:
+    """生成一段模拟说话的 16bit PCM (正弦波)"""
+    count = int(sample_rate * ms / 1000)
+    samples = array('h', (int(8000 * math.sin(2 * math.pi * freq * i / sample_rate)) for i in range(count)))
+    return samples.tobytes()
+
+
+def silence_pcm(ms: int, sample_rate: int = 16000) -> bytes:
+    """生成一段静音 PCM"""
+    return bytes(int(sample_rate * ms / 1000) * 2)
+
+
+def frame_rms(pcm: bytes) -> float:
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class _WebSocket:
+    """最小的 RFC 6455 服务端实现 (不支持分片帧)"""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._send_lock = threading.Lock()
+
+    def handshake(self) -> bool:
+        request_line = self.rfile.readline()
+        if not request_line:
+            return False
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not key:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        self.wfile.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+        self.wfile.flush()
+        return True
+
+    def receive(self):
+        """读取一条消息，连接关闭时返回 None"""
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                return None
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if head[1] & 0x80 else b'\x00' * 4
+            data = bytearray(self.rfile.read(length))
+            for i in range(len(data)):
+                data[i] ^= mask[i % 4]
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._send_frame(0xA, bytes(data))
+                continue
+            if opcode in (0x1, 0x2):
+                return bytes(data).decode('utf-8')
+
+    def _send_frame(self, opcode: int, data: bytes):
+        length = len(data)
+        if length < 126:
+            head = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            head = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.wfile.write(head + data)
+            self.wfile.flush()
+
+    def send(self, message: str):
+        self._send_frame(0x1, message.encode('utf-8'))
+
+    def send_bytes(self, data: bytes):
+        self._send_frame(0x2, data)
+
+    def close(self):
+        try:
+            self._send_frame(0x8, b'')
+        except OSError:
+            pass
+
+
+class _Recognizer:
+    """一个连接上的模拟识别状态"""
+
+    def __init__(self, server: 'MockASRServer'):
+        self.server = server
+        self.sample_rate = 16000
+        self.speech_ms = 0.0
+        self.silence_ms = 0.0
+        self.since_partial_ms = 0.0
+        self.offset_ms = 0.0
+        self.begin_ms = None
+
+    def _sentence(self) -> str:
+        script = self.server.script
+        return script[self.server.next_sentence % len(script)]
+
+    def _result(self, final: bool) -> dict:
+        sentence = self._sentence()
+        chars = len(sentence) if final else max(1, min(len(sentence), int(self.speech_ms / self.server.ms_per_char)))
+        return {
+            'header': {'event': 'result-generated'},
+            'payload': {'sentence': {
+                'text': sentence[:chars],
+                'begin_time': int(self.begin_ms or 0),
+                'end_time': int(self.offset_ms) if final else None,
+                'sentence_end': final
+            }}
+        }
+
+    def feed(self, pcm: bytes):
+        """处理一帧音频，返回需要发送的结果列表"""
+        duration = len(pcm) / 2 / self.sample_rate * 1000
+        self.offset_ms += duration
+        results = []
+        if frame_rms(pcm) >= self.server.energy_threshold:
+            if self.begin_ms is None:
+                self.begin_ms = self.offset_ms - duration
+            self.speech_ms += duration
+            self.silence_ms = 0
+            self.since_partial_ms += duration
+            if self.since_partial_ms >= self.server.partial_interval_ms:
+                self.since_partial_ms = 0
+                results.append(self._result(False))
+        elif self.speech_ms:
+            self.silence_ms += duration
+            if self.silence_ms >= self.server.end_silence_ms:
+                results.append(self._result(True))
+                with self.server.lock:
+                    self.server.next_sentence += 1
+                self.speech_ms = self.silence_ms = self.since_partial_ms = 0
+                self.begin_ms = None
+        return results
+
+
+class MockASRServer:
+    """模拟实时语音识别服务"""
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 script=None,
+                 partial_interval_ms: float = 200,
+                 end_silence_ms: float = 400,
+                 ms_per_char: float = 150,
+                 result_latency_ms: float = 30,
+                 energy_threshold: float = 500,
+                 drop_after_frames: int = 0):
+        self.script = script or DEFAULT_SCRIPT
+        self.partial_interval_ms = partial_interval_ms
+        self.end_silence_ms = end_silence_ms
+        self.ms_per_char = ms_per_char
+        self.result_latency_ms = result_latency_ms
+        self.energy_threshold = energy_threshold
+        self.drop_after_frames = drop_after_frames
+        self.lock = threading.Lock()
+        self.next_sentence = 0
+        self.connections = 0
+        self.frames = 0
+        self._dropped = False
+        self._server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}/asr"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _should_drop(self) -> bool:
+        with self.lock:
+            self.frames += 1
+            if self.drop_after_frames and not self._dropped and self.frames >= self.drop_after_frames:
+                self._dropped = True
+                return True
+        return False
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                ws = _WebSocket(self.rfile, self.wfile)
+                if not ws.handshake():
+                    return
+                with server.lock:
+                    server.connections += 1
+                recognizer = _Recognizer(server)
+                while True:
+                    message = ws.receive()
+                    if message is None:
+                        return
+                    data = json.loads(message)
+                    action = (data.get('header') or {}).get('action')
+                    if action == 'start':
+                        recognizer.sample_rate = (data.get('payload') or {}).get('sample_rate', 16000)
+                        ws.send(json.dumps({'header': {'event': 'task-started'}}))
+                    elif action == 'send_audio':
+                        if server._should_drop():
+                            ws.close()
+                            return
+                        pcm = base64.b64decode((data.get('payload') or {}).get('audio', ''))
+                        results = recognizer.feed(pcm)
+                        if results and server.result_latency_ms:
+                            time.sleep(server.result_latency_ms / 1000)
+                        for result in results:
+                            ws.send(json.dumps(result, ensure_ascii=False))
+                    elif action == 'finish':
+                        ws.close()
+                        return
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟实时语音识别服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--partial-interval-ms', type=float, default=200)
+    parser.add_argument('--end-silence-ms', type=float, default=400)
+    parser.add_argument('--result-latency-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    mock = MockASRServer(args.host, args.port,
+                         partial_interval_ms=args.partial_interval_ms,
+                         end_silence_ms=args.end_silence_ms,
+                         result_latency_ms=args.result_latency_ms).start()
+    print(f"模拟语音识别服务: {mock.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+本地模拟的 OpenAI 兼容对话服务 (/chat/completions)
+用于基准测试，不访问真实的百炼平台
+
+模拟的耗时模型：
+    首 token 延迟 = base_latency_ms + prefill_ms_per_token * 未命中缓存的 prompt token 数
+    之后每个输出块间隔 token_interval_ms
+上下文缓存 (prefix_cache 开启时)：
+    与服务端的前缀缓存一样只看请求内容：按顺序拼接各消息的角色和文本，以 cache_block_chars 个字符为一块，
+    命中此前请求中出现过的最长整块前缀；不读取 cache_control 标记，也不使用客户端的任何判断逻辑
+
+用法:
+    python benchmarks/mock_chat_server.py --port 8090
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.prompt_builder import estimate_tokens, estimate_messages_tokens, message_text
+
+
+class MockChatServer:
+    """模拟对话服务"""
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 base_latency_ms: float = 80,
+                 prefill_ms_per_token: float = 0.5,
+                 token_interval_ms: float = 5,
+                 reply: str = '您当年在工厂里做的是什么工作呀？',
+                 prefix_cache: bool = False,
+                 cache_block_chars: int = 64):
+        self.base_latency_ms = base_latency_ms
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.token_interval_ms = token_interval_ms
+        self.reply = reply
+        self.prefix_cache = prefix_cache
+        self.cache_block_chars = cache_block_chars
+        self.request_count = 0
+        self._cache = set()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _cached_tokens(self, messages: list) -> int:
+        """计算命中缓存的 prompt token 数：此前出现过的最长整块前缀"""
+        if not self.prefix_cache:
+            return 0
+        prompt = ''.join(f"{msg.get('role')}\n{message_text(msg)}\n" for msg in messages)
+        block = self.cache_block_chars
+        keys = [hashlib.sha1(prompt[:end].encode('utf-8')).hexdigest()
+                for end in range(block, len(prompt) + 1, block)]
+        hit = 0
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key not in self._cache:
+                    break
+                hit = (i + 1) * block
+            self._cache.update(keys)
+        return estimate_tokens(prompt[:hit])
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    server.request_count += 1
+
+                messages = payload.get('messages', [])
+                prompt_tokens = estimate_messages_tokens(messages)
+                cached_tokens = server._cached_tokens(messages)
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': estimate_tokens(server.reply),
+                    'total_tokens': prompt_tokens + estimate_tokens(server.reply),
+                    'prompt_tokens_details': {'cached_tokens': cached_tokens}
+                }
+                ttft = server.base_latency_ms + server.prefill_ms_per_token * (prompt_tokens - cached_tokens)
+                time.sleep(ttft / 1000)
+
+                if payload.get('stream'):
+                    self._send_stream(payload, usage)
+                else:
+                    time.sleep(server.token_interval_ms * len(server.reply) / 1000)
+                    body = json.dumps({
+                        'id': 'mock',
+                        'object': 'chat.completion',
+                        'model': payload.get('model'),
+                        'choices': [{
+                            'index': 0,
+                            'message': {'role': 'assistant', 'content': server.reply},
+                            'finish_reason': 'stop'
+                        }],
+                        'usage': usage
+                    }).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _send_stream(self, payload, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def write_event(data: dict):
+                    chunk = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+
+                for i, char in enumerate(server.reply):
+                    if i:
+                        time.sleep(server.token_interval_ms / 1000)
+                    write_event({'choices': [{'index': 0, 'delta': {'content': char}, 'finish_reason': None}]})
+                write_event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+                if (payload.get('stream_options') or {}).get('include_usage'):
+                    write_event({'choices': [], 'usage': usage})
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟 OpenAI 兼容对话服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--base-latency-ms', type=float, default=80)
+    parser.add_argument('--prefill-ms-per-token', type=float, default=0.5)
+    parser.add_argument('--token-interval-ms', type=float, default=5)
+    parser.add_argument('--prefix-cache', action='store_true')
+    args = parser.parse_args()
+
+    mock = MockChatServer(args.host, args.port, args.base_latency_ms,
+                          args.prefill_ms_per_token, args.token_interval_ms,
+                          prefix_cache=args.prefix_cache)
+    print(f"[Mock] 对话服务已启动: {mock.url}", flush=True)
+    try:
+        mock._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
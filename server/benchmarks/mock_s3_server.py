@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+本地模拟的 S3 兼容对象存储
+支持 PUT/GET/DELETE 对象和分片上传 (初始化、上传分片、完成、取消)，不校验签名，数据保存在内存中
+用于代替 OSS/COS 测试 app/utils/storage.py
+
+用法:
+    python benchmarks/mock_s3_server.py --port 9000
+    然后在 config.ini 中设置 [storage] provider = s3, s3_endpoint = http://127.0.0.1:9000
+"""
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockS3Server:
+    """模拟 S3 兼容对象存储 (path-style)"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _parse(self):
+                parsed = urlparse(self.path)
+                key = unquote(parsed.path.lstrip('/'))
+                query = {k: v[0] for k, v in parse_qs(parsed.query, keep_blank_values=True).items()}
+                with server._lock:
+                    server.requests.append((self.command, key, sorted(query)))
+                return key, query
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _reply(self, status: int, body: bytes = b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_PUT(self):
+                key, query = self._parse()
+                data = self._body()
+                etag = f'"{hashlib.md5(data).hexdigest()}"'
+                with server._lock:
+                    if 'uploadId' in query:
+                        parts = server.uploads.get(query['uploadId'])
+                        if parts is None:
+                            return self._reply(404)
+                        parts[int(query['partNumber'])] = data
+                    else:
+                        server.objects[key] = data
+                self._reply(200, headers={'ETag': etag})
+
+            def do_POST(self):
+                key, query = self._parse()
+                self._body()
+                with server._lock:
+                    if 'uploads' in query:
+                        upload_id = uuid.uuid4().hex
+                        server.uploads[upload_id] = {}
+                        body = (f'<InitiateMultipartUploadResult><Bucket>b</Bucket><Key>{key}</Key>'
+                                f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+                        return self._reply(200, body.encode('utf-8'))
+                    parts = server.uploads.pop(query.get('uploadId'), None)
+                    if parts is None:
+                        return self._reply(404)
+                    server.objects[key] = b''.join(parts[n] for n in sorted(parts))
+                self._reply(200, b'<CompleteMultipartUploadResult/>')
+
+            def do_GET(self):
+                key, _ = self._parse()
+                with server._lock:
+                    data = server.objects.get(key)
+                if data is None:
+                    return self._reply(404)
+                self._reply(200, data)
+
+            def do_DELETE(self):
+                key, query = self._parse()
+                with server._lock:
+                    if 'uploadId' in query:
+                        server.uploads.pop(query['uploadId'], None)
+                    else:
+                        server.objects.pop(key, None)
+                self._reply(204)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟 S3 兼容对象存储')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+
+    mock = MockS3Server(args.host, args.port).start()
+    print(f"模拟对象存储: {mock.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+本地模拟的语音合成服务 (百炼 CosyVoice WebSocket 协议)
+用于测试和基准测试，不访问真实的百炼平台
+
+模拟的合成行为：
+    握手前等待 handshake_ms 模拟 TLS + WebSocket 建连耗时；
+    收到 finish-task 后等待 first_chunk_ms 返回第一块音频，之后每 chunk_interval_ms 返回一块，
+    每个字 chunk_bytes_per_char 字节，最后返回 task-finished；同一连接上可以连续执行多个任务
+
+用法:
+    python benchmarks/mock_tts_server.py --port 8093
+    然后设置 dashscope.base_websocket_api_url = ws://127.0.0.1:8093/tts
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_asr_server import _WebSocket
+
+
+class MockTTSServer:
+    """模拟语音合成服务"""
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 handshake_ms: float = 80,
+                 first_chunk_ms: float = 60,
+                 chunk_interval_ms: float = 20,
+                 chunk_bytes: int = 4096,
+                 chunk_bytes_per_char: int = 800):
+        self.handshake_ms = handshake_ms
+        self.first_chunk_ms = first_chunk_ms
+        self.chunk_interval_ms = chunk_interval_ms
+        self.chunk_bytes = chunk_bytes
+        self.chunk_bytes_per_char = chunk_bytes_per_char
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.tasks = 0
+        self._server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}/tts"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def audio_for(self, text: str) -> bytes:
+        """按文本长度生成的模拟音频 (内容可预测，便于校验)"""
+        size = max(1, len(text)) * self.chunk_bytes_per_char
+        pattern = text.encode('utf-8') or b'-'
+        return (pattern * (size // len(pattern) + 1))[:size]
+
+    def _synthesize(self, ws: _WebSocket, task_id: str, text: str):
+        audio = self.audio_for(text)
+        time.sleep(self.first_chunk_ms / 1000)
+        for offset in range(0, len(audio), self.chunk_bytes):
+            if offset:
+                time.sleep(self.chunk_interval_ms / 1000)
+            ws.send_bytes(audio[offset:offset + self.chunk_bytes])
+        ws.send(json.dumps({'header': {'event': 'task-finished', 'task_id': task_id}, 'payload': {}}))
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                time.sleep(server.handshake_ms / 1000)
+                ws = _WebSocket(self.rfile, self.wfile)
+                if not ws.handshake():
+                    return
+                with server.lock:
+                    server.connections += 1
+                task_id, texts = None, []
+                while True:
+                    message = ws.receive()
+                    if message is None:
+                        return
+                    data = json.loads(message)
+                    header = data.get('header') or {}
+                    action = header.get('action')
+                    if action == 'run-task':
+                        task_id, texts = header.get('task_id'), []
+                        text = ((data.get('payload') or {}).get('input') or {}).get('text')
+                        if text:
+                            texts.append(text)
+                        with server.lock:
+                            server.tasks += 1
+                        ws.send(json.dumps({'header': {'event': 'task-started', 'task_id': task_id}, 'payload': {}}))
+                    elif action == 'continue-task':
+                        texts.append(((data.get('payload') or {}).get('input') or {}).get('text', ''))
+                    elif action == 'finish-task':
+                        server._synthesize(ws, task_id, ''.join(texts))
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟语音合成服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8093)
+    parser.add_argument('--handshake-ms', type=float, default=80)
+    parser.add_argument('--first-chunk-ms', type=float, default=60)
+    args = parser.parse_args()
+
+    mock = MockTTSServer(args.host, args.port, handshake_ms=args.handshake_ms,
+                         first_chunk_ms=args.first_chunk_ms).start()
+    print(f"模拟语音合成服务: {mock.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
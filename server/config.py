@@ -9,6 +9,9 @@ load_dotenv()
 config_ini = configparser.ConfigParser()
 config_ini.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
 
+# 未设置环境变量 SECRET_KEY 时使用的默认值 (已公开在代码库中，生产环境必须替换)
+DEFAULT_SECRET_KEY = 'echotalk-secret-key-change-me'
+
 
 def get_ini_value(section, key, default=None, value_type=str):
     """从ini文件读取配置值"""
@@ -35,7 +38,7 @@ class Config:
     # 1. Flask 基础配置
     # ============================================================
     # 敏感：SECRET_KEY 从环境变量读取
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'echotalk-secret-key-change-me'
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
     # 不敏感：从config.ini读取
     DEBUG = get_ini_value('flask', 'debug', False, bool)
     PORT = get_ini_value('flask', 'port', 5050, int)
@@ -89,15 +92,35 @@ class Config:
     CHAT_TEMPERATURE = get_ini_value('ai', 'chat_temperature', 0.7, float)
     CHAT_MAX_TOKENS = get_ini_value('ai', 'chat_max_tokens', 2000, int)
     CHAT_TIMEOUT = get_ini_value('ai', 'chat_timeout', 30, int)
+    # 追问生成的 prompt token 预算 (还受模型上下文窗口与 chat_max_tokens 限制)
+    FOLLOWUP_PROMPT_TOKENS = get_ini_value('ai', 'followup_prompt_tokens', 1500, int)
+    # 上下文缓存：explicit 为固定 system 前缀添加 cache_control 标记，implicit 只依赖服务端隐式缓存
+    PROMPT_CACHE_MODE = get_ini_value('ai', 'prompt_cache', 'explicit')
+    PROMPT_CACHE_MIN_TOKENS = get_ini_value('ai', 'prompt_cache_min_tokens', 1024, int)
     # 语音识别配置
     ASR_MODEL = get_ini_value('ai', 'asr_model', 'paraformer-v2')
     ASR_FORMAT = get_ini_value('ai', 'asr_format', 'mp3')
     ASR_SAMPLE_RATE = get_ini_value('ai', 'asr_sample_rate', 16000, int)
+    ASR_TIMEOUT = get_ini_value('ai', 'asr_timeout', 60, int)
+    # 实时语音识别：预热连接池大小、预热连接最长空闲时间(秒)、等待连接就绪的超时(秒)
+    ASR_REALTIME_URL = get_ini_value('ai', 'asr_realtime_url', 'wss://dashscope.aliyuncs.com/api-ws/v1/inference/asr/paraformer-realtime-v2')
+    ASR_POOL_SIZE = get_ini_value('ai', 'asr_pool_size', 2, int)
+    ASR_POOL_MAX_IDLE = get_ini_value('ai', 'asr_pool_max_idle', 15, int)
+    ASR_OPEN_TIMEOUT = get_ini_value('ai', 'asr_open_timeout', 5, int)
+    # 实时语音识别传输层 websocket / sdk，断线重连次数，重连后重放的音频时长(毫秒)，连接期间最多缓存的音频(毫秒)
+    ASR_REALTIME_TRANSPORT = get_ini_value('ai', 'asr_realtime_transport', 'websocket')
+    ASR_MAX_RECONNECTS = get_ini_value('ai', 'asr_max_reconnects', 2, int)
+    ASR_REPLAY_MS = get_ini_value('ai', 'asr_replay_ms', 3000, int)
+    ASR_BUFFER_MS = get_ini_value('ai', 'asr_buffer_ms', 10000, int)
     # 语音合成配置
     TTS_MODEL = get_ini_value('ai', 'tts_model', 'cosyvoice-v1')
     TTS_VOICE = get_ini_value('ai', 'tts_voice', 'longxiaochun')
     TTS_SPEED = get_ini_value('ai', 'tts_speed', 1.0, float)
     TTS_VOLUME = get_ini_value('ai', 'tts_volume', 50, int)
+    # 语音合成器复用：WebSocket 地址(为空使用 SDK 默认地址)、预先建立的连接数
+    TTS_WS_URL = get_ini_value('ai', 'tts_ws_url', '')
+    TTS_POOL_SIZE = get_ini_value('ai', 'tts_pool_size', 4, int)
+    TTS_TIMEOUT = get_ini_value('ai', 'tts_timeout', 30, int)
     # 敏感：API密钥从环境变量读取 (百炼平台统一使用一个API Key)
     ALIYUN_API_KEY = os.environ.get('ALIYUN_API_KEY') or 'your-aliyun-api-key'
 
@@ -110,11 +133,49 @@ class Config:
     OSS_ENDPOINT = get_ini_value('storage', 'oss_endpoint', 'oss-cn-hangzhou.aliyuncs.com')
     OSS_REGION = get_ini_value('storage', 'oss_region', 'cn-hangzhou')
     COS_REGION = get_ini_value('storage', 'cos_region', 'ap-guangzhou')
+    OSS_BUCKET = get_ini_value('storage', 'oss_bucket', '')
+    COS_BUCKET = get_ini_value('storage', 'cos_bucket', '')
+    # provider = s3 时使用的 S3 兼容服务 (如 benchmarks/mock_s3_server.py)
+    S3_ENDPOINT = get_ini_value('storage', 's3_endpoint', 'http://127.0.0.1:9000')
+    S3_BUCKET = get_ini_value('storage', 's3_bucket', 'echotalk')
+    S3_REGION = get_ini_value('storage', 's3_region', 'us-east-1')
+    S3_PATH_STYLE = get_ini_value('storage', 's3_path_style', True, bool)
+    # 对象的公开访问前缀 (如 CDN 地址)，为空时使用存储桶地址；本地存储为空时使用 public_base_url/uploads
+    STORAGE_PUBLIC_URL = get_ini_value('storage', 'public_url', '')
+    # 分片上传：分片大小(MB，不小于5)与并发分片数
+    STORAGE_PART_SIZE_MB = get_ini_value('storage', 'part_size_mb', 8, int)
+    STORAGE_CONCURRENCY = get_ini_value('storage', 'concurrency', 4, int)
+    # 签名URL：外部 (百炼识别服务) 可访问的站点地址，例如 https://example.com/echotalk
+    PUBLIC_BASE_URL = get_ini_value('storage', 'public_base_url', '')
+    SIGNED_URL_TTL = get_ini_value('storage', 'signed_url_ttl', 600, int)
+    # 语音识别直接使用本地签名URL，不再上传到百炼临时存储 (需要配置 public_base_url)
+    ASR_SIGNED_URL = get_ini_value('storage', 'asr_signed_url', False, bool)
+    # 识别前预处理的临时文件目录，使用签名URL时必须在上传目录下
+    ASR_TEMP_DIR = get_ini_value('storage', 'asr_temp_dir', os.path.join(LOCAL_STORAGE_PATH, 'tmp'))
+    # nginx internal location 前缀，设置后签名URL由 nginx 通过 X-Accel-Redirect 以 sendfile 返回文件
+    X_ACCEL_REDIRECT_PREFIX = get_ini_value('storage', 'x_accel_redirect_prefix', '')
+    # 语音合成结果目录
+    TTS_OUTPUT_DIR = get_ini_value('storage', 'tts_output_dir', os.path.join(LOCAL_STORAGE_PATH, 'tts'))
+    # 磁盘清理：保留期和配额 (0 表示不限制)，超过配额时按最近访问时间淘汰；每轮每个目录扫描 janitor_batch 个文件
+    JANITOR_ENABLED = get_ini_value('storage', 'janitor', True, bool)
+    JANITOR_INTERVAL = get_ini_value('storage', 'janitor_interval', 300, int)
+    JANITOR_BATCH = get_ini_value('storage', 'janitor_batch', 5000, int)
+    JANITOR_VOICE_RETENTION_DAYS = get_ini_value('storage', 'voice_retention_days', 0, int)
+    JANITOR_VOICE_QUOTA_MB = get_ini_value('storage', 'voice_quota_mb', 0, int)
+    JANITOR_TTS_RETENTION_HOURS = get_ini_value('storage', 'tts_retention_hours', 24, int)
+    JANITOR_TTS_QUOTA_MB = get_ini_value('storage', 'tts_quota_mb', 512, int)
+    JANITOR_TEMP_RETENTION_MINUTES = get_ini_value('storage', 'temp_retention_minutes', 60, int)
+    # 多个 worker 只由持有该锁文件的进程清理，为空时使用 local_path/.janitor.lock
+    JANITOR_LOCK_FILE = get_ini_value('storage', 'janitor_lock_file', '')
     # 敏感：密钥从环境变量读取
     OSS_ACCESS_KEY_ID = os.environ.get('OSS_ACCESS_KEY_ID') or 'your-oss-access-key-id'
     OSS_ACCESS_KEY_SECRET = os.environ.get('OSS_ACCESS_KEY_SECRET') or 'your-oss-access-key-secret'
     COS_SECRET_ID = os.environ.get('COS_SECRET_ID') or 'your-cos-secret-id'
     COS_SECRET_KEY = os.environ.get('COS_SECRET_KEY') or 'your-cos-secret-key'
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID') or 'your-s3-access-key-id'
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY') or 'your-s3-secret-access-key'
+    # 签名URL密钥，未设置时使用 SECRET_KEY；开启 asr_signed_url 时两者都是默认值则拒绝启动
+    MEDIA_SIGNING_KEY = os.environ.get('MEDIA_SIGNING_KEY')
 
     # ============================================================
     # 7. 语音录制配置 (已合并到AI配置中)
@@ -129,6 +190,25 @@ class Config:
     VOICE_FORMAT = get_ini_value('voice', 'format', 'mp3')
     VOICE_SAMPLE_RATE = get_ini_value('voice', 'sample_rate', 16000, int)
     VOICE_BITRATE = get_ini_value('voice', 'bitrate', 48000, int)
+    # 识别前的音频预处理：单声道、重采样到 ASR_SAMPLE_RATE、去首尾静音、Opus 编码 (需要 ffmpeg，否则只处理 WAV)
+    ASR_PREPROCESS = get_ini_value('voice', 'asr_preprocess', True, bool)
+    ASR_PREPROCESS_WORKERS = get_ini_value('voice', 'asr_preprocess_workers', 2, int)
+    ASR_PREPROCESS_BITRATE = get_ini_value('voice', 'asr_preprocess_bitrate', 24, int)
+    ASR_TRIM_SILENCE_DB = get_ini_value('voice', 'asr_trim_silence_db', -45, int)
+    FFMPEG_PATH = get_ini_value('voice', 'ffmpeg_path', 'ffmpeg')
+    # 实时对话话轮判定：句子结束后的宽限期(毫秒)；没有句子结束事件时识别结果多久不变视为说完(毫秒)
+    TURN_GRACE_MS = get_ini_value('voice', 'turn_grace_ms', 300, int)
+    TURN_SILENCE_MS = get_ini_value('voice', 'turn_silence_ms', 1500, int)
+    # 投机预取：识别文本稳定 speculate_stable_ms 毫秒后提前生成追问，话轮结束时文本一致则直接采用
+    SPECULATE_ENABLED = get_ini_value('voice', 'speculate', True, bool)
+    SPECULATE_STABLE_MS = get_ini_value('voice', 'speculate_stable_ms', 250, int)
+    SPECULATE_MIN_CHARS = get_ini_value('voice', 'speculate_min_chars', 4, int)
+    # 实时对话录音：按话轮编码保存用户音频，单段超过最长时长自动切段，等待保存的段数有上限
+    RECORD_REALTIME = get_ini_value('voice', 'record_realtime', True, bool)
+    RECORD_BITRATE = get_ini_value('voice', 'record_bitrate', 32, int)
+    RECORD_MAX_SEGMENT_SECONDS = get_ini_value('voice', 'record_max_segment_seconds', 60, int)
+    RECORD_MAX_PENDING = get_ini_value('voice', 'record_max_pending', 4, int)
+    RECORD_WORKERS = get_ini_value('voice', 'record_workers', 2, int)
 
     # ============================================================
     # 9. 业务逻辑配置
@@ -138,6 +218,12 @@ class Config:
     ARTICLE_MIN_MESSAGES = get_ini_value('business', 'article_min_messages', 3, int)
     ARTICLE_MAX_LENGTH = get_ini_value('business', 'article_max_length', 2000, int)
     ARTICLE_MIN_LENGTH = get_ini_value('business', 'article_min_length', 300, int)
+    # 长会话回忆录分层摘要：对话超过 memoir_prompt_tokens 时先分段摘要再合成
+    MEMOIR_PROMPT_TOKENS = get_ini_value('business', 'memoir_prompt_tokens', 6000, int)
+    MEMOIR_CHUNK_TOKENS = get_ini_value('business', 'memoir_chunk_tokens', 2000, int)
+    MEMOIR_MAX_WORKERS = get_ini_value('business', 'memoir_max_workers', 4, int)
+    # 最多摘要的层数，用完后仍超出长度时截断摘要
+    MEMOIR_MAX_LEVELS = get_ini_value('business', 'memoir_max_levels', 3, int)
 
     # ============================================================
     # 10. 日志配置
@@ -145,6 +231,14 @@ class Config:
     LOG_LEVEL = get_ini_value('log', 'level', 'INFO')
     LOG_FILE = get_ini_value('log', 'file', './logs/echotalk.log')
     LOG_FORMAT = get_ini_value('log', 'format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # 每条记录输出一行 JSON，关闭时按 LOG_FORMAT 输出文本
+    LOG_JSON = get_ini_value('log', 'json', True, bool)
+    # 按模块的级别，格式: 模块=级别, 模块=级别
+    LOG_LEVELS = get_ini_value('log', 'levels', 'pymongo=WARNING, urllib3=WARNING, websocket=WARNING, dashscope=WARNING')
+    # 高频事件 (音频帧等) 每个事件每秒最多输出的条数
+    LOG_RATE_LIMIT = get_ini_value('log', 'rate_limit', 1, float)
+    # 日志队列长度，写日志跟不上时丢弃新记录
+    LOG_QUEUE_SIZE = get_ini_value('log', 'queue_size', 10000, int)
 
     # ============================================================
     # 11. 安全配置
@@ -154,6 +248,97 @@ class Config:
     RATE_LIMIT_WINDOW = get_ini_value('security', 'rate_limit_window', 3600, int)
     MAX_CONTENT_LENGTH = get_ini_value('security', 'max_content_length', 16 * 1024 * 1024, int)
 
+    # ============================================================
+    # 12. 响应缓存配置
+    # ============================================================
+    # 追问回复缓存（默认关闭）：相同或相近的开场白直接复用之前的追问
+    FOLLOWUP_CACHE_ENABLED = get_ini_value('cache', 'followup_enabled', False, bool)
+    FOLLOWUP_CACHE_THRESHOLD = get_ini_value('cache', 'followup_threshold', 0.85, float)
+    FOLLOWUP_CACHE_TTL = get_ini_value('cache', 'followup_ttl', 3600, int)
+    FOLLOWUP_CACHE_MAX_SIZE = get_ini_value('cache', 'followup_max_size', 1000, int)
+    FOLLOWUP_CACHE_NGRAM = get_ini_value('cache', 'followup_ngram', 2, int)
+
+    # ============================================================
+    # 13. 大模型路由配置
+    # ============================================================
+    # 多目标路由（默认关闭）：对冲请求 + 按目标熔断，仅用于非流式对话
+    ROUTER_ENABLED = get_ini_value('router', 'enabled', False, bool)
+    ROUTER_TARGETS = get_ini_value('router', 'targets', '')
+    ROUTER_HEDGE_MIN_MS = get_ini_value('router', 'hedge_min_ms', 500, int)
+    ROUTER_HEDGE_MAX_MS = get_ini_value('router', 'hedge_max_ms', 5000, int)
+    ROUTER_HEDGE_DEFAULT_MS = get_ini_value('router', 'hedge_default_ms', 2000, int)
+    ROUTER_BREAKER_FAILURES = get_ini_value('router', 'breaker_failures', 5, int)
+    ROUTER_BREAKER_RESET = get_ini_value('router', 'breaker_reset', 30, int)
+
+    # ============================================================
+    # 14. 上游调用弹性配置
+    # ============================================================
+    # 每个 HTTP 请求 / 实时语音轮次的截止时间(秒)，所有上游调用的超时和重试都不超过它
+    REQUEST_DEADLINE = get_ini_value('resilience', 'request_deadline', 60, int)
+    RESILIENCE_MAX_ATTEMPTS = get_ini_value('resilience', 'max_attempts', 3, int)
+    RESILIENCE_BASE_DELAY_MS = get_ini_value('resilience', 'base_delay_ms', 200, int)
+    RESILIENCE_MAX_DELAY_MS = get_ini_value('resilience', 'max_delay_ms', 2000, int)
+    RESILIENCE_BREAKER_FAILURES = get_ini_value('resilience', 'breaker_failures', 5, int)
+    RESILIENCE_BREAKER_RESET = get_ini_value('resilience', 'breaker_reset', 30, int)
+
+    # ============================================================
+    # 15. 百炼平台配额限流配置
+    # ============================================================
+    # mongo: 多个 worker 共享配额（不可用时回退到 local）；local: 进程内限流
+    QUOTA_BACKEND = get_ini_value('quota', 'backend', 'mongo')
+    QUOTA_MAX_WAIT_MS = get_ini_value('quota', 'max_wait_ms', 5000, int)
+    QUOTA_LEASE_TTL = get_ini_value('quota', 'lease_ttl', 300, int)
+    # mongo 后端的连接和读写超时，超时后回退到 local，不会阻塞请求
+    QUOTA_MONGO_TIMEOUT_MS = get_ini_value('quota', 'mongo_timeout_ms', 200, int)
+    # 各接口的 QPS、令牌桶容量和最大并发，0 表示不限制
+    QUOTA_LIMITS = {
+        api: {
+            'qps': get_ini_value('quota', f'{api}_qps', 0, float),
+            'burst': get_ini_value('quota', f'{api}_burst', 0, float),
+            'concurrency': get_ini_value('quota', f'{api}_concurrency', 0, int),
+        }
+        for api in ('chat', 'asr', 'asr_realtime', 'tts')
+    }
+
+    # ============================================================
+    # 16. 监控指标配置
+    # ============================================================
+    # /metrics 以 Prometheus 文本格式输出指标
+    METRICS_ENABLED = get_ini_value('metrics', 'enabled', True, bool)
+    # 多 worker 部署时各进程写入指标的共享目录，为空时只输出处理请求的进程的指标
+    METRICS_DIR = get_ini_value('metrics', 'dir', '')
+    METRICS_FLUSH_INTERVAL = get_ini_value('metrics', 'flush_interval', 5, int)
+    # 设置后抓取 /metrics 需要 Authorization: Bearer <token>
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or ''
+
+    # ============================================================
+    # 17. 链路追踪配置
+    # ============================================================
+    TRACING_ENABLED = get_ini_value('tracing', 'enabled', True, bool)
+    TRACING_SERVICE_NAME = get_ini_value('tracing', 'service_name', 'echotalk')
+    # none: 只记录慢 trace / file: OTLP JSON 写入 TRACING_FILE / otlp: 发送到 OpenTelemetry 采集器
+    TRACING_EXPORTER = get_ini_value('tracing', 'exporter', 'none')
+    TRACING_OTLP_ENDPOINT = get_ini_value('tracing', 'otlp_endpoint', 'http://127.0.0.1:4318/v1/traces')
+    TRACING_FILE = get_ini_value('tracing', 'file', './logs/traces.jsonl')
+    # 头部采样率，慢 trace 不受采样率限制
+    TRACING_SAMPLE_RATE = get_ini_value('tracing', 'sample_rate', 0.01, float)
+    # 慢 trace 阈值(毫秒): HTTP 请求 / 实时对话话轮 (从用户最后一次识别结果到语音发送完毕)
+    TRACING_SLOW_MS = get_ini_value('tracing', 'slow_ms', 3000, int)
+    TRACING_SLOW_TURN_MS = get_ini_value('tracing', 'slow_turn_ms', 5000, int)
+    TRACING_SLOW_FILE = get_ini_value('tracing', 'slow_file', './logs/slow_traces.jsonl')
+
+    # ============================================================
+    # 18. 性能剖析配置
+    # ============================================================
+    # /admin/profile 采样剖析当前 worker，/admin/profile/blocking 检测阻塞 gevent 事件循环的协程
+    PROFILER_ENABLED = get_ini_value('profiler', 'enabled', True, bool)
+    PROFILER_MAX_SECONDS = get_ini_value('profiler', 'max_seconds', 60, int)
+    PROFILER_INTERVAL_MS = get_ini_value('profiler', 'interval_ms', 10, int)
+    PROFILER_BLOCKING_THRESHOLD_MS = get_ini_value('profiler', 'blocking_threshold_ms', 100, int)
+    PROFILER_BLOCKING_HISTORY = 50
+    # 启动时开启阻塞检测 (仅 gevent 服务器，run.py)
+    PROFILER_BLOCKING_MONITOR = get_ini_value('profiler', 'blocking_monitor', False, bool)
+
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
@@ -1,11 +1,13 @@
-from app import create_app, websocket_app
+from app import create_app, websocket_app, init_background_workers
 from config import get_config
+import logging
 import sys
 
 sys.stdout = sys.stderr
 
 config = get_config()
 app = create_app()
+logger = logging.getLogger('echotalk')
 
 class WSGIHandler:
     """
@@ -20,14 +22,13 @@ class WSGIHandler:
         if path.startswith('/ws/'):
             ws = environ.get('wsgi.websocket')
             if ws:
-                print(f"[WS] WebSocket请求: {path}", file=sys.stderr, flush=True)
+                logger.debug(f"[WS] WebSocket请求: {path}")
                 
                 if path.startswith('/ws/realtime/'):
                     parts = path.split('/')
                     if len(parts) >= 5:
                         session_id = parts[3]
                         open_id = parts[4]
-                        print(f"[WS] session_id={session_id}, open_id={open_id}", file=sys.stderr, flush=True)
                         
                         from app.routes.realtime import handle_websocket
                         with self.app.app_context():
@@ -37,23 +38,33 @@ class WSGIHandler:
         return self.app(environ, start_response)
 
 if __name__ == '__main__':
-    print(f"Starting EchoTalk Server...", flush=True)
-    print(f"Environment: {'development' if config.DEBUG else 'production'}", flush=True)
-    print(f"Host: {config.HOST}", flush=True)
-    print(f"Port: {config.PORT}", flush=True)
-    print(f"MySQL: {config.MYSQL_HOST}:{config.MYSQL_PORT}/{config.MYSQL_DB}", flush=True)
-    print(f"MongoDB: {config.MONGO_HOST}:{config.MONGO_PORT}/{config.MONGO_DB}", flush=True)
+    logger.info("Starting EchoTalk Server...")
+    logger.info(f"Environment: {'development' if config.DEBUG else 'production'}")
+    logger.info(f"Host: {config.HOST}")
+    logger.info(f"Port: {config.PORT}")
+    logger.info(f"MySQL: {config.MYSQL_HOST}:{config.MYSQL_PORT}/{config.MYSQL_DB}")
+    logger.info(f"MongoDB: {config.MONGO_HOST}:{config.MONGO_PORT}/{config.MONGO_DB}")
 
     from gevent.pywsgi import WSGIServer
     from geventwebsocket.handler import WebSocketHandler
     
+    # 识别连接预热、磁盘清理等后台线程在服务启动时就开始运行，不等第一个 HTTP 请求
+    init_background_workers(app.config)
+    
+    # 检测阻塞事件循环的协程 (同步的网络 / 数据库调用等)
+    if config.PROFILER_BLOCKING_MONITOR:
+        from app.utils.profiler import get_blocking_monitor
+        get_blocking_monitor(app.config).start()
+    
     handler = WSGIHandler(app)
     
     server = WSGIServer(
         (config.HOST, config.PORT),
         handler,
         handler_class=WebSocketHandler,
-        log=sys.stdout
+        # 访问日志和错误日志同样经过日志队列，不在请求的协程中同步写 stderr
+        log=logging.getLogger('gevent.access'),
+        error_log=logging.getLogger('gevent.error')
     )
-    print(f"WebSocket server running on ws://{config.HOST}:{config.PORT}", flush=True)
+    logger.info(f"WebSocket server running on ws://{config.HOST}:{config.PORT}")
     server.serve_forever()
@@ -0,0 +1,133 @@
+"""
+app.utils.sse 的单元测试
+    - SSEParser：随机生成事件、换行符 (LF / CRLF / CR) 和分块方式，与逐行解析的参考实现对比
+    - iter_sse_data：非分块传输的 gzip 响应体要先解压
+
+用法:
+    python -m pytest -q tests
+"""
+import io
+import os
+import sys
+import gzip
+import random
+import unittest
+
+import requests
+from urllib3.response import HTTPResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.sse import SSEParser, iter_sse_data
+
+
+def reference_parse(text: bytes) -> list:
+    """按 SSE 规范逐行解析 (与旧的 iter_lines 做法等价)，返回各事件的 data"""
+    lines = text.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+    events, data = [], None
+    for line in lines:
+        if not line:
+            if data is not None:
+                events.append(b'\n'.join(data))
+            data = None
+            continue
+        field, sep, value = line.partition(b':')
+        if field != b'data':
+            continue
+        if sep and value.startswith(b' '):
+            value = value[1:]
+        data = [value] if data is None else data + [value]
+    if data is not None:
+        events.append(b'\n'.join(data))
+    return events
+
+
+def random_stream(rng: random.Random) -> bytes:
+    """随机的事件流：单行 / 多行 data、注释、其它字段、空 data，随机换行符"""
+    newline = rng.choice([b'\n', b'\r\n', b'\r'])
+    values = [b'', b'[DONE]', b'{"a": 1}', '中文内容'.encode('utf-8'), b'x:y', b' leading']
+    blocks = []
+    for _ in range(rng.randint(0, 8)):
+        lines = []
+        for _ in range(rng.randint(1, 3)):
+            kind = rng.random()
+            if kind < 0.7:
+                lines.append(b'data' + rng.choice([b': ', b':']) + rng.choice(values))
+            elif kind < 0.8:
+                lines.append(b'data')
+            elif kind < 0.9:
+                lines.append(b': keep-alive')
+            else:
+                lines.append(b'event: message')
+        blocks.append(newline.join(lines))
+    if not blocks:
+        return b''
+    body = (newline * 2).join(blocks)
+    return body + rng.choice([b'', newline, newline * 2])
+
+
+def random_chunks(data: bytes, rng: random.Random) -> list:
+    chunks, i = [], 0
+    while i < len(data):
+        size = rng.randint(1, 8)
+        chunks.append(data[i:i + size])
+        i += size
+    return chunks
+
+
+class SSEParserTest(unittest.TestCase):
+
+    def parse(self, chunks) -> list:
+        parser = SSEParser()
+        events = []
+        for chunk in chunks:
+            events.extend(parser.feed(chunk))
+        events.extend(parser.flush())
+        return events
+
+    def test_single_line_events(self):
+        body = b'data: {"a": 1}\n\ndata: [DONE]\n\n'
+        self.assertEqual(self.parse([body]), [b'{"a": 1}', b'[DONE]'])
+
+    def test_multi_line_data(self):
+        self.assertEqual(self.parse([b'data: a\ndata: b\n\n']), [b'a\nb'])
+
+    def test_crlf_split_across_chunks(self):
+        self.assertEqual(self.parse([b'data: a\r', b'\n\r', b'\ndata: b\r\n\r\n']), [b'a', b'b'])
+
+    def test_missing_trailing_blank_line(self):
+        self.assertEqual(self.parse([b'data: a\n\ndata: b']), [b'a', b'b'])
+
+    def test_fuzz_against_reference(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            body = random_stream(rng)
+            expected = reference_parse(body)
+            self.assertEqual(self.parse([body]), expected, body)
+            self.assertEqual(self.parse(random_chunks(body, rng)), expected, body)
+
+
+class IterSSEDataTest(unittest.TestCase):
+
+    def make_response(self, body: bytes, headers: dict) -> requests.Response:
+        """与 requests 相同的方式包装响应体：decode_content=False，由读取方解压"""
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=200,
+                           preload_content=False, decode_content=False)
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = raw
+        return response
+
+    def test_plain_content_length(self):
+        body = b'data: a\n\ndata: b\n\n'
+        response = self.make_response(body, {'Content-Length': str(len(body))})
+        self.assertEqual(list(iter_sse_data(response)), [b'a', b'b'])
+
+    def test_gzip_content_length(self):
+        body = gzip.compress(b'data: a\n\ndata: b\n\n')
+        response = self.make_response(body, {'Content-Length': str(len(body)), 'Content-Encoding': 'gzip'})
+        self.assertEqual(list(iter_sse_data(response)), [b'a', b'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()